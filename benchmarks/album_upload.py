@@ -0,0 +1,100 @@
+"""Запросы к Bot API и к БД при загрузке альбома файлов.
+
+Обновления обрабатывает диспетчер бота, а ответы принимает локальный
+`fake_api.FakeBotAPI`. Сравнивается отправка файлов отдельными
+сообщениями (как раньше обрабатывался каждый файл альбома) и одним
+альбомом, файлы которого собираются вместе.
+Запуск: `python -m benchmarks.album_upload`
+"""
+import asyncio
+from itertools import count
+import os
+
+from benchmarks.fake_api import FakeBotAPI, TOKEN
+
+os.environ.setdefault("STAGE", "dev")
+os.environ.setdefault("BOT_TOKEN", TOKEN)
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+
+from benchmarks.utils import report  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import bot  # noqa: E402
+from filogram import db  # noqa: E402
+
+
+ALBUM_SIZES = (2, 5, 10)
+
+_ids = count(1)
+
+
+def create_document_update(user_id, media_group_id=None):
+    """Обновление с сообщением пользователя, содержащим файл"""
+    number = next(_ids)
+    message = {
+        "message_id": number,
+        "date": 0,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+        "document": {
+            "file_id": f"file_id{number}",
+            "file_unique_id": f"unique{number}",
+            "file_name": f"file{number}.txt",
+        },
+    }
+    if media_group_id is not None:
+        message["media_group_id"] = media_group_id
+
+    return types.Update.to_object({"update_id": number, "message": message})
+
+
+async def measure(dp, api, album_size, as_album):
+    """Запросы к API и к БД при загрузке `album_size` файлов"""
+    user_id = next(_ids)
+    media_group_id = f"album{user_id}" if as_album else None
+    updates = [
+        create_document_update(user_id, media_group_id)
+        for _ in range(album_size)
+    ]
+    statements = []
+    db.set_trace_callback(statements.append)
+    api.calls.clear()
+
+    if as_album:
+        # сообщения альбома приходят почти одновременно
+        await asyncio.gather(*map(dp.process_update, updates))
+    else:
+        # каждое обновление обрабатывается в своей задаче, как в aiogram
+        for update in updates:
+            await asyncio.create_task(dp.process_update(update))
+
+    db.set_trace_callback(None)
+    return {"api_calls": len(api.calls), "db_statements": len(statements)}
+
+
+async def main():
+    """Запуск бенчмарка"""
+    dp = app.create_app()
+    api = FakeBotAPI()
+    await api.start()
+    fake_bot = api.create_bot()
+    Bot.set_current(fake_bot)
+    Dispatcher.set_current(dp)
+    bot.albums.debounce = 0.05
+
+    results = {}
+    for album_size in ALBUM_SIZES:
+        results[f"{album_size}_files"] = {
+            "separate_messages": await measure(
+                dp, api, album_size, False
+            ),
+            "album": await measure(dp, api, album_size, True),
+        }
+
+    await (await fake_bot.get_session()).close()
+    await api.close()
+    report("album_upload", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
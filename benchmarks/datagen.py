@@ -0,0 +1,112 @@
+"""Синтетические данные для бенчмарков на большой БД.
+
+Как и в тестах (`tests/file_service_fixtures.py`), файлы создаются
+из уникальных телеграм-документов, пользователей и категорий, но
+распределение неравномерное, как у настоящих пользователей: немногие
+пользователи хранят большую часть файлов, а у каждого пользователя
+файлы сосредоточены в нескольких категориях. Количество файлов
+у пользователя и в категории распределено по закону Ципфа
+"""
+from array import array
+from itertools import accumulate, islice
+import random
+from typing import NamedTuple
+
+from filogram import db
+from filogram import queries
+from filogram.models import FileModel
+
+
+# показатели распределения Ципфа: чем больше, тем сильнее перекос
+USERS_SKEW = 1.1
+CATEGORIES_SKEW = 1.3
+MAX_CATEGORIES = 50
+# в среднем файлов на пользователя
+FILES_PER_USER = 20
+BATCH_SIZE = 100_000
+
+
+class Dataset(NamedTuple):
+    """Сгенерированные данные.
+
+    `owners[unique_id - 1]` - владелец файла с этим `unique_id`,
+    `files_per_user[user_id]` - количество файлов пользователя.
+    Чем меньше ID пользователя, тем больше у него в среднем файлов
+    """
+
+    files_count: int
+    users_count: int
+    owners: array
+    files_per_user: array
+
+
+def get_category(index):
+    """Название категории по её номеру (0 - самая популярная)"""
+    return f"category{index}"
+
+
+def zipf_cum_weights(count, skew):
+    """Накопленные веса распределения Ципфа для `count` значений"""
+    return list(accumulate(1 / rank**skew for rank in range(1, count + 1)))
+
+
+def generate_files(files_count, seed=0):
+    """Генерация файлов с перекошенным распределением.
+
+    Возвращаем итератор по файлам и список владельцев файлов по порядку
+    """
+    rng = random.Random(seed)
+    users_count = max(1, files_count // FILES_PER_USER)
+    owners = array(
+        "l",
+        (
+            user_index + 1
+            for user_index in rng.choices(
+                range(users_count),
+                cum_weights=zipf_cum_weights(users_count, USERS_SKEW),
+                k=files_count,
+            )
+        ),
+    )
+    category_indexes = rng.choices(
+        range(MAX_CATEGORIES),
+        cum_weights=zipf_cum_weights(MAX_CATEGORIES, CATEGORIES_SKEW),
+        k=files_count,
+    )
+
+    def files():
+        for number, owner_id in enumerate(owners):
+            category_index = category_indexes[number]
+            yield FileModel(
+                file_unique_id=f"unique{seed}-{number}",
+                file_id=f"file_id{number}",
+                owner_id=owner_id,
+                category=get_category(category_index),
+                file_name=f"file{number}.txt",
+            )
+
+    return (files(), owners, users_count)
+
+
+def fill_database(files_count, seed=0):
+    """Заполнение БД сгенерированными файлами.
+
+    Файлы добавляются в пустую БД (уже подключённую через
+    `filogram.app.init`) одной транзакцией, поэтому их `unique_id` идут
+    по порядку с 1
+    """
+    files, owners, users_count = generate_files(files_count, seed)
+    with db.get_cursor() as cursor:
+        while True:
+            batch = [
+                file.column_values() for file in islice(files, BATCH_SIZE)
+            ]
+            if not batch:
+                break
+            cursor.executemany(queries.INSERT_FILE.sql, batch)
+
+    files_per_user = array("l", [0]) * (users_count + 1)
+    for owner_id in owners:
+        files_per_user[owner_id] += 1
+
+    return Dataset(files_count, users_count, owners, files_per_user)
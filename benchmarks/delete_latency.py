@@ -0,0 +1,72 @@
+"""Задержка команды /d при конкурентных удалениях.
+
+Сравнивается прежнее удаление в два запроса (проверка доступа через
+`get_file` и отдельный DELETE) с удалением одним запросом в
+`file_service.delete_file`.
+Запуск: `python -m benchmarks.delete_latency`
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault("STAGE", "dev")
+
+from benchmarks.utils import report, summarize  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import db  # noqa: E402
+from filogram import file_service  # noqa: E402
+from filogram import queries  # noqa: E402
+
+
+FILES_COUNT = 5_000
+CONCURRENCY = 50
+
+
+def fill_db():
+    """Заполнение БД файлами одного пользователя"""
+    files = [
+        file_service.FileModel(str(i), f"file_id{i}", 0, "c", f"file{i}")
+        for i in range(FILES_COUNT)
+    ]
+    file_service.save_files(files)
+
+
+def two_step_delete(unique_id, user_id):
+    """Удаление файла с отдельным запросом для проверки доступа"""
+    file_service.get_file(unique_id, user_id)
+    db.delete(queries.DELETE_FILE, unique_id=unique_id, owner_id=user_id)
+
+
+async def measure(delete):
+    """Задержки удаления всех файлов при `CONCURRENCY` запросах"""
+    db.reset_connection()
+    fill_db()
+
+    unique_ids = iter(range(1, FILES_COUNT + 1))
+    durations = []
+
+    async def worker():
+        for unique_id in unique_ids:
+            started = time.perf_counter()
+            await db.run_write(delete, unique_id, 0)
+            durations.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - started
+
+    return {"ops_per_s": FILES_COUNT / elapsed, **summarize(durations)}
+
+
+async def main():
+    """Запуск бенчмарка"""
+    app.init()
+    results = {
+        "two_step": await measure(two_step_delete),
+        "single_statement": await measure(file_service.delete_file),
+    }
+    report("delete_latency", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
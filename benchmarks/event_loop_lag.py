@@ -0,0 +1,92 @@
+"""Задержка цикла событий при конкурентных запросах к БД.
+
+Сравнивается вызов синхронных функций `file_service` прямо в корутине
+(как это было в обработчиках бота) и их асинхронных версий.
+Запуск: `python -m benchmarks.event_loop_lag`
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault("STAGE", "dev")
+
+from benchmarks.utils import report, summarize  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import file_service  # noqa: E402
+
+
+FILES_COUNT = 20_000
+USERS_COUNT = 10
+CONCURRENT_REQUESTS = 200
+TICK = 0.001
+
+
+def fill_db():
+    """Заполнение БД файлами нескольких пользователей"""
+    for i in range(FILES_COUNT):
+        file = file_service.FileModel(
+            file_unique_id=str(i),
+            file_id=f"file_id{i}",
+            owner_id=i % USERS_COUNT,
+            category=f"category{i % 7}",
+            file_name=f"file{i}.txt",
+        )
+        file_service.save_file(file)
+
+
+async def measure_lag(load):
+    """Замер задержек цикла событий во время нагрузки `load`"""
+    lags = []
+    loaded = asyncio.Event()
+
+    async def ticker():
+        while not loaded.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - started - TICK)
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await load()
+    elapsed = time.perf_counter() - started
+    loaded.set()
+    await ticker_task
+
+    return {"elapsed_s": elapsed, "lag": summarize(lags)}
+
+
+async def sync_load():
+    """Синхронные запросы к БД прямо в корутинах"""
+
+    async def handler(user_id):
+        list(file_service.get_owned_files(user_id))
+
+    await asyncio.gather(
+        *(handler(i % USERS_COUNT) for i in range(CONCURRENT_REQUESTS))
+    )
+
+
+async def async_load():
+    """Запросы к БД через асинхронные функции `file_service`"""
+
+    async def handler(user_id):
+        list(await file_service.aget_owned_files(user_id))
+
+    await asyncio.gather(
+        *(handler(i % USERS_COUNT) for i in range(CONCURRENT_REQUESTS))
+    )
+
+
+async def main():
+    """Запуск бенчмарка"""
+    app.init()
+    fill_db()
+    results = {
+        "sync": await measure_lag(sync_load),
+        "async": await measure_lag(async_load),
+    }
+    report("event_loop_lag", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""Локальный сервер, отвечающий на запросы бота вместо Telegram Bot API.
+
+Сервер запоминает вызванные методы с их параметрами и отвечает
+на каждый запрос через `latency` секунд, как отвечал бы Telegram.
+Добавленные через `add_updates` обновления бот получает поллингом.
+Отдельным процессом: `python -m benchmarks.fake_api --port 8081`
+"""
+import argparse
+import asyncio
+from collections import deque
+from itertools import count, islice
+import json
+import time
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+
+TOKEN = "123456:fake-token"
+
+
+class FakeBotAPI:
+    """Сервер Bot API на свободном локальном порту.
+
+    Первые `flood_responses` запросов к чатам получают ответ 429
+    с `retry_after`, как при превышении ограничений Telegram
+    """
+
+    def __init__(self, latency=0.0, flood_responses=0, retry_after=1):
+        self.latency = latency
+        self.flood_responses = flood_responses
+        self.retry_after = retry_after
+        self.calls = []
+        self.updates = deque()
+        self.url = None
+        self._updates_added = asyncio.Event()
+        self._message_ids = count(1)
+        self._runner = None
+
+    async def start(self, port=0):
+        """Запуск сервера, по умолчанию на свободном порту"""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        (host, port) = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    async def close(self):
+        """Остановка сервера"""
+        await self._runner.cleanup()
+
+    def create_bot(self, bot_class=Bot, **kwargs):
+        """Бот класса `bot_class`, отправляющий запросы на этот сервер"""
+        server = TelegramAPIServer.from_base(self.url)
+        return bot_class(token=TOKEN, server=server, **kwargs)
+
+    def add_updates(self, updates):
+        """Добавление обновлений (словарей в формате Bot API)"""
+        self.updates.extend(updates)
+        self._updates_added.set()
+
+    def methods(self):
+        """Названия вызванных методов по порядку"""
+        return [method for (method, _) in self.calls]
+
+    async def _handle(self, request):
+        """Ответ на запрос к методу Bot API"""
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((method, params))
+        await asyncio.sleep(self.latency)
+        if method == "getUpdates":
+            return web.json_response(
+                {"ok": True, "result": await self._get_updates(params)}
+            )
+        if self.flood_responses and "chat_id" in params:
+            self.flood_responses -= 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+
+        return web.json_response(
+            {"ok": True, "result": self._result(method, params)}
+        )
+
+    def _result(self, method, params):
+        """Результат метода в формате Bot API"""
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Fake"}
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return self._message(params)
+        if method == "getWebhookInfo":
+            return {
+                "url": "",
+                "has_custom_certificate": False,
+                "pending_update_count": 0,
+            }
+        if method == "sendMediaGroup":
+            media = json.loads(params["media"])
+            return [self._message(params) for _ in media]
+
+        return True
+
+    async def _get_updates(self, params):
+        """Обновления начиная с `offset`, с ожиданием до `timeout` секунд"""
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = float(params.get("timeout", 0))
+        while True:
+            # как и Telegram, забываем подтверждённые обновления
+            while self.updates and self.updates[0]["update_id"] < offset:
+                self.updates.popleft()
+            if self.updates or timeout <= 0:
+                return list(islice(self.updates, limit))
+
+            self._updates_added.clear()
+            try:
+                await asyncio.wait_for(self._updates_added.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+    def _message(self, params):
+        """Отправленное ботом сообщение"""
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+
+async def serve(port, latency):
+    """Работа сервера на порту `port` до остановки процесса"""
+    api = FakeBotAPI(latency)
+    await api.start(port)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(serve(args.port, args.latency))
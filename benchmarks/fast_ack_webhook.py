@@ -0,0 +1,142 @@
+"""Время ответа вебхука с обработкой обновления и с быстрым подтверждением.
+
+Обновления обрабатывает диспетчер бота, а запросы к Bot API принимает
+локальный `fake_api.FakeBotAPI`, отвечающий с задержкой. На вебхук
+конкурентно отправляются команды "Получить категорию" (ответ отдельным
+запросом к API) и "Мои файлы" (ответ в ответе на вебхук). Кроме времени
+ответа вебхука измеряется время до отправки всех ответов пользователям.
+Запуск: `python -m benchmarks.fast_ack_webhook`
+"""
+import asyncio
+import os
+import time
+
+import aiohttp
+
+from benchmarks.fake_api import FakeBotAPI, TOKEN
+
+os.environ.setdefault("STAGE", "dev")
+os.environ.setdefault("BOT_TOKEN", TOKEN)
+
+from aiogram.dispatcher.webhook import (  # noqa: E402
+    BOT_DISPATCHER_KEY,
+    WebhookRequestHandler,
+)
+from aiohttp import web  # noqa: E402
+
+from benchmarks.utils import report, summarize  # noqa: E402
+from filogram import keyboards  # noqa: E402
+from filogram.app import create_app  # noqa: E402
+from filogram.send_scheduler import (  # noqa: E402
+    SchedulingBot,
+    SendScheduler,
+)
+from filogram.webhook import (  # noqa: E402
+    FastAckWebhookRequestHandler,
+    UPDATE_QUEUE_KEY,
+    UpdateQueue,
+)
+
+
+API_LATENCY = 0.2
+UPDATES_COUNT = 1000
+CONCURRENCY = 40  # как max_connections вебхука Telegram по умолчанию
+TEXTS = (keyboards.GET_CATEGORY_FILES, keyboards.MY_FILES)
+
+
+def create_update(number):
+    """Обновление с командой от пользователя"""
+    return {
+        "update_id": number,
+        "message": {
+            "message_id": number,
+            "date": 0,
+            "chat": {"id": number, "type": "private"},
+            "from": {"id": number, "is_bot": False, "first_name": "User"},
+            "text": TEXTS[number % len(TEXTS)],
+        },
+    }
+
+
+async def send_updates(url, first_number):
+    """Отправка обновлений на вебхук с ограниченной конкурентностью"""
+    durations = []
+    numbers = iter(range(first_number, first_number + UPDATES_COUNT))
+
+    async with aiohttp.ClientSession() as session:
+
+        async def client():
+            for number in numbers:
+                started = time.perf_counter()
+                async with session.post(url, json=create_update(number)) as r:
+                    r.raise_for_status()
+                durations.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+
+    return durations
+
+
+async def measure(dp, api, handler, first_number):
+    """Время ответа вебхука с обработчиком запросов `handler`"""
+    app = web.Application()
+    app[BOT_DISPATCHER_KEY] = dp
+    app.router.add_route("*", "/webhook", handler)
+    queue = UpdateQueue()
+    app[UPDATE_QUEUE_KEY] = queue
+    await queue.start(dp)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    (host, port) = runner.addresses[0][:2]
+
+    api.calls.clear()
+    started = time.perf_counter()
+    durations = await send_updates(
+        f"http://{host}:{port}/webhook", first_number
+    )
+    acknowledged = time.perf_counter() - started
+    await queue.close()
+    completed = time.perf_counter() - started
+    await runner.cleanup()
+
+    return {
+        "webhook_response": summarize(durations),
+        "all_acknowledged_s": acknowledged,
+        "all_processed_s": completed,
+        "api_calls": len(api.calls),
+        "queue": queue.stats(),
+    }
+
+
+async def main():
+    """Запуск бенчмарка"""
+    dp = create_app()
+    api = FakeBotAPI(API_LATENCY)
+    await api.start()
+    # ограничение Telegram на отправку здесь не измеряется
+    scheduler = SendScheduler(global_rate=1_000_000, global_burst=1_000_000)
+    fake_bot = api.create_bot(SchedulingBot, scheduler=scheduler)
+    dp.bot = fake_bot
+
+    results = {
+        "api_latency_s": API_LATENCY,
+        "updates": UPDATES_COUNT,
+        "concurrency": CONCURRENCY,
+        "process_then_respond": await measure(
+            dp, api, WebhookRequestHandler, 1
+        ),
+        "fast_ack": await measure(
+            dp, api, FastAckWebhookRequestHandler, UPDATES_COUNT + 1
+        ),
+    }
+
+    await (await fake_bot.get_session()).close()
+    await api.close()
+    report("fast_ack_webhook", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,481 @@
+"""Бенчмарки функций `file_service` на большой БД.
+
+БД во временной директории заполняется синтетическими файлами
+(`datagen`, по умолчанию 1 000 000) с продакшен-конфигом. Для каждой
+публичной функции `file_service` и для
+`templates.generate_grouped_files_text` измеряется время вызовов
+(p50/p99), количество вызовов в секунду и пик RSS процесса после
+вызовов. Аргументы выбираются так, как их передавали
+бы пользователи: чаще всего - от пользователей с большим количеством
+файлов. Отдельно измеряются вызовы для пользователя с наибольшим
+количеством файлов. Результаты в JSON можно сравнивать между коммитами.
+Запуск: `python -m benchmarks.file_service_suite [--rows N] [--output F]`
+"""
+import argparse
+import asyncio
+from functools import partial
+import os
+from pathlib import Path
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from benchmarks.utils import peak_rss_mb, report, summarize
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rows", type=int, default=1_000_000)
+parser.add_argument("--calls", type=int, default=200)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--only", help="только бенчмарки, содержащие строку")
+parser.add_argument("--output", type=Path, help="файл для результатов")
+
+# вызовов для самого активного пользователя меньше - они медленнее
+HEAVY_USER_CALLS = 20
+SAVE_BATCH_SIZE = 10
+
+
+def measure(func, arguments):
+    """Вызов `func` с каждым набором аргументов из `arguments`"""
+    if asyncio.iscoroutinefunction(func):
+        return asyncio.run(_measure_async(func, arguments))
+
+    durations = []
+    started = time.perf_counter()
+    for args in arguments:
+        call_started = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    return _summarize(durations, elapsed)
+
+
+async def _measure_async(func, arguments):
+    """Последовательный вызов асинхронной `func`"""
+    from filogram import file_service
+
+    durations = []
+    started = time.perf_counter()
+    for args in arguments:
+        call_started = time.perf_counter()
+        await func(*args)
+        durations.append(time.perf_counter() - call_started)
+    # отложенные записи должны выполниться в этом же цикле событий
+    await file_service.close_write_queue()
+    elapsed = time.perf_counter() - started
+
+    return _summarize(durations, elapsed)
+
+
+def _summarize(durations, elapsed):
+    """Сводка по вызовам"""
+    return {
+        **summarize(durations),
+        "ops_per_s": len(durations) / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+class Arguments:
+    """Аргументы вызовов, выбранные из сгенерированных данных"""
+
+    def __init__(self, dataset, calls, seed):
+        from filogram import file_service
+
+        self.dataset = dataset
+        self.calls = calls
+        self.rng = random.Random(seed)
+        self._new_files = 0
+        self._used_files = set()
+        self._deleted_owners = set()
+        self._deleted_categories = None
+        # пользователь с наибольшим количеством файлов
+        self.heavy_user = max(
+            range(1, dataset.users_count + 1),
+            key=dataset.files_per_user.__getitem__,
+        )
+        self.users = [self.active_user() for _ in range(calls)]
+        self.categories = {
+            user_id: file_service.get_user_categories(user_id)
+            for user_id in {*self.users, self.heavy_user}
+        }
+        file_service.categories_cache.clear()
+
+    def active_user(self):
+        """Пользователь, отправивший запрос.
+
+        Чем больше файлов у пользователя, тем чаще он пользуется ботом
+        """
+        return self.random_file()[1]
+
+    def random_file(self):
+        """ID случайного файла и его владельца"""
+        index = self.rng.randrange(self.dataset.files_count)
+        return (index + 1, self.dataset.owners[index])
+
+    def files(self):
+        """Существующие файлы, каждый - один раз"""
+        arguments = []
+        while len(arguments) < self.calls:
+            unique_id, owner_id = self.random_file()
+            if unique_id not in self._used_files:
+                self._used_files.add(unique_id)
+                arguments.append((unique_id, owner_id))
+        return arguments
+
+    def files_to_delete(self):
+        """Существующие файлы для удаления.
+
+        Категории их владельцев не удаляются, иначе файлы одной
+        из категорий могли бы уже закончиться
+        """
+        arguments = self.files()
+        self._deleted_owners.update(owner_id for _, owner_id in arguments)
+        return arguments
+
+    def user_ids(self):
+        """Пользователи запросов"""
+        return [(user_id,) for user_id in self.users]
+
+    def user_categories(self, user_ids=None):
+        """Пользователи запросов и одна из их категорий.
+
+        Популярные категории выбираются чаще
+        """
+        arguments = []
+        for user_id in user_ids or self.users:
+            categories = self.categories[user_id]
+            weights = [1 / rank for rank in range(1, len(categories) + 1)]
+            (category,) = self.rng.choices(categories, weights)
+            arguments.append((category, user_id))
+        return arguments
+
+    def categories_to_delete(self):
+        """Разные категории пользователей для удаления, каждая - один раз"""
+        if self._deleted_categories is None:
+            excluded = {self.heavy_user, *self._deleted_owners}
+            self._deleted_categories = [
+                (category, user_id)
+                for user_id, categories in self.categories.items()
+                if user_id not in excluded
+                for category in categories
+            ]
+            self.rng.shuffle(self._deleted_categories)
+
+        arguments = self._deleted_categories[: self.calls]
+        del self._deleted_categories[: self.calls]
+        return arguments
+
+    def new_files(self, count=1):
+        """Новые файлы пользователей запросов"""
+        from filogram.models import FileModel
+
+        arguments = []
+        for user_id in self.users:
+            files = []
+            for _ in range(count):
+                self._new_files += 1
+                files.append(
+                    FileModel(
+                        file_unique_id=f"new{self._new_files}",
+                        file_id=f"new_file_id{self._new_files}",
+                        owner_id=user_id,
+                        category=self.categories[user_id][0],
+                        file_name=f"new{self._new_files}.txt",
+                    )
+                )
+            arguments.append(files)
+        return arguments
+
+    def new_documents(self, count=1):
+        """Новые документы пользователей запросов с категорией"""
+        from filogram.models import PendingDocument
+
+        return [
+            (
+                [
+                    PendingDocument(f.file_unique_id, f.file_id, f.file_name)
+                    for f in files
+                ],
+                files[0].owner_id,
+                files[0].category,
+            )
+            for files in self.new_files(count)
+        ]
+
+
+def create_cases(arguments):
+    """Бенчмарки: название, функция и наборы аргументов её вызовов.
+
+    Аргументы выбираются при создании бенчмарков, до измерений.
+    Удаляющие бенчмарки - в конце, чтобы не влиять на остальные
+    """
+    from filogram import file_service as fs
+    from filogram import templates
+
+    heavy_user = arguments.heavy_user
+    heavy_calls = [(heavy_user,)] * HEAVY_USER_CALLS
+    heavy_files = fs.get_owned_files(heavy_user)
+    middle = heavy_files[len(heavy_files) // 2].unique_id
+    pages = [
+        fs.get_owned_files_page(user_id).files
+        for (user_id,) in arguments.user_ids()
+    ]
+    grouped_pages = [(fs.group_files_by_category(p),) for p in pages]
+    documents = [(docs[0], *rest) for docs, *rest in arguments.new_documents()]
+
+    def uncached(func):
+        def call(user_id):
+            fs.categories_cache.invalidate(user_id)
+            return func(user_id)
+
+        return call
+
+    async def aiter_all_chunks(category, user_id):
+        async for _ in fs.aiter_category_files_chunks(category, user_id):
+            pass
+
+    return [
+        ("get_file", fs.get_file, arguments.files()),
+        ("aget_file", fs.aget_file, arguments.files()),
+        ("get_owned_files", fs.get_owned_files, arguments.user_ids()),
+        ("get_owned_files.heavy_user", fs.get_owned_files, heavy_calls),
+        ("aget_owned_files", fs.aget_owned_files, arguments.user_ids()),
+        (
+            "get_owned_files_page.first",
+            fs.get_owned_files_page,
+            arguments.user_ids(),
+        ),
+        (
+            "get_owned_files_page.heavy_user_after",
+            partial(fs.get_owned_files_page, after=middle),
+            heavy_calls,
+        ),
+        (
+            "get_owned_files_page.heavy_user_before",
+            partial(fs.get_owned_files_page, before=middle),
+            heavy_calls,
+        ),
+        (
+            "aget_owned_files_page",
+            fs.aget_owned_files_page,
+            arguments.user_ids(),
+        ),
+        (
+            "get_user_categories.uncached",
+            uncached(fs.get_user_categories),
+            arguments.user_ids(),
+        ),
+        (
+            "get_user_categories.heavy_user_uncached",
+            uncached(fs.get_user_categories),
+            heavy_calls,
+        ),
+        (
+            "get_user_categories.cached",
+            fs.get_user_categories,
+            arguments.user_ids(),
+        ),
+        (
+            "aget_user_categories",
+            fs.aget_user_categories,
+            arguments.user_ids(),
+        ),
+        (
+            "group_files_by_category.page",
+            fs.group_files_by_category,
+            [(page,) for page in pages],
+        ),
+        (
+            "group_files_by_category.heavy_user",
+            fs.group_files_by_category,
+            [(heavy_files,)] * HEAVY_USER_CALLS,
+        ),
+        (
+            "generate_grouped_files_text.page",
+            templates.generate_grouped_files_text,
+            grouped_pages,
+        ),
+        (
+            "generate_grouped_files_text.heavy_user",
+            templates.generate_grouped_files_text,
+            [(fs.group_files_by_category(heavy_files),)] * HEAVY_USER_CALLS,
+        ),
+        (
+            "get_category_files",
+            fs.get_category_files,
+            arguments.user_categories(),
+        ),
+        (
+            "get_category_files.heavy_user",
+            fs.get_category_files,
+            arguments.user_categories([heavy_user] * HEAVY_USER_CALLS),
+        ),
+        (
+            "aget_category_files",
+            fs.aget_category_files,
+            arguments.user_categories(),
+        ),
+        (
+            "get_category_files_chunk",
+            fs.get_category_files_chunk,
+            arguments.user_categories(),
+        ),
+        (
+            "aiter_category_files_chunks",
+            aiter_all_chunks,
+            arguments.user_categories(),
+        ),
+        (
+            "count_category_files",
+            fs.count_category_files,
+            arguments.user_categories(),
+        ),
+        (
+            "count_category_files.heavy_user",
+            fs.count_category_files,
+            arguments.user_categories([heavy_user] * HEAVY_USER_CALLS),
+        ),
+        (
+            "acount_category_files",
+            fs.acount_category_files,
+            arguments.user_categories(),
+        ),
+        (
+            "save_file",
+            fs.save_file,
+            [(files[0],) for files in arguments.new_files()],
+        ),
+        (
+            "asave_file",
+            fs.asave_file,
+            [(files[0],) for files in arguments.new_files()],
+        ),
+        (
+            "save_files",
+            fs.save_files,
+            [(files,) for files in arguments.new_files(SAVE_BATCH_SIZE)],
+        ),
+        (
+            "asave_files",
+            fs.asave_files,
+            [(files,) for files in arguments.new_files(SAVE_BATCH_SIZE)],
+        ),
+        ("save_telegram_document", fs.save_telegram_document, documents),
+        (
+            "asave_telegram_document",
+            fs.asave_telegram_document,
+            [(docs[0], *rest) for docs, *rest in arguments.new_documents()],
+        ),
+        (
+            "save_telegram_documents",
+            fs.save_telegram_documents,
+            arguments.new_documents(SAVE_BATCH_SIZE),
+        ),
+        (
+            "asave_telegram_documents",
+            fs.asave_telegram_documents,
+            arguments.new_documents(SAVE_BATCH_SIZE),
+        ),
+        ("delete_file", fs.delete_file, arguments.files_to_delete()),
+        ("adelete_file", fs.adelete_file, arguments.files_to_delete()),
+        (
+            "delete_category_files",
+            fs.delete_category_files,
+            arguments.categories_to_delete(),
+        ),
+        (
+            "adelete_category_files",
+            fs.adelete_category_files,
+            arguments.categories_to_delete(),
+        ),
+    ]
+
+
+def get_commit():
+    """Текущий коммит репозитория, если он есть"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_database_size_mb(database_path):
+    """Размер БД в мегабайтах.
+
+    В режиме WAL записанные данные могут быть ещё в файле `-wal`, поэтому
+    сначала они переносятся в основной файл, а размер `-wal` (если его
+    не удалось опустошить) прибавляется
+    """
+    from filogram import db
+
+    db.writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    wal_path = database_path.with_name(f"{database_path.name}-wal")
+    size = database_path.stat().st_size
+    if wal_path.exists():
+        size += wal_path.stat().st_size
+    return size / 1024 / 1024
+
+
+def run(args, database_path):
+    """Заполнение БД и запуск бенчмарков"""
+    from benchmarks import datagen
+    from filogram import app
+
+    app.init("prod")
+    started = time.perf_counter()
+    dataset = datagen.fill_database(args.rows, args.seed)
+    generation_s = time.perf_counter() - started
+
+    arguments = Arguments(dataset, args.calls, args.seed)
+    results = {
+        "environment": {
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpu_count": os.cpu_count(),
+        },
+        "dataset": {
+            "files": dataset.files_count,
+            "users": dataset.users_count,
+            "heavy_user_files": dataset.files_per_user[arguments.heavy_user],
+            "seed": args.seed,
+            "generation_s": generation_s,
+            "db_size_mb": get_database_size_mb(database_path),
+            "peak_rss_mb": peak_rss_mb(),
+        },
+        "benchmarks": {},
+    }
+    for name, func, call_arguments in create_cases(arguments):
+        if args.only is None or args.only in name:
+            results["benchmarks"][name] = measure(func, call_arguments)
+
+    from filogram import db
+
+    db.close_connection()
+    return results
+
+
+def main():
+    """Запуск бенчмарков"""
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = Path(directory).joinpath("db.sqlite3")
+        # путь к БД читается при импорте конфига
+        os.environ["DATABASE_PATH"] = str(database_path)
+        results = run(args, database_path)
+
+    report("file_service_suite", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
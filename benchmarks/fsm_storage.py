@@ -0,0 +1,91 @@
+"""Хранилища состояний пользователей на 100 тысячах сессий.
+
+Сравниваются `MemoryStorage` из aiogram и `fsm_storage.SQLiteStorage`:
+каждая сессия - состояние загрузки файлов с одним документом в данных,
+как после отправки файла боту. Замеряются задержки записи и чтения,
+объём памяти Python-объектов и размер таблицы состояний в БД.
+Запуск: `python -m benchmarks.fsm_storage`
+"""
+import asyncio
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("STAGE", "dev")
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage  # noqa: E402
+
+from benchmarks.utils import report, summarize  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import db  # noqa: E402
+from filogram.fsm_storage import SQLiteStorage  # noqa: E402
+
+
+SESSIONS_COUNT = 100_000
+STATE = "UploadDocuments:handle_documents_or_category"
+DOCUMENT = {
+    "file_id": "BQACAgIAAxkBAAIBY2Q" + "x" * 50,
+    "file_unique_id": "AgADBAADxxx",
+    "file_name": "document.pdf",
+    "mime_type": "application/pdf",
+    "file_size": 123456,
+}
+
+
+async def measure(storage):
+    """Создание и чтение всех сессий в хранилище `storage`"""
+    write_durations = []
+    read_durations = []
+
+    tracemalloc.start()
+    for user in range(SESSIONS_COUNT):
+        started = time.perf_counter()
+        await storage.set_state(chat=user, user=user, state=STATE)
+        await storage.update_data(chat=user, user=user, documents=[DOCUMENT])
+        write_durations.append(time.perf_counter() - started)
+    (memory, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for user in range(SESSIONS_COUNT):
+        started = time.perf_counter()
+        await storage.get_state(chat=user, user=user)
+        await storage.get_data(chat=user, user=user)
+        read_durations.append(time.perf_counter() - started)
+
+    await storage.close()
+    await storage.wait_closed()
+    return {
+        "write": summarize(write_durations),
+        "read": summarize(read_durations),
+        "python_memory_mb": memory / 2**20,
+    }
+
+
+def table_size():
+    """Размер таблицы состояний и её индексов в БД"""
+    with db.get_read_cursor() as cursor:
+        (size,) = cursor.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name LIKE 'fsm_states%'"
+        ).fetchone()
+    return size
+
+
+async def main():
+    """Запуск бенчмарка"""
+    app.init()
+    memory_results = await measure(MemoryStorage())
+    sqlite_results = await measure(SQLiteStorage())
+    sqlite_results["db_size_mb"] = table_size() / 2**20
+
+    report(
+        "fsm_storage",
+        {
+            "sessions": SESSIONS_COUNT,
+            "memory_storage": memory_results,
+            "sqlite_storage": sqlite_results,
+        },
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Пропускная способность записи с общими транзакциями.
+
+Сравнивается сохранение файлов конкурентными пользователями с отдельной
+транзакцией на каждый файл и через очередь отложенной записи
+`db.WriteBehindQueue`. Используется БД в файле в режиме WAL, как
+в продакшене.
+Запуск: `python -m benchmarks.group_commit`
+"""
+import asyncio
+import os
+from pathlib import Path
+import tempfile
+import time
+
+os.environ.setdefault("STAGE", "dev")
+
+from benchmarks.utils import report, summarize  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import db  # noqa: E402
+from filogram import file_service  # noqa: E402
+from filogram.config import config  # noqa: E402
+
+
+USERS_COUNT = 200
+FILES_PER_USER = 25
+
+
+async def measure(write, database_path):
+    """Сохранение файлов всех пользователей функцией `write`"""
+    config.DATABASE_URL = database_path
+    db.reset_connection()
+    durations = []
+
+    async def user(user_id):
+        for i in range(FILES_PER_USER):
+            file = file_service.FileModel(
+                f"{user_id}-{i}", "file_id", user_id, "category", "name"
+            )
+            started = time.perf_counter()
+            await write(file_service.save_file, file)
+            durations.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(USERS_COUNT)))
+    elapsed = time.perf_counter() - started
+
+    return {"ops_per_s": len(durations) / elapsed, **summarize(durations)}
+
+
+async def main():
+    """Запуск бенчмарка"""
+    app.init()
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        write_queue = db.WriteBehindQueue(
+            config.WRITE_BEHIND_INTERVAL, config.WRITE_BEHIND_BATCH_SIZE
+        )
+
+        results = {
+            "transaction_per_write": await measure(
+                db.run_write, directory.joinpath("separate.sqlite3")
+            ),
+            "write_behind": await measure(
+                write_queue.submit, directory.joinpath("grouped.sqlite3")
+            ),
+        }
+        await write_queue.close()
+        results["write_behind"]["batches"] = write_queue.batches
+        db.close_connection()
+
+    report("group_commit", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,322 @@
+"""Нагрузочный тест бота: поток обновлений через диспетчер.
+
+Диспетчер из `filogram.app.create_app` получает синтетические обновления через
+очереди поллинга (`polling.ShardedUpdateRunner`), а запросы к Bot API
+принимает локальный `fake_api.FakeBotAPI`. БД во временной директории
+заполняется файлами из `datagen`, конфиг - продакшен.
+
+Обновления приходят с заданной частотой (в секунду, по Пуассону):
+- загрузка файла и через `--think-time` секунд выбор категории,
+- команда "Мои файлы",
+- команды /f<ID> и /d<ID> для файлов пользователя.
+
+Для каждого обработчика выводится время обработки (p50/p99), а также
+пропускная способность, задержка очередей и количество запросов
+к Bot API по методам.
+Запуск: `python -m benchmarks.load_test [--duration 30] [--uploads 20]`
+"""
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+from itertools import count
+import os
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from benchmarks.fake_api import FakeBotAPI, TOKEN
+from benchmarks.utils import peak_rss_mb, report, summarize
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--duration", type=float, default=30)
+parser.add_argument("--files", type=int, default=200_000)
+parser.add_argument("--uploads", type=float, default=10)
+parser.add_argument("--my-files", type=float, default=20)
+parser.add_argument("--get-file", type=float, default=20)
+parser.add_argument("--delete-file", type=float, default=5)
+parser.add_argument("--think-time", type=float, default=0.5)
+parser.add_argument("--api-latency", type=float, default=0.03)
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument(
+    "--telegram-limits",
+    action="store_true",
+    help="ограничивать отправку как Telegram (по умолчанию без ограничений)",
+)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output", type=Path, help="файл для результатов")
+
+
+class HandlerTimer(BaseMiddleware):
+    """Время работы обработчиков сообщений и нажатий кнопок"""
+
+    def __init__(self):
+        super().__init__()
+        self.durations = defaultdict(list)
+
+    async def on_process_message(self, message, data):
+        """Начало обработки сообщения"""
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        """Конец обработки сообщения"""
+        self._stop(data)
+
+    async def on_process_callback_query(self, call, data):
+        """Начало обработки нажатия на кнопку"""
+        self._start(data)
+
+    async def on_post_process_callback_query(self, call, results, data):
+        """Конец обработки нажатия на кнопку"""
+        self._stop(data)
+
+    def _start(self, data):
+        data["timer"] = (current_handler.get().__name__, time.perf_counter())
+
+    def _stop(self, data):
+        if "timer" in data:
+            handler, started = data["timer"]
+            self.durations[handler].append(time.perf_counter() - started)
+
+
+class UpdateFactory:
+    """Обновления от пользователей из сгенерированных данных"""
+
+    def __init__(self, dataset, seed):
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self._ids = count(1)
+
+    def active_user(self):
+        """Пользователь, чаще - с большим количеством файлов"""
+        return self.random_file()[1]
+
+    def random_file(self):
+        """ID случайного файла и его владельца"""
+        index = self.rng.randrange(self.dataset.files_count)
+        return (index + 1, self.dataset.owners[index])
+
+    def message(self, user_id, **fields):
+        """Обновление с сообщением пользователя"""
+        from aiogram import types
+
+        number = next(self._ids)
+        message = {
+            "message_id": number,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            **fields,
+        }
+        return types.Update(update_id=number, message=message)
+
+    def document(self, user_id):
+        """Сообщение с новым файлом"""
+        number = next(self._ids)
+        return self.message(
+            user_id,
+            document={
+                "file_id": f"load_file_id{number}",
+                "file_unique_id": f"load{number}",
+                "file_name": f"load{number}.txt",
+            },
+        )
+
+    def category_selection(self, user_id):
+        """Нажатие на кнопку с одной из популярных категорий"""
+        from aiogram import types
+
+        from benchmarks import datagen
+
+        number = next(self._ids)
+        (category_index,) = self.rng.choices(
+            range(datagen.MAX_CATEGORIES),
+            cum_weights=datagen.zipf_cum_weights(
+                datagen.MAX_CATEGORIES, datagen.CATEGORIES_SKEW
+            ),
+        )
+        user = {"id": user_id, "is_bot": False, "first_name": "User"}
+        callback_query = {
+            "id": str(number),
+            "from": user,
+            "chat_instance": str(user_id),
+            "message": {
+                "message_id": number,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "Выберите категорию",
+            },
+            "data": datagen.get_category(category_index),
+        }
+        return types.Update(update_id=number, callback_query=callback_query)
+
+    def my_files(self, user_id):
+        """Нажатие на кнопку «Мои файлы»"""
+        from filogram import keyboards
+
+        return self.message(user_id, text=keyboards.MY_FILES)
+
+    def file_command(self, command):
+        """Команда `command` (f или d) с файлом пользователя"""
+        unique_id, user_id = self.random_file()
+        return self.message(
+            user_id,
+            text=f"/{command}{unique_id}",
+            entities=[
+                {
+                    "type": "bot_command",
+                    "offset": 0,
+                    "length": len(str(unique_id)) + 2,
+                }
+            ],
+        )
+
+
+async def generate(rate, duration, rng, send):
+    """Вызов `send` с частотой `rate` в секунду в течение `duration`"""
+    if rate <= 0:
+        return
+
+    deadline = time.perf_counter() + duration
+    while True:
+        await asyncio.sleep(rng.expovariate(rate))
+        if time.perf_counter() >= deadline:
+            return
+        await send()
+
+
+async def run_load(args, dataset):
+    """Поток обновлений через диспетчер бота"""
+    from aiogram import Bot, Dispatcher
+
+    from filogram import file_service
+    from filogram.app import create_app
+    from filogram.polling import ShardedUpdateRunner
+    from filogram.send_scheduler import SchedulingBot, SendScheduler
+
+    api = FakeBotAPI(args.api_latency)
+    await api.start()
+    if args.telegram_limits:
+        scheduler = SendScheduler()
+    else:
+        scheduler = SendScheduler(
+            global_rate=1_000_000,
+            global_burst=1_000_000,
+            chat_rate=1_000_000,
+            chat_burst=1_000_000,
+        )
+    fake_bot = api.create_bot(SchedulingBot, scheduler=scheduler)
+    dp = create_app()
+    dp.bot = fake_bot
+    Bot.set_current(fake_bot)
+    Dispatcher.set_current(dp)
+    timer = HandlerTimer()
+    dp.middleware.setup(timer)
+
+    runner = ShardedUpdateRunner(dp, args.concurrency)
+    runner.start()
+    factory = UpdateFactory(dataset, args.seed)
+    sent = Counter()
+    uploading = set()  # пользователи, ещё не выбравшие категорию
+
+    async def put(kind, update):
+        sent[kind] += 1
+        await runner.put(update)
+
+    async def upload():
+        user_id = factory.active_user()
+        if user_id in uploading:
+            return
+        uploading.add(user_id)
+        await put("upload", factory.document(user_id))
+        asyncio.create_task(select_category(user_id))
+
+    async def select_category(user_id):
+        await asyncio.sleep(args.think_time)
+        await put("category_selection", factory.category_selection(user_id))
+        uploading.discard(user_id)
+
+    async def my_files():
+        await put("my_files", factory.my_files(factory.active_user()))
+
+    async def get_file():
+        await put("get_file", factory.file_command("f"))
+
+    async def delete_file():
+        await put("delete_file", factory.file_command("d"))
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    await asyncio.gather(
+        generate(args.uploads, args.duration, rng, upload),
+        generate(args.my_files, args.duration, rng, my_files),
+        generate(args.get_file, args.duration, rng, get_file),
+        generate(args.delete_file, args.duration, rng, delete_file),
+    )
+    await asyncio.sleep(args.think_time)  # последние выборы категорий
+    await runner.close()
+    await file_service.close_write_queue()
+    elapsed = time.perf_counter() - started
+
+    await (await fake_bot.get_session()).close()
+    await api.close()
+
+    stats = runner.stats()
+    processed = sum(shard["processed"] + shard["failed"] for shard in stats)
+    return {
+        "elapsed_s": elapsed,
+        "updates_sent": dict(sent),
+        "updates_per_s": processed / elapsed,
+        "failed_updates": sum(shard["failed"] for shard in stats),
+        "queue_lag_max_s": max(shard["lag_max"] for shard in stats),
+        "handlers": {
+            handler: summarize(durations)
+            for handler, durations in sorted(timer.durations.items())
+        },
+        "api_calls": dict(Counter(api.methods())),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run(args):
+    """Заполнение БД и запуск нагрузки"""
+    from benchmarks import datagen
+    from filogram import app
+    from filogram import db
+
+    app.init("prod")
+    dataset = datagen.fill_database(args.files, args.seed)
+    results = {
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key != "output"
+        },
+        "dataset": {
+            "files": dataset.files_count,
+            "users": dataset.users_count,
+        },
+        **asyncio.run(run_load(args, dataset)),
+    }
+    db.close_connection()
+    return results
+
+
+def main():
+    """Запуск нагрузочного теста"""
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        # путь к БД и токен читаются при импорте конфига
+        os.environ["DATABASE_PATH"] = str(Path(directory, "db.sqlite3"))
+        os.environ.setdefault("BOT_TOKEN", TOKEN)
+        results = run(args)
+
+    report("load_test", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Время отправки категории из 500 файлов альбомами.
+
+Бот отправляет запросы на локальный `fake_api.FakeBotAPI` с задержкой
+ответа, как у Telegram. Сравнивается поочерёдное чтение части файлов
+из БД и её отправка с `sending.send_category_files`, который выбирает
+следующие альбомы, пока отправляется текущий.
+Запуск: `python -m benchmarks.media_group_send`
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault("STAGE", "dev")
+
+from aiogram import Bot, types  # noqa: E402
+
+from benchmarks.fake_api import FakeBotAPI  # noqa: E402
+from benchmarks.utils import report  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import db  # noqa: E402
+from filogram import file_service  # noqa: E402
+from filogram import sending  # noqa: E402
+from filogram.config import config  # noqa: E402
+
+
+FILES_COUNT = 500
+API_LATENCY = 0.05
+USER_ID = 0
+CATEGORY = "books"
+
+
+def fill_db():
+    """Заполнение БД файлами одной категории"""
+    files = [
+        file_service.FileModel(
+            str(i), f"file_id{i}", USER_ID, CATEGORY, f"file{i}.txt"
+        )
+        for i in range(FILES_COUNT)
+    ]
+    file_service.save_files(files)
+
+
+async def send_sequentially(category, user_id, message):
+    """Чтение каждой части файлов и её отправка по очереди"""
+    after = 0
+    while True:
+        files = await db.run_read(
+            file_service.get_category_files_chunk, category, user_id, after
+        )
+        if not files:
+            return
+
+        await message.answer_media_group(sending.create_media_group(files))
+        after = files[-1].unique_id
+
+
+async def measure(send):
+    """Время отправки всех файлов категории функцией `send`"""
+    api = FakeBotAPI(API_LATENCY)
+    await api.start()
+    bot = api.create_bot()
+    Bot.set_current(bot)
+    message = types.Message.to_object(
+        {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}
+    )
+
+    started = time.perf_counter()
+    await send(CATEGORY, USER_ID, message)
+    elapsed = time.perf_counter() - started
+
+    await (await bot.get_session()).close()
+    await api.close()
+    return {
+        "total_s": elapsed,
+        "api_calls": len(api.calls),
+        "files_per_s": FILES_COUNT / elapsed,
+    }
+
+
+async def main():
+    """Запуск бенчмарка"""
+    app.init()
+    fill_db()
+    results = {
+        "files": FILES_COUNT,
+        "album_size": config.MEDIA_GROUP_SIZE,
+        "api_latency_s": API_LATENCY,
+        "sequential": await measure(send_sequentially),
+        "pipelined_with_progress": await measure(sending.send_category_files),
+    }
+    # те же запросы к API, что и при поочерёдной отправке
+    config.SEND_PROGRESS_MIN_FILES = FILES_COUNT
+    results["pipelined"] = await measure(sending.send_category_files)
+
+    report("media_group_send", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""Размер файлов, ожидающих сохранения, в данных состояния пользователя.
+
+Сравниваются документы aiogram целиком (с превью и вложенными объектами)
+и компактные `models.PendingDocument` для сессий с сотнями файлов.
+Замеряются байты на один файл в памяти процесса и в JSON, в котором
+данные состояний хранит `fsm_storage.SQLiteStorage`.
+Запуск: `python -m benchmarks.pending_documents`
+"""
+import json
+import os
+import tracemalloc
+
+os.environ.setdefault("STAGE", "dev")
+
+from aiogram import types  # noqa: E402
+
+from benchmarks.utils import report  # noqa: E402
+from filogram.models import PendingDocument  # noqa: E402
+
+
+SESSIONS_COUNT = 20
+DOCUMENTS_PER_SESSION = 500
+
+
+def create_telegram_document(number):
+    """Документ в том виде, в котором его присылает Telegram"""
+    return types.Document.to_object(
+        {
+            "file_id": f"BQACAgIAAxkBAAIBY2Q{number:0>40}",
+            "file_unique_id": f"AgADBAAD{number:0>8}",
+            "file_name": f"document{number}.pdf",
+            "mime_type": "application/pdf",
+            "file_size": 123456,
+            "thumb": {
+                "file_id": f"AAMCAgADGQEAAgFjZ{number:0>40}",
+                "file_unique_id": f"AQADBAAD{number:0>8}",
+                "file_size": 2345,
+                "width": 320,
+                "height": 240,
+            },
+        }
+    )
+
+
+def measure(convert, serialize):
+    """Байты на один файл для документов, преобразованных `convert`.
+
+    `serialize` приводит сохранённый документ к значению для JSON
+    """
+    telegram_documents = [
+        [
+            create_telegram_document(session * DOCUMENTS_PER_SESSION + i)
+            for i in range(DOCUMENTS_PER_SESSION)
+        ]
+        for session in range(SESSIONS_COUNT)
+    ]
+    documents_count = SESSIONS_COUNT * DOCUMENTS_PER_SESSION
+
+    tracemalloc.start()
+    sessions = [
+        {"documents": [convert(document) for document in documents]}
+        for documents in telegram_documents
+    ]
+    (memory, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    json_size = sum(
+        len(json.dumps(documents, ensure_ascii=False).encode())
+        for documents in (
+            [serialize(document) for document in session["documents"]]
+            for session in sessions
+        )
+    )
+    return {
+        "memory_bytes_per_file": memory / documents_count,
+        "json_bytes_per_file": json_size / documents_count,
+    }
+
+
+def main():
+    """Запуск бенчмарка"""
+    report(
+        "pending_documents",
+        {
+            "documents_per_session": DOCUMENTS_PER_SESSION,
+            # копия документа, как в прежнем хранении целых документов
+            "telegram_document": measure(
+                lambda document: types.Document.to_object(
+                    document.to_python()
+                ),
+                types.Document.to_python,
+            ),
+            "pending_document": measure(
+                PendingDocument.from_telegram_document, tuple
+            ),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Накладные расходы на один запрос к БД.
+
+Сравнивается сборка текста запроса при каждом вызове (как это было
+в `db.fetchone`/`db.fetchall`) и выполнение запросов из `queries`.
+Таблица маленькая, поэтому время вызова - в основном накладные расходы.
+Профилирование запросов (выборка, лог медленных запросов и обработчик
+прогресса sqlite) отключено, как и в обычной работе без него.
+Запуск: `python -m benchmarks.query_overhead`
+"""
+import os
+import time
+
+os.environ.setdefault("STAGE", "dev")
+
+from benchmarks.utils import report  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import db  # noqa: E402
+from filogram import file_service  # noqa: E402
+from filogram import queries  # noqa: E402
+from filogram.config import config  # noqa: E402
+
+
+CALLS = 50_000
+COLUMNS = file_service.FileModel.db_columns()
+
+
+def dynamic_fetchone(**conditions):
+    """Запрос с текстом, собираемым при каждом вызове"""
+    columns = ",".join(COLUMNS)
+    condition_query = " AND ".join(f"{key} = ?" for key in conditions)
+    condition_values = tuple(conditions.values())
+
+    with db.get_read_cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT {columns}
+            FROM files
+            WHERE {condition_query}
+            """,
+            condition_values,
+        )
+        return cursor.fetchone()
+
+
+def registry_fetchone(**params):
+    """Запрос из реестра `queries`"""
+    return db.fetchone(queries.FILE, **params)
+
+
+def measure(fetchone):
+    """Среднее время одного вызова в микросекундах"""
+    started = time.perf_counter()
+    for i in range(CALLS):
+        fetchone(unique_id=i % 10 + 1, owner_id=0)
+
+    return (time.perf_counter() - started) / CALLS * 1_000_000
+
+
+def main():
+    """Запуск бенчмарка"""
+    config.SLOW_QUERY_THRESHOLD = None
+    config.QUERY_SAMPLE_RATE = 0
+    config.QUERY_PROGRESS_STEPS = None
+    app.init()
+    for i in range(10):
+        file = file_service.FileModel(str(i), f"file_id{i}", 0, "c", "name")
+        file_service.save_file(file)
+
+    results = {
+        "dynamic_us_per_call": measure(dynamic_fetchone),
+        "registry_us_per_call": measure(registry_fetchone),
+    }
+    report("query_overhead", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Создание `FileModel` из строк БД на 100 тысячах строк.
+
+Сравнивается прежний путь (`sqlite3.Row` -> `dict(zip())` -> `FileModel`
+через ленивый `map`) и фабрика строк `FileModel.from_db_row`.
+Замеряются время и пиковый объём выделенной памяти.
+Запуск: `python -m benchmarks.row_factory`
+"""
+import os
+import sqlite3
+import time
+import tracemalloc
+
+os.environ.setdefault("STAGE", "dev")
+
+from benchmarks.utils import report  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import db  # noqa: E402
+from filogram import file_service  # noqa: E402
+from filogram import queries  # noqa: E402
+
+
+ROWS_COUNT = 100_000
+
+
+def fill_db():
+    """Заполнение БД файлами одного пользователя"""
+    files = [
+        file_service.FileModel(
+            str(i), f"file_id{i}", 0, f"category{i % 20}", f"file{i}.txt"
+        )
+        for i in range(ROWS_COUNT)
+    ]
+    file_service.save_files(files)
+
+
+def dict_zip_path():
+    """Прежнее создание моделей через словарь"""
+
+    def from_db_values(row):
+        named_values = dict(zip(row.keys(), row))
+        return file_service.FileModel(**named_values)
+
+    with db.get_read_cursor() as cursor:
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(queries.OWNED_FILES.sql, {"owner_id": 0})
+        values = cursor.fetchall()
+
+    return list(map(from_db_values, values))
+
+
+def row_factory_path():
+    """Создание моделей фабрикой строк"""
+    return file_service.get_owned_files(0)
+
+
+def measure(path):
+    """Время и пиковая память при выборке всех файлов"""
+    started = time.perf_counter()
+    files = path()
+    elapsed = time.perf_counter() - started
+    assert len(files) == ROWS_COUNT
+    del files
+
+    tracemalloc.start()
+    path()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"elapsed_s": elapsed, "peak_memory_mb": peak / 1024 / 1024}
+
+
+def main():
+    """Запуск бенчмарка"""
+    app.init()
+    fill_db()
+    results = {
+        "dict_zip": measure(dict_zip_path),
+        "row_factory": measure(row_factory_path),
+    }
+    report("row_factory", results)
+
+
+if __name__ == "__main__":
+    main()
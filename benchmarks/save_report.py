@@ -0,0 +1,92 @@
+"""Запросы к Bot API при повторной загрузке папки с файлами.
+
+Сравнивается прежний отчёт (сообщение на каждый уже сохранённый файл
+и итоговое сообщение) и один отчёт `bot.save_documents`. Запросы
+считает локальный `fake_api.FakeBotAPI`.
+Запуск: `python -m benchmarks.save_report`
+"""
+import asyncio
+import os
+
+from benchmarks.fake_api import FakeBotAPI, TOKEN
+
+os.environ.setdefault("STAGE", "dev")
+os.environ.setdefault("BOT_TOKEN", TOKEN)
+
+from aiogram import Bot, types  # noqa: E402
+
+from benchmarks.utils import report  # noqa: E402
+from filogram import app  # noqa: E402
+from filogram import bot  # noqa: E402
+from filogram import file_service  # noqa: E402
+from filogram.models import PendingDocument  # noqa: E402
+
+
+FILES_COUNT = 40
+USER_ID = 0
+
+
+async def send_report_per_file(documents, user_id, category, message):
+    """Прежний отчёт: сообщение на каждый уже сохранённый файл"""
+    results = await file_service.asave_telegram_documents(
+        documents, user_id, category
+    )
+    for result in results:
+        if not result.saved:
+            await message.answer(f"{result.file.file_name} уже сохранён")
+
+    if all(result.saved for result in results):
+        await message.answer("Все файлы сохранены!")
+    elif any(result.saved for result in results):
+        await message.answer("Остальные файлы сохранены!")
+    else:
+        await message.answer("Ни один файл не сохранён!")
+
+
+async def measure(save, saved_before):
+    """Количество запросов к API при загрузке папки функцией `save`.
+
+    `saved_before` файлов папки уже были сохранены ранее
+    """
+    prefix = f"{save.__name__}-{saved_before}-"
+    documents = [
+        PendingDocument(f"{prefix}{i}", f"file_id{i}", f"file{i}.txt")
+        for i in range(FILES_COUNT)
+    ]
+    await file_service.asave_telegram_documents(
+        documents[:saved_before], USER_ID, "folder"
+    )
+
+    api = FakeBotAPI()
+    await api.start()
+    fake_bot = api.create_bot()
+    Bot.set_current(fake_bot)
+    message = types.Message.to_object(
+        {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}
+    )
+    await save(documents, USER_ID, "folder", message)
+
+    await (await fake_bot.get_session()).close()
+    await api.close()
+    return len(api.calls)
+
+
+async def main():
+    """Запуск бенчмарка"""
+    app.init()
+    results = {"files": FILES_COUNT}
+    for saved_before in (0, FILES_COUNT // 2, FILES_COUNT):
+        results[f"{saved_before}_saved_before"] = {
+            "report_per_file_api_calls": await measure(
+                send_report_per_file, saved_before
+            ),
+            "single_report_api_calls": await measure(
+                bot.save_documents, saved_before
+            ),
+        }
+
+    report("save_report", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""Пропускная способность поллинга в зависимости от числа очередей.
+
+Обновления получает и обрабатывает диспетчер бота, а запросы к Bot API
+принимает локальный `fake_api.FakeBotAPI`, отвечающий с задержкой.
+Пользователи отправляют команды "Получить категорию" (ответ отдельным
+запросом к API) и "Мои файлы".
+Запуск: `python -m benchmarks.sharded_polling`
+"""
+import asyncio
+import os
+import time
+
+from benchmarks.fake_api import FakeBotAPI, TOKEN
+
+os.environ.setdefault("STAGE", "dev")
+os.environ.setdefault("BOT_TOKEN", TOKEN)
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+
+from benchmarks.utils import report  # noqa: E402
+from filogram.app import create_app  # noqa: E402
+from filogram import keyboards  # noqa: E402
+from filogram.polling import ShardedUpdateRunner  # noqa: E402
+from filogram.send_scheduler import (  # noqa: E402
+    SchedulingBot,
+    SendScheduler,
+)
+
+
+API_LATENCY = 0.05
+CONCURRENCY = (1, 4, 16, 64)
+UPDATES_COUNT = 1000
+USERS_COUNT = 500
+TEXTS = (keyboards.GET_CATEGORY_FILES, keyboards.MY_FILES)
+
+
+def create_update(number):
+    """Обновление с командой от пользователя"""
+    user_id = number % USERS_COUNT + 1
+    return {
+        "update_id": number,
+        "message": {
+            "message_id": number,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "text": TEXTS[number % len(TEXTS)],
+        },
+    }
+
+
+async def measure(dp, api, concurrency, first_number):
+    """Обработка обновлений в `concurrency` очередях"""
+    api.add_updates(
+        create_update(number)
+        for number in range(first_number, first_number + UPDATES_COUNT)
+    )
+    runner = ShardedUpdateRunner(dp, concurrency)
+    runner.start()
+
+    started = time.perf_counter()
+    polling = asyncio.create_task(runner.poll(timeout=1))
+    while api.updates:
+        await asyncio.sleep(0.01)
+    polling.cancel()
+    await runner.close()
+    elapsed = time.perf_counter() - started
+
+    stats = runner.stats()
+    return {
+        "updates_per_s": UPDATES_COUNT / elapsed,
+        "lag_max_s": max(shard["lag_max"] for shard in stats),
+        "lag_avg_s": (
+            sum(shard["lag_avg"] for shard in stats) / len(stats)
+        ),
+        "failed": sum(shard["failed"] for shard in stats),
+    }
+
+
+async def main():
+    """Запуск бенчмарка"""
+    dp = create_app()
+    api = FakeBotAPI(API_LATENCY)
+    await api.start()
+    # ограничение Telegram на отправку здесь не измеряется
+    scheduler = SendScheduler(
+        global_rate=1_000_000,
+        global_burst=1_000_000,
+        chat_rate=1_000_000,
+        chat_burst=1_000_000,
+    )
+    fake_bot = api.create_bot(SchedulingBot, scheduler=scheduler)
+    dp.bot = fake_bot
+    Bot.set_current(fake_bot)
+    Dispatcher.set_current(dp)
+
+    results = {
+        "api_latency_s": API_LATENCY,
+        "updates": UPDATES_COUNT,
+        "users": USERS_COUNT,
+    }
+    for number, concurrency in enumerate(CONCURRENCY):
+        results[f"concurrency_{concurrency}"] = await measure(
+            dp, api, concurrency, number * UPDATES_COUNT + 1
+        )
+
+    await (await fake_bot.get_session()).close()
+    await api.close()
+    report("sharded_polling", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
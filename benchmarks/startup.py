@@ -0,0 +1,184 @@
+"""Время запуска бота: импорт модулей и обработка первого обновления.
+
+Импорт измеряется через `python -X importtime` без переменной STAGE:
+модули бота при импорте ничего не инициализируют. Время до первого
+обновления измеряется так, как перезапускается процесс вебхука: в новом
+процессе с продакшен конфигом и БД во временной директории (при первом
+запуске БД создаётся) импортируется бот, вызывается
+`filogram.app.create_app` и обрабатывается команда "Мои файлы" (запросы
+к Bot API, если они будут, принимает `fake_api.FakeBotAPI`).
+Запуск: `python -m benchmarks.startup [--runs 10]`
+"""
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.utils import report, summarize
+
+
+MODULES = ("filogram.cli", "filogram.app", "filogram.bot")
+# сколько самых долгих импортов выводить
+SLOWEST_IMPORTS = 10
+PHASES = ("process_s", "import_s", "create_app_s", "first_update_s")
+MY_FILES = "Мои файлы"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--runs", type=int, default=10)
+parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+
+
+def parse_importtime(output):
+    """Время импорта модулей из вывода `-X importtime`.
+
+    Возвращаем словарь модуль -> (собственное время, время с вложенными
+    импортами) в секундах
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, module = line.split(":", 1)[1].split("|")
+        if not self_us.strip().isdigit():
+            continue  # заголовок
+        times[module.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return times
+
+
+def get_environment(**variables):
+    """Окружение нового процесса без STAGE"""
+    environment = {**os.environ, **variables}
+    environment.pop("STAGE", None)
+    return environment
+
+
+def measure_import(module, runs):
+    """Время импорта `module` в новом интерпретаторе"""
+    totals = []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            env=get_environment(),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times = parse_importtime(process.stderr)
+        totals.append(times[module][1])
+
+    slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)
+    return {
+        "import": summarize(totals),
+        "slowest_self_ms": {
+            name: self_time * 1000
+            for name, (self_time, _) in slowest[:SLOWEST_IMPORTS]
+        },
+    }
+
+
+def create_update():
+    """Обновление с командой «Мои файлы»"""
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "User"},
+            "text": MY_FILES,
+        },
+    }
+
+
+async def first_update():
+    """Запуск бота и обработка первого обновления (в новом процессе)"""
+    started = time.perf_counter()
+    from aiogram import Bot, Dispatcher, types
+
+    from filogram import db
+    from filogram import file_service
+    from filogram.app import create_app
+
+    imported = time.perf_counter()
+    dp = create_app("prod")
+    created = time.perf_counter()
+
+    from benchmarks.fake_api import FakeBotAPI
+
+    api = FakeBotAPI()
+    await api.start()
+    fake_bot = api.create_bot()
+    dp.bot = fake_bot
+    Bot.set_current(fake_bot)
+    Dispatcher.set_current(dp)
+
+    update_started = time.perf_counter()
+    results = await dp.process_update(types.Update.to_object(create_update()))
+    processed = time.perf_counter()
+
+    await file_service.close_write_queue()
+    db.close_connection()
+    await (await fake_bot.get_session()).close()
+    await api.close()
+    return {
+        "import_s": imported - started,
+        "create_app_s": created - imported,
+        "first_update_s": processed - update_started,
+        "handled": bool(results),
+    }
+
+
+def measure_first_update(runs):
+    """Время до обработки первого обновления новым процессом"""
+    from benchmarks.fake_api import TOKEN
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        environment = get_environment(
+            DATABASE_PATH=str(Path(directory, "db.sqlite3")),
+            BOT_TOKEN=os.getenv("BOT_TOKEN", TOKEN),
+        )
+        for _ in range(runs):
+            started = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.startup", "--child"],
+                env=environment,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            elapsed = time.perf_counter() - started
+            result = json.loads(process.stdout.splitlines()[-1])
+            if not result["handled"]:
+                raise RuntimeError("Первое обновление не обработано")
+            results.append({**result, "process_s": elapsed})
+
+    return {
+        phase: summarize([result[phase] for result in results])
+        for phase in PHASES
+    }
+
+
+def main():
+    """Запуск бенчмарка"""
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(asyncio.run(first_update())))
+        return
+
+    results = {
+        "imports": {
+            module: measure_import(module, args.runs) for module in MODULES
+        },
+        "first_update": measure_first_update(args.runs),
+    }
+    report("startup", results)
+
+
+if __name__ == "__main__":
+    main()
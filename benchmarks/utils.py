@@ -0,0 +1,40 @@
+"""Общие функции для бенчмарков"""
+import json
+import resource
+import sys
+
+
+def percentile(values, percent):
+    """Значение перцентиля `percent` (от 0 до 100)"""
+    ordered = sorted(values)
+    index = round(percent / 100 * (len(ordered) - 1))
+    return ordered[index]
+
+
+def summarize(durations):
+    """Сводка по длительностям (в секундах) в миллисекундах"""
+    return {
+        "count": len(durations),
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def peak_rss_mb():
+    """Пик потребления памяти процессом (RSS) в мегабайтах"""
+    # в Linux значение в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(benchmark, results, output=None):
+    """Вывод результатов бенчмарка в формате JSON.
+
+    Если передан путь `output`, то результаты записываются и в файл
+    """
+    data = {"benchmark": benchmark, "results": results}
+    json.dump(data, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    if output is not None:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
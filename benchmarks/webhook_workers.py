@@ -0,0 +1,156 @@
+"""Пропускная способность вебхука в зависимости от количества процессов.
+
+Бот запускается через CLI (`--use webhook --workers N`) с продакшен
+конфигом и БД во временной директории, а запросы к Bot API принимает
+`fake_api` в отдельном процессе. На вебхук конкурентно отправляются
+обновления с командой "Мои файлы" от разных пользователей.
+Запуск: `python -m benchmarks.webhook_workers`
+"""
+import asyncio
+import os
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.fake_api import TOKEN
+from benchmarks.utils import report, summarize
+
+
+WORKERS = (1, 2, 4)
+UPDATES_COUNT = 3000
+CONCURRENCY = 50
+USERS_COUNT = 500
+MY_FILES = "Мои файлы"
+
+
+def get_free_port():
+    """Свободный локальный порт"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def create_update(number):
+    """Обновление с командой "Мои файлы" от пользователя"""
+    user_id = number % USERS_COUNT + 1
+    return {
+        "update_id": number,
+        "message": {
+            "message_id": number,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "text": MY_FILES,
+        },
+    }
+
+
+async def wait_webhook(session, url):
+    """Ожидание, пока вебхук начнёт принимать обновления"""
+    for _ in range(300):
+        try:
+            async with session.post(url, json=create_update(0)) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+
+    raise RuntimeError("Вебхук не запустился")
+
+
+async def send_updates(url):
+    """Отправка обновлений на вебхук с ограниченной конкурентностью"""
+    durations = []
+    numbers = iter(range(1, UPDATES_COUNT + 1))
+
+    async with aiohttp.ClientSession() as session:
+        await wait_webhook(session, url)
+
+        async def client():
+            for number in numbers:
+                started = time.perf_counter()
+                async with session.post(url, json=create_update(number)) as r:
+                    r.raise_for_status()
+                durations.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+        elapsed = time.perf_counter() - started
+
+    return {"updates_per_s": UPDATES_COUNT / elapsed, **summarize(durations)}
+
+
+def measure(workers, api_port, directory):
+    """Пропускная способность бота, запущенного в `workers` процессах"""
+    port = get_free_port()
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "BOT_API_URL": f"http://127.0.0.1:{api_port}",
+        "DATABASE_PATH": str(directory.joinpath(f"db{workers}.sqlite3")),
+        "SEND_GLOBAL_RATE": "1000000",
+        "WEBHOOK_PATH": "/webhook",
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}/webhook",
+        "WEBAPP_HOST": "127.0.0.1",
+        "WEBAPP_PORT": str(port),
+    }
+    command = [
+        sys.executable,
+        "-c",
+        "from filogram.cli import cli; cli()",
+        "--stage=prod",
+        "--use=webhook",
+        f"--workers={workers}",
+    ]
+    bot_process = subprocess.Popen(command, env=env)
+    try:
+        return asyncio.run(
+            send_updates(f"http://127.0.0.1:{port}/webhook")
+        )
+    finally:
+        bot_process.send_signal(signal.SIGTERM)
+        bot_process.wait(timeout=30)
+
+
+def main():
+    """Запуск бенчмарка"""
+    api_port = get_free_port()
+    api_command = [
+        sys.executable,
+        "-m",
+        "benchmarks.fake_api",
+        f"--port={api_port}",
+    ]
+    api_process = subprocess.Popen(api_command)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            results = {
+                f"{workers}_workers": measure(
+                    workers, api_port, Path(directory)
+                )
+                for workers in WORKERS
+            }
+    finally:
+        api_process.terminate()
+        api_process.wait()
+
+    report(
+        "webhook_workers",
+        {
+            "cpu_count": os.cpu_count(),
+            "updates": UPDATES_COUNT,
+            "concurrency": CONCURRENCY,
+            **results,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Сбор сообщений одного альбома"""
+import asyncio
+
+from .config import config
+
+
+class AlbumCollector:
+    """Сбор сообщений, отправленных одним альбомом.
+
+    Telegram присылает каждый файл альбома отдельным сообщением
+    с общим `media_group_id`. Обработчик первого сообщения ждёт, пока
+    в течение `debounce` секунд не перестанут приходить сообщения
+    альбома, и получает их все, а обработчики остальных сообщений -
+    `None`. Так альбом обрабатывается один раз.
+    По умолчанию `debounce` - `config.ALBUM_DEBOUNCE`
+    """
+
+    def __init__(self, debounce=None):
+        self.debounce = debounce
+        self._albums = {}
+
+    async def collect(self, message):
+        """Получение всех сообщений альбома, либо None.
+
+        Все сообщения (по порядку отправки) получает только обработчик
+        первого сообщения альбома, после того как альбом перестал
+        пополняться
+        """
+        messages = self._albums.get(message.media_group_id)
+        if messages is not None:
+            messages.append(message)
+            return None
+
+        debounce = self.debounce
+        if debounce is None:
+            debounce = config.ALBUM_DEBOUNCE
+
+        messages = [message]
+        self._albums[message.media_group_id] = messages
+        try:
+            received = 0
+            while received != len(messages):
+                received = len(messages)
+                await asyncio.sleep(debounce)
+        finally:
+            del self._albums[message.media_group_id]
+
+        # сообщения альбома могли быть обработаны не по порядку
+        return sorted(messages, key=lambda m: m.message_id)
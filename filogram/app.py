@@ -0,0 +1,41 @@
+"""Фабрика приложения.
+
+Импорт модулей бота ничего не инициализирует: конфиг, логгер, БД
+и диспетчер создаются здесь один раз и в этом порядке
+"""
+from . import db
+from . import file_service
+from .config import config
+from .logger import setup_logger
+
+
+# диспетчер, созданный `create_app`
+_dispatcher = None
+
+
+def init(stage=None):
+    """Инициализация всего, кроме диспетчера: конфиг, логгер и БД.
+
+    Конфиг выбирается для `stage` (по умолчанию - из переменной
+    окружения STAGE). Повторные вызовы ничего не делают
+    """
+    config.load(stage)
+    setup_logger()
+    db.connect()
+    file_service.init()
+
+
+def create_app(stage=None):
+    """Инициализация и создание диспетчера с обработчиками бота.
+
+    Повторные вызовы возвращают тот же диспетчер
+    """
+    global _dispatcher
+
+    if _dispatcher is None:
+        init(stage)
+        from .bot import create_dispatcher
+
+        _dispatcher = create_dispatcher()
+
+    return _dispatcher
@@ -1,33 +1,61 @@
-"""Инициализация бота"""
-from aiogram import Bot, Dispatcher
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.dispatcher.filters import RegexpCommandsFilter, Text as TextFilter
+"""Обработчики бота и создание диспетчера"""
+from aiogram import Dispatcher
+from aiogram.dispatcher.filters import (
+    MediaGroupFilter,
+    RegexpCommandsFilter,
+    Text as TextFilter,
+)
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types.input_media import MediaGroup, InputMediaDocument
+from aiogram.dispatcher.webhook import SendDocument, SendMessage
 from aiogram.types.message import ContentType, ParseMode
+from aiogram.utils.exceptions import RetryAfter
 
 from . import exceptions
 from . import file_service
 from . import keyboards
+from . import metrics
+from . import sending
 from . import templates
+from .albums import AlbumCollector
 from .config import config
-from .logger import logger
+from .fsm_storage import SQLiteStorage
+from .logger import (
+    RepeatedErrorLimiter,
+    UpdateLogContextMiddleware,
+    logger,
+)
+from .models import PendingDocument
+from .send_scheduler import SchedulingBot
 
 
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
+# сборщик альбомов и ограничение записи повторяющихся ошибок (чтобы
+# одинаковые ошибки, например при недоступной БД, не заваливали лог)
+# создаются вместе с диспетчером
+albums = None
+error_limiter = None
 
 
-@dp.message_handler(commands=["start"])
-async def send_welcome(message):
-    """Приветственное сообщение"""
-    await message.answer(
-        templates.START_MESSAGE,
-        reply_markup=keyboards.main_keyboard,
-        parse_mode=ParseMode.MARKDOWN,
+def create_dispatcher():
+    """Создание бота и диспетчера с обработчиками.
+
+    Используется фабрикой приложения `filogram.app.create_app`, когда
+    конфиг, логгер и БД уже инициализированы
+    """
+    global albums, error_limiter
+
+    albums = AlbumCollector()
+    error_limiter = RepeatedErrorLimiter(
+        config.LOG_ERRORS_INTERVAL, config.LOG_ERRORS_LOCATIONS
     )
 
+    bot = SchedulingBot(token=config.BOT_TOKEN)
+    metrics.register_send_scheduler(bot.scheduler)
+    dp = Dispatcher(bot, storage=SQLiteStorage())
+    dp.middleware.setup(metrics.MetricsMiddleware())
+    dp.middleware.setup(UpdateLogContextMiddleware())
+    register_handlers(dp)
+    return dp
+
 
 class UploadDocuments(StatesGroup):
     """Состояние пользователя при загрузке файлов.
@@ -40,21 +68,86 @@ class UploadDocuments(StatesGroup):
     handle_new_category = State()
 
 
-@dp.message_handler(content_types=ContentType.DOCUMENT)
-async def handle_document_message(message):
+async def handle_document_album(message, state):
+    """Обработка альбома файлов.
+
+    Файлы альбома приходят отдельными сообщениями, поэтому сначала
+    собираются вместе. На весь альбом отправляется одно сообщение:
+    выбор категории, либо подтверждение добавления к сохранению.
+    Состояние пользователя проверяется один раз на весь альбом, поэтому
+    обработчик регистрируется первым - до обработчиков с фильтром
+    состояния, которые проверяют его для каждого сообщения
+    """
+    messages = await albums.collect(message)
+    if messages is None:  # альбом обрабатывается с первым сообщением
+        return
+
+    documents = [
+        PendingDocument.from_telegram_document(m.document) for m in messages
+    ]
+    await add_documents(message, state, documents)
+
+
+async def send_welcome(message):
+    """Приветственное сообщение.
+
+    Здесь и в других обработчиках с единственным ответом ответ
+    возвращается, а не отправляется: через вебхук он уходит в ответе
+    на запрос Telegram, без отдельного запроса к Bot API
+    """
+    return SendMessage(
+        message.chat.id,
+        templates.START_MESSAGE,
+        reply_markup=keyboards.main_keyboard,
+        parse_mode=ParseMode.MARKDOWN,
+    )
+
+
+async def handle_document_message(message, state):
     """Обработка отправленного файла.
 
     Для загружаемого файла предлагается выбрать категорию из уже
     созданных пользователем, или создать новую
     """
-    await UploadDocuments.handle_documents_or_category.set()
-    state = Dispatcher.get_current().current_state()
-    await state.update_data(documents=[message.document])
+    document = PendingDocument.from_telegram_document(message.document)
+    await add_documents(message, state, [document])
 
-    user_id = message.from_user.id
-    categories = file_service.get_user_categories(user_id)
-    keyboard = keyboards.create_categories_keboard(categories)
-    await send_message_about_documents_save(message, keyboard)
+
+async def add_documents(message, state, documents):
+    """Добавление файлов к ожидающим сохранения с ответом пользователю.
+
+    Без состояния начинается загрузка с выбором категории, при загрузке
+    файлы добавляются к уже ожидающим, в остальных состояниях файлы
+    не принимаются. Количество ожидающих файлов ограничено. Состояние
+    проверяется и файлы добавляются в хранилище атомарно: большой
+    альбом Telegram делит на несколько, и они могут обрабатываться
+    одновременно. Возвращаем, добавлены ли файлы к начатой загрузке
+    """
+    upload_state = UploadDocuments.handle_documents_or_category.state
+    (previous_state, added) = await state.storage.add_to_list(
+        chat=state.chat,
+        user=state.user,
+        state=upload_state,
+        key="documents",
+        values=documents,
+        limit=config.MAX_PENDING_DOCUMENTS,
+    )
+    if previous_state not in (None, upload_state):
+        return False
+
+    if added < len(documents):
+        await send_message_about_too_many_documents(message)
+    if previous_state is None:
+        user_id = message.from_user.id
+        categories = await file_service.aget_user_categories(user_id)
+        keyboard = keyboards.create_categories_keboard(categories)
+        await send_message_about_documents_save(message, keyboard)
+        return False
+    if added < len(documents):
+        return False
+
+    await message.answer("Добавлено к сохранению!")
+    return True
 
 
 async def send_message_about_documents_save(message, keyboard):
@@ -71,20 +164,25 @@ async def send_message_about_documents_save(message, keyboard):
     )
 
 
-@dp.message_handler(
-    content_types=ContentType.DOCUMENT,
-    state=UploadDocuments.handle_documents_or_category,
-)
 async def handle_additional_document_to_save(message, state):
-    """Обработка дополнительного файла к сохранению"""
-    async with state.proxy() as data:
-        data["documents"].append(message.document)
+    """Обработка дополнительного файла к сохранению.
+
+    Сообщение с добавленным файлом удаляется
+    """
+    document = PendingDocument.from_telegram_document(message.document)
+    if await add_documents(message, state, [document]):
+        await message.delete()
 
-    await message.delete()
-    await message.answer("Добавлено к сохранению!")
+
+async def send_message_about_too_many_documents(message):
+    """Сообщаем, что больше файлов к сохранению добавить нельзя"""
+    await message.answer(
+        templates.TOO_MANY_PENDING_DOCUMENTS.format(
+            max_documents=config.MAX_PENDING_DOCUMENTS
+        )
+    )
 
 
-@dp.callback_query_handler(state=UploadDocuments.handle_documents_or_category)
 async def handle_documents_or_category(call, state):
     """Обработка выбранной категории.
 
@@ -108,7 +206,6 @@ async def handle_documents_or_category(call, state):
     await save_documents(documents, user_id, category, call.message)
 
 
-@dp.message_handler(state=UploadDocuments.handle_new_category)
 async def handle_new_category(message, state):
     """Обработка новой категории.
 
@@ -131,68 +228,79 @@ async def handle_new_category(message, state):
 async def save_documents(documents, user_id, category, message):
     """Сохранение переданных файлов.
 
-    Сохраняем переданные файлы и сообщаем, сколько из них сохранилось
-    (возможно пользователь отправил файлы, которые уже были загружены ранее)
+    Сохраняем переданные файлы и отправляем один отчёт о сохранении
+    (возможно пользователь отправил файлы, которые уже были загружены
+    ранее). Длинный отчёт разбивается на несколько сообщений
     """
-    all_files_saved = True
-    any_files_saved = False
-
-    for document in documents:
-        try:
-            file_service.save_telegram_document(document, user_id, category)
-        except exceptions.FileAlreadyExists:
-            filename = document.file_name
-            await message.answer(f"{filename} уже сохранён")
-            all_files_saved = False
-        else:
-            any_files_saved = True
-
-    await send_message_how_many_documents_was_saved(
-        all_files_saved, any_files_saved, message
+    # после хранилища состояний документы могут быть списками из JSON
+    documents = [PendingDocument._make(document) for document in documents]
+    results = await file_service.asave_telegram_documents(
+        documents, user_id, category
     )
+    report = templates.generate_save_report(results)
+    for text in templates.split_text(report):
+        await message.answer(text)
 
 
-async def send_message_how_many_documents_was_saved(
-    all_files_saved, any_files_saved, message
-):
-    """Отправляем информацию о том, сколько файлов было сохранено"""
-    if all_files_saved:
-        await message.answer("Все файлы сохранены!")
-    elif any_files_saved:
-        # если какой-то файл не был сохранён, то было
-        # отправлено сообщение вида "<document> уже сохранён",
-        # поэтому используется слово "остальные"
-        await message.answer("Остальные файлы сохранены!")
-    else:
-        await message.answer("Ни один файл не сохранён!")
-
-
-@dp.message_handler(TextFilter(equals=keyboards.MY_FILES))
 async def send_owned_files(message):
     """Обработка команды "Мои файлы".
 
-    Отправляем пользователю информацию о его загруженных файлах.
+    Отправляем пользователю первую страницу его загруженных файлов
+    с клавиатурой для перехода между страницами
     """
     user_id = message.from_user.id
-    answer_message = generate_owned_files_answer(user_id)
-    await message.answer(answer_message, parse_mode=ParseMode.MARKDOWN)
+    answer_message, keyboard = await generate_owned_files_answer(user_id)
+    return SendMessage(
+        message.chat.id,
+        answer_message,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=keyboard,
+    )
+
 
+async def handle_owned_files_page(call, callback_data):
+    """Обработка перехода к другой странице файлов.
 
-def generate_owned_files_answer(user_id):
+    Страница выбирается из БД по ключу файла на границе текущей страницы,
+    и заменяет текущую страницу в сообщении
+    """
+    user_id = call.from_user.id
+    unique_id = int(callback_data["unique_id"])
+    if callback_data["direction"] == keyboards.PREVIOUS_PAGE:
+        page_key = {"before": unique_id}
+    else:
+        page_key = {"after": unique_id}
+
+    answer_message, keyboard = await generate_owned_files_answer(
+        user_id, **page_key
+    )
+    await call.message.edit_text(
+        answer_message,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=keyboard,
+    )
+    await call.answer()
+
+
+async def generate_owned_files_answer(user_id, after=None, before=None):
     """Генерация ответа для команды "Мои файлы".
 
-    Генерируем ответ с файлами пользователя, сгруппироваными
-    по категориям. Если файлов нет, то возвращаем сообщение,
-    что у пользователя нет загруженных файлов
+    Генерируем ответ со страницей файлов пользователя, сгруппироваными
+    по категориям, и клавиатуру для перехода между страницами.
+    Если файлов нет, то возвращаем сообщение, что у пользователя
+    нет загруженных файлов
     """
     try:
-        files = file_service.get_owned_files(user_id)
+        page = await file_service.aget_owned_files_page(
+            user_id, after, before
+        )
     except exceptions.NoUserFiles as e:
-        return str(e)
+        return (str(e), None)
     else:
-        grouped_files = file_service.group_files_by_category(files)
+        grouped_files = file_service.group_files_by_category(page.files)
         text = templates.generate_grouped_files_text(grouped_files)
-        return text
+        keyboard = keyboards.create_owned_files_page_keyboard(page)
+        return (text, keyboard)
 
 
 class GetCategoryState(StatesGroup):
@@ -201,7 +309,6 @@ class GetCategoryState(StatesGroup):
     handle_category = State()
 
 
-@dp.message_handler(TextFilter(equals=keyboards.GET_CATEGORY_FILES))
 async def handle_get_category_files(message):
     """Обработка команды "Получить категорию".
 
@@ -209,7 +316,7 @@ async def handle_get_category_files(message):
     есть, иначе сообщаем, что у пользователя нет файлов
     """
     user_id = message.from_user.id
-    categories = file_service.get_user_categories(user_id)
+    categories = await file_service.aget_user_categories(user_id)
     if not categories:
         await message.answer("У вас пока нет ни одного файла")
         return
@@ -222,7 +329,6 @@ async def handle_get_category_files(message):
     )
 
 
-@dp.callback_query_handler(state=GetCategoryState.handle_category)
 async def handle_category_to_get(call, state):
     """Обработка выбранной для получения файлов категории"""
     await call.message.delete()  # удаляем клавитуру
@@ -233,20 +339,8 @@ async def handle_category_to_get(call, state):
 
     category = call.data
     user_id = call.from_user.id
-    files = file_service.get_category_files(category, user_id)
-    await send_files(files, call.message)
     await state.finish()
-
-
-async def send_files(files, message):
-    """Отправка файлов пользователю.
-
-    Отправляем пользователю файлы как группу файлов
-    """
-    media_group = MediaGroup()
-    attachments = (InputMediaDocument(f.file_id) for f in files)
-    media_group.attach_many(*attachments)
-    await message.answer_media_group(media_group)
+    await sending.send_category_files(category, user_id, call.message)
 
 
 class DeleteCategoryState(StatesGroup):
@@ -255,7 +349,6 @@ class DeleteCategoryState(StatesGroup):
     handle_category = State()
 
 
-@dp.message_handler(TextFilter(equals=keyboards.DELETE_CATEGORY_FILES))
 async def handle_delete_category_files(message):
     """Обработка команды "Удалить категорию".
 
@@ -264,7 +357,7 @@ async def handle_delete_category_files(message):
     Если же у пользователя нет файлов, то уведомляем его об этом
     """
     user_id = message.from_user.id
-    categories = file_service.get_user_categories(user_id)
+    categories = await file_service.aget_user_categories(user_id)
     if not categories:
         await message.answer("У вас нет категорий для удаления")
         return
@@ -277,7 +370,6 @@ async def handle_delete_category_files(message):
     )
 
 
-@dp.callback_query_handler(state=DeleteCategoryState.handle_category)
 async def handle_category_to_delete(call, state):
     """Обработка выбранной для удаления категории"""
     await call.message.delete()  # удаляем клавитуру
@@ -288,13 +380,16 @@ async def handle_category_to_delete(call, state):
 
     category = call.data
     user_id = call.from_user.id
-    file_service.delete_category_files(category, user_id)
+    try:
+        await file_service.adelete_category_files(category, user_id)
+    except exceptions.NoCategoryFiles as e:
+        await call.message.answer(str(e))
+    else:
+        await call.message.answer(f"Категория {category} успешно удалена")
 
-    await call.message.answer(f"Категория {category} успешно удалена")
     await state.finish()
 
 
-@dp.message_handler(RegexpCommandsFilter(regexp_commands=[r"f(\d*)"]))
 async def handle_get_file_command(message, regexp_command):
     """Обработка команды /f<unique_id>.
 
@@ -305,14 +400,13 @@ async def handle_get_file_command(message, regexp_command):
     unique_id = int(regexp_command.group(1))
     user_id = message.from_user.id
     try:
-        file = file_service.get_file(unique_id, user_id)
+        file = await file_service.aget_file(unique_id, user_id)
     except exceptions.IncorrectFileID as e:
-        await message.answer(str(e))
+        return SendMessage(message.chat.id, str(e))
     else:
-        await message.answer_document(file.file_id)
+        return SendDocument(message.chat.id, file.file_id)
 
 
-@dp.message_handler(RegexpCommandsFilter(regexp_commands=[r"d(\d*)"]))
 async def handle_delete_file_command(message, regexp_command):
     """Обработка команды /d<unique_id>.
 
@@ -323,21 +417,95 @@ async def handle_delete_file_command(message, regexp_command):
     unique_id = int(regexp_command.group(1))
     user_id = message.from_user.id
     try:
-        file_service.delete_file(unique_id, user_id)
+        await file_service.adelete_file(unique_id, user_id)
     except exceptions.IncorrectFileID as e:
-        await message.answer(str(e))
+        return SendMessage(message.chat.id, str(e))
     else:
-        await message.answer("Успешно удалено!")
+        return SendMessage(message.chat.id, "Успешно удалено!")
 
 
-@dp.errors_handler()
 async def handle_errors(update, error):
     """Обработка непредвиденных ошибок.
 
     Логируем ошибку, а также отправляем пользователю
-    сообщение, что произошла непредвиденная ошибка
+    сообщение, что произошла непредвиденная ошибка. Если Telegram
+    ограничил отправку сообщений, то сообщение не отправляем.
+    Повторяющаяся ошибка логируется не чаще `config.LOG_ERRORS_INTERVAL`
     """
+    if isinstance(error, RetryAfter):
+        if error_limiter.acquire(error) is not None:
+            logger.warning(f"Telegram ограничил отправку: {error}")
+        return True
+
+    suppressed = error_limiter.acquire(error)
+    if suppressed is not None:
+        text = "Exception occured!"
+        if suppressed:
+            text += f" Таких же ошибок пропущено: {suppressed}"
+        logger.opt(exception=error).error(text)
+
     message = update.message or update.callback_query.message
     await message.answer("Произошла ошибка")
-    logger.exception("Exception occured!")
     return True
+
+
+def register_handlers(dp):
+    """Регистрация обработчиков бота в диспетчере.
+
+    Порядок важен: для обновления вызывается первый подходящий обработчик
+    """
+    dp.register_message_handler(
+        handle_document_album,
+        MediaGroupFilter(is_media_group=True),
+        content_types=ContentType.DOCUMENT,
+        state="*",
+    )
+    # листать файлы можно в любом состоянии: иначе нажатие попадёт
+    # в обработчики категорий, ожидающие любую кнопку
+    dp.register_callback_query_handler(
+        handle_owned_files_page,
+        keyboards.owned_files_page.filter(),
+        state="*",
+    )
+    dp.register_message_handler(send_welcome, commands=["start"])
+    dp.register_message_handler(
+        handle_document_message, content_types=ContentType.DOCUMENT
+    )
+    dp.register_message_handler(
+        handle_additional_document_to_save,
+        content_types=ContentType.DOCUMENT,
+        state=UploadDocuments.handle_documents_or_category,
+    )
+    dp.register_callback_query_handler(
+        handle_documents_or_category,
+        state=UploadDocuments.handle_documents_or_category,
+    )
+    dp.register_message_handler(
+        handle_new_category, state=UploadDocuments.handle_new_category
+    )
+    dp.register_message_handler(
+        send_owned_files, TextFilter(equals=keyboards.MY_FILES)
+    )
+    dp.register_message_handler(
+        handle_get_category_files,
+        TextFilter(equals=keyboards.GET_CATEGORY_FILES),
+    )
+    dp.register_callback_query_handler(
+        handle_category_to_get, state=GetCategoryState.handle_category
+    )
+    dp.register_message_handler(
+        handle_delete_category_files,
+        TextFilter(equals=keyboards.DELETE_CATEGORY_FILES),
+    )
+    dp.register_callback_query_handler(
+        handle_category_to_delete, state=DeleteCategoryState.handle_category
+    )
+    dp.register_message_handler(
+        handle_get_file_command,
+        RegexpCommandsFilter(regexp_commands=[r"f(\d*)"]),
+    )
+    dp.register_message_handler(
+        handle_delete_file_command,
+        RegexpCommandsFilter(regexp_commands=[r"d(\d*)"]),
+    )
+    dp.register_errors_handler(handle_errors)
@@ -0,0 +1,91 @@
+"""Кэш в памяти для результатов запросов к БД"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """Кэш ограниченного размера с временем жизни записей.
+
+    При переполнении удаляется запись, которая дольше всех не
+    запрашивалась. Записи старше `ttl` секунд считаются отсутствующими.
+    Счётчики `hits` и `misses` нужны для подбора размера кэша.
+    Кэш используется из нескольких потоков, поэтому защищён блокировкой.
+
+    Значение, прочитанное из БД до удаления ключа, не должно попасть
+    в кэш после удаления. Поэтому `invalidate` увеличивает поколение
+    ключа, а `set` с поколением, взятым до чтения (`generation`), ничего
+    не сохраняет, если оно с тех пор изменилось. Поколения хранятся
+    не больше чем для `maxsize` ключей: при переполнении они удаляются
+    все и меняется эпоха, так что устаревают все взятые поколения
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Количество записей в кэше"""
+        return len(self._entries)
+
+    def get(self, key):
+        """Получение значения по ключу, либо None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < self._timer():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def generation(self, key):
+        """Поколение ключа: берётся до чтения значения для `set`"""
+        with self._lock:
+            return self._get_generation(key)
+
+    def set(self, key, value, generation=None):
+        """Сохранение значения по ключу.
+
+        Если передано `generation`, а ключ с тех пор удалялся,
+        то значение не сохраняется
+        """
+        with self._lock:
+            if generation not in (None, self._get_generation(key)):
+                return
+
+            self._entries[key] = (value, self._timer() + self.ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Удаление значения по ключу"""
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._generations) >= self.maxsize:
+                self._generations.clear()
+                self._epoch += 1
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        """Удаление всех значений и сброс счётчиков"""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self.hits = 0
+            self.misses = 0
+
+    def _get_generation(self, key):
+        """Поколение ключа (вызывается под блокировкой)"""
+        return (self._epoch, self._generations.get(key, 0))
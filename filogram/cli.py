@@ -2,13 +2,16 @@
 import argparse
 import os
 
-from aiogram import executor
-from aiogram.utils.executor import start_webhook
 
+# сервер метрик при поллинге хранится в данных диспетчера
+METRICS_RUNNER_KEY = "metrics_runner"
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--stage", choices=["dev", "prod"], default="dev")
 parser.add_argument("--use", choices=["polling", "webhook"], default="polling")
+parser.add_argument("--workers", type=int, default=1)
+parser.add_argument("--fast-ack", action="store_true")
+parser.add_argument("--concurrency", type=int)
 
 
 def cli():
@@ -17,22 +20,53 @@ def cli():
     Аргументы:
     --stage: dev - запуск бота при разработке, prod - запуск бота в продакшене
     --use: polling (по умолчанию запускается поллинг)
+    --workers: количество процессов при запуске через вебхук (по умолчанию 1)
+    --fast-ack: отвечать на вебхук до обработки обновления
+    --concurrency: сколько пользователей обслуживается параллельно при
+    поллинге (по умолчанию из конфига)
     """
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers должен быть не меньше 1")
+    if args.workers > 1 and args.use != "webhook":
+        parser.error("--workers поддерживается только с --use webhook")
+    if args.workers > 1 and args.stage == "dev":
+        # при разработке БД находится в памяти одного процесса
+        parser.error("--workers больше 1 поддерживается только с --stage prod")
+    if args.fast_ack and args.use != "webhook":
+        parser.error("--fast-ack поддерживается только с --use webhook")
+    if args.concurrency is not None and args.use != "polling":
+        parser.error("--concurrency поддерживается только с --use polling")
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("--concurrency должен быть не меньше 1")
+
+    # процессы вебхука выбирают конфиг по переменной окружения
     os.environ["STAGE"] = args.stage
 
+    from .app import init
+
+    init(args.stage)
+
     if args.use == "polling":
-        run_polling()
+        run_polling(args.concurrency)
     elif args.use == "webhook":
-        run_webhook()
+        run_webhook(args.workers, args.fast_ack)
+
 
+def run_polling(concurrency=None):
+    """Запуск бота через поллинг.
 
-def run_polling():
-    """Запуск бота через поллинг"""
-    from .bot import dp
+    Обновления разных пользователей обрабатываются в `concurrency`
+    очередях параллельно, а одного пользователя - по порядку
+    """
+    from .app import create_app
+    from .config import config
+    from .polling import start_sharded_polling
 
-    executor.start_polling(
+    dp = create_app()
+    start_sharded_polling(
         dp,
+        concurrency or config.POLLING_CONCURRENCY,
         skip_updates=True,
         on_startup=on_polling_startup,
         on_shutdown=on_polling_shutdown,
@@ -40,56 +74,90 @@ def run_polling():
 
 
 async def on_polling_startup(dp):
-    """Колбэк при включении бота через поллинг"""
+    """Колбэк при включении бота через поллинг.
+
+    Метрики отдаются отдельным сервером
+    """
+    from . import metrics
     from .logger import logger
 
+    dp[METRICS_RUNNER_KEY] = await metrics.start_server()
     logger.info("Запуск бота через поллинг")
 
 
 async def on_polling_shutdown(dp):
     """Колбэк при выключении бота через поллинг"""
     from . import db
+    from . import file_service
     from .logger import logger
 
+    await dp[METRICS_RUNNER_KEY].cleanup()
+    await file_service.close_write_queue()
     db.close_connection()
 
     logger.info("Работа бота завершена")
 
 
-def run_webhook():
-    """Функция запуска бота через вебхук"""
-    from .bot import dp
+def run_webhook(workers=1, fast_ack=False):
+    """Функция запуска бота через вебхук.
 
+    При `workers` больше 1 бот запускается в нескольких процессах.
+    При `fast_ack` на вебхук отвечается сразу, а обновления
+    обрабатываются из очереди
+    """
     webhook_path = os.getenv("WEBHOOK_PATH")
     host = os.getenv("WEBAPP_HOST")
-    port = os.getenv("WEBAPP_PORT")
-
-    start_webhook(
-        dispatcher=dp,
-        skip_updates=True,
-        on_startup=on_webhook_startup,
-        on_shutdown=on_webhook_shutdown,
-        webhook_path=webhook_path,
-        host=host,
-        port=port,
-    )
+    port = int(os.getenv("WEBAPP_PORT", 8080))
+
+    if workers > 1:
+        from .workers import run_webhook_workers
+
+        run_webhook_workers(
+            workers,
+            os.getenv("WEBHOOK_URL"),
+            fast_ack,
+            webhook_path=webhook_path,
+            host=host,
+            port=port,
+        )
+        return
+
+    from aiogram.utils.executor import set_webhook
+
+    from . import metrics
+    from .app import create_app
+    from .webhook import start_fast_ack_webhook
+
+    dp = create_app()
+    # метрики отдаются тем же веб-приложением, что и вебхук
+    params = {
+        "dispatcher": dp,
+        "skip_updates": True,
+        "on_startup": on_webhook_startup,
+        "on_shutdown": on_webhook_shutdown,
+        "webhook_path": webhook_path,
+        "web_app": metrics.create_app(),
+    }
+    if fast_ack:
+        start_fast_ack_webhook(**params, host=host, port=port)
+    else:
+        set_webhook(**params).run_app(host=host, port=port)
 
 
 async def on_webhook_startup(dp):
     """Колбэк при включении бота через вебхук"""
-    from .bot import bot
-
     webhook_url = os.getenv("WEBHOOK_URL")
-    await bot.set_webhook(webhook_url)
+    await dp.bot.set_webhook(webhook_url)
 
 
 async def on_webhook_shutdown(dp):
     """Колбэк при выключении бота через вебхук"""
     from . import db
-    from .bot import bot
+    from . import file_service
     from .logger import logger
 
-    await bot.delete_webhook()
+    await dp.bot.delete_webhook()
+    await file_service.close_write_queue()
     db.close_connection()
 
     logger.info("Работа бота завершена")
@@ -1,7 +1,7 @@
 """Конфиги для запуска бота с определёнными настройками"""
 import os
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
 
 class Config:
@@ -13,17 +13,108 @@ class Config:
 
     DATABASE_URL: Union[Path, str]
     LOG_DB_ERRORS: bool
+    DB_POOL_SIZE: int
+    CATEGORIES_CACHE_SIZE: int
+    CATEGORIES_CACHE_TTL: float
+    WRITE_BEHIND: bool
+    SLOW_QUERY_THRESHOLD: Optional[float]
+    QUERY_SAMPLE_RATE: float
+    QUERY_PROGRESS_STEPS: Optional[int]
 
     BOT_TOKEN = os.getenv("BOT_TOKEN")
-    CREATE_DB_SCRIPT_PATH = Path(".").joinpath("filogram/createdb.sql")
+    # адрес своего сервера Bot API (по умолчанию - сервер Telegram)
+    BOT_API_URL = os.getenv("BOT_API_URL")
+    # страница "Мои файлы" должна помещаться в одно сообщение: файлов
+    # на ней не больше OWNED_FILES_PAGE_SIZE (и меньше, если текст страницы
+    # длиннее сообщения), а длинные категории и имена файлов сокращаются
+    OWNED_FILES_PAGE_SIZE = 10
+    OWNED_FILES_NAME_MAX_LENGTH = 100
+    # накопление отложенных записей: не дольше интервала (в секундах)
+    # и не больше размера пачки
+    WRITE_BEHIND_INTERVAL = 0.01
+    WRITE_BEHIND_BATCH_SIZE = 100
+    # сколько файлов пользователь может отправить перед выбором категории
+    MAX_PENDING_DOCUMENTS = 100
+    # максимальная длина текста сообщения в Telegram
+    MESSAGE_MAX_LENGTH = 4096
+    # Telegram принимает в одном альбоме не больше 10 файлов
+    MEDIA_GROUP_SIZE = 10
+    # сколько альбомов выбирается из БД заранее, пока отправляется текущий
+    MEDIA_GROUP_PREFETCH = 2
+    # о ходе отправки сообщается для категорий больше чем из 50 файлов,
+    # сообщение обновляется после каждых 5 альбомов
+    SEND_PROGRESS_MIN_FILES = 50
+    SEND_PROGRESS_EVERY = 5
+    # ограничения Telegram на отправку: около 30 сообщений в секунду
+    # для бота (больше с платными рассылками) и около одного в секунду
+    # в чат (с небольшими всплесками)
+    SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+    SEND_GLOBAL_BURST = 30
+    SEND_CHAT_RATE = 1
+    SEND_CHAT_BURST = 3
+    # сколько раз повторяется запрос после ответа RetryAfter
+    SEND_MAX_RETRIES = 3
+    # сообщения альбома приходят почти одновременно, альбом считается
+    # полученным, если за это время (в секундах) не пришло новых
+    ALBUM_DEBOUNCE = 0.5
+    # брошенные состояния пользователей (например, загрузка файлов без
+    # выбора категории) удаляются через сутки, проверка - раз в 10 минут
+    FSM_STATE_TTL = 24 * 60 * 60
+    FSM_SWEEP_INTERVAL = 10 * 60
+    # категории кэшируются в каждом процессе вебхука отдельно, а кэш
+    # сбрасывается только в процессе, изменившем файлы
+    WORKERS_CATEGORIES_CACHE_TTL = 5
+    # вебхук с быстрым подтверждением: сколько обновлений может ждать
+    # обработки и в скольких очередях они обрабатываются параллельно
+    # (обновления одного пользователя - по порядку в одной очереди,
+    # обработчики в основном ждут БД и Bot API). Ответ обработчика
+    # возвращается прямо в ответе на вебхук, если готов за это время
+    # (в секундах), 0 - никогда
+    WEBHOOK_QUEUE_SIZE = 1000
+    WEBHOOK_QUEUE_WORKERS = 100
+    WEBHOOK_INLINE_REPLY_TIMEOUT = 0.01
+    # поллинг: сколько очередей обрабатывают обновления параллельно
+    # (обновления одного пользователя - всегда в одной очереди), сколько
+    # обновлений в очереди ждут обработки, и как часто (в секундах)
+    # записывается в лог задержка очередей
+    POLLING_CONCURRENCY = 16
+    POLLING_SHARD_QUEUE_SIZE = 100
+    POLLING_LAG_REPORT_INTERVAL = 60
+    # метрики отдаются по этому пути на порту вебхука, а при поллинге -
+    # отдельным сервером на METRICS_HOST:METRICS_PORT
+    METRICS_PATH = "/metrics"
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+    # выборка времени запросов к БД хранит последние QUERY_SAMPLE_WINDOW
+    # значений для каждого запроса
+    QUERY_SAMPLE_WINDOW = 1000
+    # с запасом больше числа запросов в filogram/queries.py
+    DB_CACHED_STATEMENTS = 64
+    # одинаковые ошибки обработчиков (тип и место в коде) логируются не
+    # чаще раза в минуту, запоминается до 1000 мест ошибок
+    LOG_ERRORS_INTERVAL = 60
+    LOG_ERRORS_LOCATIONS = 1000
+    MIGRATIONS_PATH = Path(".").joinpath("filogram/migrations")
     LOGS_PATH = Path(".").joinpath("logs/log.log")
 
 
 class ProdConfig(Config):
     """Конфиг для запуска в продакшене"""
 
-    DATABASE_URL = Path(".").joinpath("db.sqlite3")
+    DATABASE_URL = Path(os.getenv("DATABASE_PATH", "db.sqlite3"))
     LOG_DB_ERRORS = False
+    DB_POOL_SIZE = 4
+    CATEGORIES_CACHE_SIZE = 10_000
+    CATEGORIES_CACHE_TTL = 600
+    WRITE_BEHIND = True
+    # запросы дольше порога (в секундах) записываются в лог с планом
+    # выполнения, None - не записываются. Время доли запросов попадает
+    # в скользящую выборку метрик (0 - выборка отключена). sqlite вызывает
+    # обработчик прогресса каждые QUERY_PROGRESS_STEPS инструкций (по ним
+    # видно, работал запрос или ждал соединения), None - без обработчика
+    SLOW_QUERY_THRESHOLD = 0.2
+    QUERY_SAMPLE_RATE = 0.01
+    QUERY_PROGRESS_STEPS = 10_000
 
 
 class DevConfig(Config):
@@ -31,10 +122,65 @@ class DevConfig(Config):
 
     DATABASE_URL = ":memory:"
     LOG_DB_ERRORS = True
+    DB_POOL_SIZE = 2
+    CATEGORIES_CACHE_SIZE = 100
+    CATEGORIES_CACHE_TTL = 60
+    WRITE_BEHIND = False
+    SLOW_QUERY_THRESHOLD = 0.05
+    QUERY_SAMPLE_RATE = 1.0
+    QUERY_PROGRESS_STEPS = 10_000
 
 
-stage = os.getenv("STAGE")
-if stage == "prod":
-    config = ProdConfig()
-elif stage == "dev":
-    config = DevConfig()
+STAGES = {"prod": ProdConfig, "dev": DevConfig}
+
+
+class LazyConfig:
+    """Конфиг, который создаётся при первом обращении к параметрам.
+
+    Импорт модулей бота не требует переменной окружения STAGE: конфиг
+    выбирается при вызове `load` (из фабрики приложения), либо по STAGE
+    при первом чтении параметра. Изменение параметров (например,
+    в тестах) меняет созданный конфиг
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_config", None)
+
+    def __getattr__(self, name):
+        """Параметр созданного конфига"""
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        """Изменение параметра созданного конфига"""
+        setattr(self.load(), name, value)
+
+    def __delattr__(self, name):
+        """Удаление изменённого параметра созданного конфига"""
+        delattr(self.load(), name)
+
+    def load(self, stage=None):
+        """Создание конфига для `stage` (по умолчанию - из STAGE).
+
+        Конфиг создаётся один раз, повторный вызов возвращает его же.
+        Неизвестный этап, либо этап, отличный от уже выбранного - ошибка
+        """
+        current = self._config
+        if current is not None:
+            if stage is not None and STAGES.get(stage) is not type(current):
+                raise ValueError(
+                    f"Конфиг уже создан для другого этапа, не {stage}"
+                )
+            return current
+
+        stage = stage or os.getenv("STAGE")
+        if stage not in STAGES:
+            raise ValueError(
+                f"Неизвестный этап {stage!r}: переменная STAGE должна быть "
+                f"одним из {', '.join(STAGES)}"
+            )
+        current = STAGES[stage]()
+        object.__setattr__(self, "_config", current)
+        return current
+
+
+config = LazyConfig()
@@ -1,51 +1,335 @@
-"""Функции для прямой работы с БД"""
+"""Функции для прямой работы с БД.
+
+Соединения открываются вызовом `connect` (его делает фабрика
+приложения `filogram.app`), а не при импорте модуля
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import partial
+import json
+from pathlib import Path
+import queue
+import random
 import sqlite3
+import threading
+from typing import Callable, NamedTuple, Optional
 
 from . import exceptions
+from . import metrics
 from .config import config
 from .logger import logger
 
 
-conn = None
+# единственное соединение для записи и пул соединений для чтения,
+# открываются в `connect`
+writer = None
+_writer_lock = threading.RLock()
+# вложенность транзакций на запись в текущем потоке
+_transaction = threading.local()
+_readers = queue.LifoQueue()
+# вызовы обработчика прогресса sqlite в текущем потоке
+_progress = threading.local()
+# планы выполнения медленных запросов по их именам
+_query_plans = {}
+
+# запись в БД идёт из одного потока, чтение - из нескольких (по размеру
+# пула соединений, поэтому потоки для чтения создаются в `connect`)
+_writer_executor = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+_reader_executor = None
+
+# при разработке все соединения работают с одной БД в памяти
+SHARED_MEMORY_URI = "file:filogram?mode=memory&cache=shared"
 
 
 @contextmanager
 def get_cursor():
-    """Получение курсора для выполнения запроса к БД.
+    """Получение курсора для выполнения запроса к БД на запись.
+
+    Все записи идут через одно соединение, поэтому они выполняются
+    по очереди. Если во время запроса произошла ошибка
+    sqlite3.IntegrityError, то прокидываем исключение наверх.
+    Если возникла другая ошибка, то логируем.
+
+    Вложенный вызов выполняется в точке сохранения внешней транзакции:
+    при ошибке откатывается только он, а фиксируется он вместе
+    с внешней транзакцией. Ошибка фиксации не логируется, а прокидывается
+    наверх после отката: иначе вызывающий считал бы данные записанными
+    """
+    with _writer_lock:
+        depth = getattr(_transaction, "depth", 0)
+        cursor = writer.cursor()
+        _begin(depth)
+        _transaction.depth = depth + 1
+        try:
+            yield cursor
+        except sqlite3.IntegrityError:
+            _rollback(depth)
+            raise
+        except sqlite3.Error:  # pragma: no cover
+            _rollback(depth)
+            if config.LOG_DB_ERRORS:
+                logger.exception("DB exception occured!")
+        except BaseException:
+            _rollback(depth)
+            raise
+        else:
+            try:
+                _commit(depth)
+            except BaseException:
+                _rollback(depth)
+                raise
+        finally:
+            _transaction.depth = depth
+            # незакрытый курсор не даёт закрыть соединение к БД
+            cursor.close()
+
+
+def _begin(depth):
+    """Начало транзакции, либо точки сохранения внутри неё"""
+    if depth == 0:
+        _transaction.after_commit = []
+        # блокировка на запись берётся сразу: иначе транзакции разных
+        # процессов, читающие перед записью, мешали бы друг другу
+        writer.execute("BEGIN IMMEDIATE")
+    else:
+        writer.execute(f"SAVEPOINT write_{depth}")
+
+
+def _commit(depth):
+    """Фиксация транзакции, либо точки сохранения внутри неё"""
+    if depth == 0:
+        writer.execute("COMMIT")
+        for callback in _transaction.after_commit:
+            callback()
+    else:
+        writer.execute(f"RELEASE write_{depth}")
+
+
+def _rollback(depth):
+    """Откат транзакции, либо точки сохранения внутри неё"""
+    if depth == 0:
+        if writer.in_transaction:
+            writer.execute("ROLLBACK")
+    else:
+        writer.execute(f"ROLLBACK TO write_{depth}")
+        writer.execute(f"RELEASE write_{depth}")
+
+
+def after_commit(func, *args):
+    """Вызов функции после фиксации текущей транзакции на запись.
+
+    Вне транзакции функция вызывается сразу
+    """
+    if getattr(_transaction, "depth", 0):
+        _transaction.after_commit.append(partial(func, *args))
+    else:
+        func(*args)
 
-    Если во время запроса произошла ошибка sqlite3.IntegrityError,
-    то прокидываем исключение наверх. Если возникла другая ошибка, то логируем
+
+@contextmanager
+def get_read_cursor():
+    """Получение курсора для чтения из БД.
+
+    Курсор создаётся на одном из свободных соединений пула.
+    Если свободных соединений нет, то ждём, пока одно из них освободится
     """
+    connection = _readers.get()
+    cursor = connection.cursor()
     try:
-        cursor = conn.cursor()
         yield cursor
-    except sqlite3.IntegrityError:
-        conn.rollback()
-        raise
     except sqlite3.Error:  # pragma: no cover
-        conn.rollback()
         if config.LOG_DB_ERRORS:
             logger.exception("DB exception occured!")
-    else:
-        conn.commit()
+    finally:
+        cursor.close()
+        _readers.put(connection)
+
+
+async def run_read(func, *args, **kwargs):
+    """Выполнение читающей из БД функции вне цикла событий.
 
+    Функция выполняется в одном из потоков для чтения, поэтому
+    медленный запрос не блокирует обработку других обновлений
+    """
+    return await _run_in_executor(_reader_executor, func, *args, **kwargs)
+
+
+async def run_write(func, *args, **kwargs):
+    """Выполнение пишущей в БД функции вне цикла событий.
+
+    Все записи выполняются последовательно в единственном потоке
+    """
+    return await _run_in_executor(_writer_executor, func, *args, **kwargs)
+
+
+async def _run_in_executor(executor, func, *args, **kwargs):
+    """Выполнение функции в переданном пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+class Query(NamedTuple):
+    """Именованный запрос к БД.
+
+    Текст запроса создаётся один раз, поэтому при каждом выполнении
+    sqlite берёт уже подготовленный запрос из кэша соединения.
+    `row_factory` создаёт из строки результата нужный объект,
+    без неё строки возвращаются как `sqlite3.Row`
+    """
+
+    name: str
+    sql: str
+    row_factory: Optional[Callable] = None
 
-def insert(column_values):
+
+def first_column(cursor, row):
+    """Фабрика строк для запросов, выбирающих одну колонку"""
+    return row[0]
+
+
+class WriteBehindQueue:
+    """Очередь отложенной записи в БД.
+
+    Операции записи от всех обработчиков собираются в течение
+    `flush_interval` секунд, либо пока их не наберётся `batch_size`,
+    и выполняются одной транзакцией в потоке записи. Каждая операция
+    выполняется в своей точке сохранения, поэтому её ошибка
+    (например, `FileAlreadyExists`) достаётся только её вызывающему
+    """
+
+    def __init__(self, flush_interval, batch_size):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.batches = 0
+        self.operations = 0
+        self._queue = None
+        self._writer_task = None
+
+    async def submit(self, func, *args):
+        """Добавление операции в очередь и ожидание её результата"""
+        if self._writer_task is None:
+            self._queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._write())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((partial(func, *args), future))
+        return await future
+
+    async def close(self):
+        """Выполнение оставшихся операций и остановка очереди"""
+        if self._writer_task is None:
+            return
+
+        await self._queue.put(None)
+        await self._writer_task
+        self._writer_task = None
+
+    async def _write(self):
+        """Выполнение операций из очереди пачками"""
+        closed = False
+        while not closed:
+            batch, closed = await self._collect_batch()
+            if not batch:
+                continue
+
+            operations = [operation for (operation, _) in batch]
+            try:
+                outcomes = await run_write(_execute_batch, operations)
+            except Exception as e:  # pragma: no cover
+                outcomes = [(None, e)] * len(batch)
+
+            for (_, future), (result, error) in zip(batch, outcomes):
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+            self.batches += 1
+            self.operations += len(batch)
+
+    async def _collect_batch(self):
+        """Сбор пачки операций.
+
+        Возвращаем пачку и признак закрытия очереди
+        """
+        loop = asyncio.get_running_loop()
+        item = await self._queue.get()
+        if item is None:
+            return ([], True)
+
+        batch = [item]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return (batch, True)
+            batch.append(item)
+
+        return (batch, False)
+
+
+def _execute_batch(operations):
+    """Выполнение операций одной транзакцией.
+
+    Для каждой операции возвращается пара из результата и исключения
+    """
+    outcomes = []
+    with get_cursor():
+        for operation in operations:
+            try:
+                with get_cursor():
+                    outcomes.append((operation(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+
+    return outcomes
+
+
+def insert(query, **params):
     """Добавляем данные в БД"""
-    columns = ",".join(column_values.keys())
-    placeholders = ",".join("?" * len(column_values))
-    values = tuple(column_values.values())
+    with _QueryMeasurement(query, params) as measurement:
+        with catch_integrity():
+            with get_cursor() as cursor:
+                cursor.execute(query.sql, params)
+                measurement.rows = cursor.rowcount
+
+
+def insert_many(query, rows, *, existing_query, key):
+    """Добавляем несколько записей в БД одной транзакцией.
 
-    with catch_integrity():
+    Не добавляются записи, значение поля `key` которых уже есть в БД
+    (их ищет запрос `existing_query` по JSON-списку `keys`), либо
+    повторяется среди переданных записей. Для каждой записи возвращаем,
+    была ли она добавлена
+    """
+    keys = json.dumps([row[key] for row in rows])
+
+    with _QueryMeasurement(query, {"rows": rows}) as measurement:
         with get_cursor() as cursor:
-            cursor.execute(
-                f"""
-                INSERT INTO files({columns})
-                VALUES ({placeholders})
-                """,
-                values,
+            cursor.execute(existing_query.sql, {"keys": keys})
+            seen_keys = {existing_key for (existing_key,) in cursor}
+
+            inserted = []
+            for row in rows:
+                inserted.append(row[key] not in seen_keys)
+                seen_keys.add(row[key])
+
+            new_rows = (
+                row for (row, is_new) in zip(rows, inserted) if is_new
             )
+            cursor.executemany(query.sql, new_rows)
+            measurement.rows = sum(inserted)
+
+    return inserted
 
 
 @contextmanager
@@ -60,92 +344,280 @@ def catch_integrity():
         raise exceptions.IntegrityError from e
 
 
-def fetchone(columns, distinct=False, **conditions):
+def fetchone(query, **params):
     """Получаем одну запись из БД"""
-    columns = ",".join(columns)
-    distinct_query = "DISTINCT" if distinct else ""
-    condition_query, condition_values = _create_condition(**conditions)
-
-    with get_cursor() as cursor:
-        cursor.execute(
-            f"""
-            SELECT {distinct_query} {columns}
-            FROM files
-            WHERE {condition_query}
-            """,
-            condition_values,
-        )
-        return cursor.fetchone()
+    with _QueryMeasurement(query, params) as measurement:
+        with get_read_cursor() as cursor:
+            if query.row_factory:
+                cursor.row_factory = query.row_factory
+            cursor.execute(query.sql, params)
+            row = cursor.fetchone()
+            measurement.rows = int(row is not None)
+            return row
 
 
-def fetchall(columns, distinct=False, **conditions):
+def fetchall(query, **params):
     """Получаем все записи из БД"""
-    columns = ",".join(columns)
-    distinct_query = "DISTINCT" if distinct else ""
-    condition_query, condition_values = _create_condition(**conditions)
-
-    with get_cursor() as cursor:
-        cursor.execute(
-            f"""
-            SELECT {distinct_query} {columns}
-            FROM files
-            WHERE {condition_query}
-            ORDER BY category
-            """,
-            condition_values,
-        )
-        return cursor.fetchall()
+    with _QueryMeasurement(query, params) as measurement:
+        with get_read_cursor() as cursor:
+            if query.row_factory:
+                cursor.row_factory = query.row_factory
+            cursor.execute(query.sql, params)
+            rows = cursor.fetchall()
+            measurement.rows = len(rows)
+            return rows
 
 
-def delete(**conditions):
-    """Удаляем запись из БД"""
-    condition_query, condition_values = _create_condition(**conditions)
+def delete(query, **params):
+    """Удаляем записи из БД.
 
-    with get_cursor() as cursor:
-        cursor.execute(
-            f"""
-            DELETE FROM files
-            WHERE {condition_query}
-            """,
-            condition_values,
-        )
+    Возвращаем количество удалённых записей
+    """
+    with _QueryMeasurement(query, params) as measurement:
+        with get_cursor() as cursor:
+            cursor.execute(query.sql, params)
+            measurement.rows = cursor.rowcount
+            return cursor.rowcount
+
+
+class _QueryMeasurement(metrics.QueryMeasurement):
+    """Замер запроса к БД.
+
+    Время и количество строк попадают в метрики, время доли запросов
+    `config.QUERY_SAMPLE_RATE` - в скользящую выборку, а запросы дольше
+    `config.SLOW_QUERY_THRESHOLD` записываются в лог. Выключенные
+    выборка и лог медленных запросов почти ничего не стоят
+    """
+
+    __slots__ = ("query", "params", "_progress_calls")
+
+    def __init__(self, query, params):
+        super().__init__(query.name)
+        self.query = query
+        self.params = params
+        self._progress_calls = 0
+
+    def __enter__(self):
+        """Начало замера"""
+        self._progress_calls = getattr(_progress, "calls", 0)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Конец замера: выборка и лог только для успешных запросов"""
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+
+        sample_rate = config.QUERY_SAMPLE_RATE
+        if sample_rate >= 1 or (
+            sample_rate and random.random() < sample_rate
+        ):
+            metrics.query_samples.observe(self.elapsed, self.name)
+
+        threshold = config.SLOW_QUERY_THRESHOLD
+        if threshold is not None and self.elapsed >= threshold:
+            steps = None
+            if config.QUERY_PROGRESS_STEPS is not None:
+                steps = (
+                    getattr(_progress, "calls", 0) - self._progress_calls
+                ) * config.QUERY_PROGRESS_STEPS
+            _log_slow_query(self.query, self.params, self, steps)
+        return False
+
+
+def _log_slow_query(query, params, measurement, steps):
+    """Запись медленного запроса в лог.
+
+    Значения параметров не записываются, только их типы и размеры.
+    Если инструкций sqlite выполнено мало, то запрос в основном ждал
+    соединения или блокировки. Без обработчика прогресса (`steps` - None)
+    количество инструкций неизвестно
+    """
+    steps = "?" if steps is None else f"~{steps}"
+    logger.warning(
+        f"Медленный запрос {query.name}: "
+        f"{measurement.elapsed * 1000:.1f} мс, "
+        f"строк: {measurement.rows}, "
+        f"инструкций sqlite: {steps}, "
+        f"параметры: {describe_params(params)}, "
+        f"план: {explain(query)}"
+    )
+
+
+def describe_params(params):
+    """Типы и размеры параметров запроса, например `owner_id=int`"""
+    descriptions = []
+    for name, value in params.items():
+        description = type(value).__name__
+        if isinstance(value, (str, bytes, list, tuple)):
+            description += f"[{len(value)}]"
+        descriptions.append(f"{name}={description}")
+
+    return ", ".join(descriptions) or "-"
+
+
+def explain(query):
+    """План выполнения запроса (EXPLAIN QUERY PLAN) одной строкой.
+
+    План не зависит от значений параметров, поэтому вместо них
+    подставляется NULL, а план запоминается по имени запроса
+    """
+    plan = _query_plans.get(query.name)
+    if plan is not None:
+        return plan
+
+    with get_read_cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {query.sql}", _NullParams())
+        plan = "; ".join(row["detail"] for row in cursor) or "-"
+        _query_plans[query.name] = plan
+
+    return plan or "-"
+
+
+class _NullParams(dict):
+    """Параметры запроса, в которых любой параметр равен NULL"""
+
+    def __missing__(self, key):
+        """Значение отсутствующего параметра"""
+        return None
+
+
+def _count_progress():
+    """Обработчик прогресса sqlite: считаем его вызовы в текущем потоке.
 
+    Соединение используется одним потоком за раз, поэтому разница
+    вызовов до и после запроса - это инструкции этого запроса
+    """
+    _progress.calls = getattr(_progress, "calls", 0) + 1
+    return 0
+
+
+def set_trace_callback(callback):
+    """Установка функции трассировки запросов для всех соединений"""
+    with _writer_lock:
+        writer.set_trace_callback(callback)
+
+    readers = [_readers.get() for _ in range(config.DB_POOL_SIZE)]
+    for reader in readers:
+        reader.set_trace_callback(callback)
+        _readers.put(reader)
+
+
+def connect():
+    """Открытие соединений к БД и применение миграций.
 
-def _create_condition(**conditions):
-    """Создаён из именованых аргументов WHERE условие для sqlite3"""
-    condition_query = " AND ".join(f"{key} = ?" for key in conditions)
-    condition_values = tuple(conditions.values())
-    return (condition_query, condition_values)
+    Если соединения уже открыты, то ничего не делаем
+    """
+    global _reader_executor
+
+    if writer is not None:
+        return
+
+    if _reader_executor is None:
+        _reader_executor = ThreadPoolExecutor(
+            config.DB_POOL_SIZE, thread_name_prefix="db-reader"
+        )
+    _set_connection()
 
 
 def reset_connection():
-    """Закрываем текущее соединение и устаналиваем новое.
+    """Закрываем текущие соединения и устаналиваем новые.
 
     Функция используется только при тестах для получения корректный ID записей
     """
     close_connection()
-    _set_connection()
+    connect()
 
 
 def close_connection():
-    """Закрываем соединение к БД"""
-    conn.close()
+    """Закрываем соединения к БД"""
+    global writer
+
+    for _ in range(config.DB_POOL_SIZE):
+        _readers.get().close()
+
+    writer.close()
+    writer = None
 
 
 def _set_connection():
-    """Устанавливаем соединение к БД"""
-    global conn
+    """Устанавливаем соединения к БД.
+
+    Сначала открывается соединение для записи, через него применяются
+    миграции. После этого открываются соединения для чтения
+    """
+    global writer
+
+    writer = _connect()
+    # транзакции открываются и закрываются явно в `get_cursor`
+    writer.isolation_level = None
+    if not _is_memory_database():
+        writer.execute("PRAGMA journal_mode = WAL")
+        writer.execute("PRAGMA synchronous = NORMAL")
+    _migrate()
+
+    for _ in range(config.DB_POOL_SIZE):
+        reader = _connect()
+        reader.isolation_level = None
+        reader.execute("PRAGMA query_only = ON")
+        if _is_memory_database():
+            # в общей БД в памяти вместо ожидания снятия блокировки
+            # сразу выбрасывается ошибка, поэтому читаем без блокировок
+            reader.execute("PRAGMA read_uncommitted = ON")
+        _readers.put(reader)
+
+
+def _connect():
+    """Открытие нового соединения к БД"""
+    if _is_memory_database():
+        uri = SHARED_MEMORY_URI
+    else:
+        uri = Path(config.DATABASE_URL).resolve().as_uri()
+
+    connection = sqlite3.connect(
+        uri,
+        uri=True,
+        check_same_thread=False,
+        cached_statements=config.DB_CACHED_STATEMENTS,
+    )
+    connection.row_factory = sqlite3.Row
+    if config.QUERY_PROGRESS_STEPS is not None:
+        connection.set_progress_handler(
+            _count_progress, config.QUERY_PROGRESS_STEPS
+        )
+    return connection
 
-    conn = sqlite3.connect(config.DATABASE_URL)
-    conn.row_factory = sqlite3.Row
-    _init_db()
 
+def _is_memory_database():
+    """Используется ли БД в памяти"""
+    return config.DATABASE_URL == ":memory:"
 
-def _init_db():
-    """Инициализация БД из скрипта"""
-    with open(config.CREATE_DB_SCRIPT_PATH) as f, get_cursor() as cursor:
-        script = f.read()
-        cursor.executescript(script)
 
+def _migrate():
+    """Применение миграций БД.
 
-_set_connection()
+    Версия схемы хранится в `PRAGMA user_version`. Применяются только
+    миграции с номером больше текущей версии, каждая в своей транзакции
+    вместе с обновлением версии
+    """
+    (current_version,) = writer.execute("PRAGMA user_version").fetchone()
+    for version, script in _get_migrations():
+        if version <= current_version:
+            continue
+
+        script = f"BEGIN;\n{script}\nPRAGMA user_version = {version};"
+        try:
+            writer.executescript(f"{script}\nCOMMIT;")
+        except sqlite3.Error:
+            writer.rollback()
+            raise
+
+
+def _get_migrations():
+    """Получение миграций, отсортированных по их номеру.
+
+    Номер миграции - префикс в названии файла, например `0002_index.sql`
+    """
+    for path in sorted(config.MIGRATIONS_PATH.glob("*.sql")):
+        version = int(path.name.split("_", 1)[0])
+        yield (version, path.read_text())
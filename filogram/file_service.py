@@ -1,99 +1,42 @@
 """Работа с файлами - сохранение, получение, удаление"""
 from itertools import groupby
-from typing import NamedTuple, Optional
+from typing import NamedTuple
 
 from . import db
 from . import exceptions
+from . import metrics
+from . import queries
 from . import templates
+from .cache import LRUCache
+from .config import config
+from .models import FileModel
 
 
-class FileModel(NamedTuple):
-    """Модель файла.
-
-    Модель представляет как входной файл (созданный из ввода пользователя),
-    так и файл полученный из БД.
-
-    Модель имеет 6 полей:
-    `file_unique_id` - уникальный ID файла в Telegram
-    `file_id`        - ID телеграм-документа для отправления в сообщении
-    `owner_id`       - ID пользователя, которому принадлежит данный файл
-    `category`       - пользовательская категория файла
-    `file_name`      - название файла
-    `unique_id`      - ID данного файла в нашей БД (имеется только у файлов,
-                       которые мы достали из БД)
-    """
-
-    file_unique_id: str
-    file_id: str
-    owner_id: int
-    category: str
-    file_name: str
-    unique_id: Optional[int] = None
-
-    def __eq__(self, other):
-        """Проверка на равенство файлов.
-
-        Сравниваюся поле `file_unique_id`. Так мы можем сравнивать
-        файлы ещё не попавшие в БД с теми, которые мы оттуда достали
-        (удобно при тестах)
-        """
-        return self.file_unique_id == other.file_unique_id
-
-    @classmethod
-    def from_telegram_document(cls, document, **kwargs):
-        """Создание модели из телеграм-документа.
-
-        Создаём модель файла из телеграм-документа и дополнительно
-        переданных параметров (тех, которых нет в документе,
-        это `owner_id` и `category`).
-
-        !! При создании через документ, у модели нет поля `unique_id`
-        """
-        file_unique_id = document.file_unique_id
-        file_id = document.file_id
-        file_name = document.file_name
-        return cls(
-            file_unique_id=file_unique_id,
-            file_id=file_id,
-            file_name=file_name,
-            **kwargs
-        )
+# категории пользователей по их ID и очередь отложенной записи (записи
+# от разных пользователей фиксируются общими транзакциями) зависят от
+# конфига, поэтому создаются в `init`
+categories_cache = None
+write_queue = None
 
-    @classmethod
-    def from_db_values(cls, row):
-        """Создание модели из данных БД.
-
-        Создаём модель файла из данных БД. В этих данных присутствуют
-        все поля модели, включая `unique_id`
-        """
-        named_values = dict(zip(row.keys(), row))
-        return cls(**named_values)
-
-    @classmethod
-    def db_columns(cls):
-        """Название полей для таблицы в БД"""
-        return (
-            "file_unique_id",
-            "file_id",
-            "owner_id",
-            "category",
-            "file_name",
-            "unique_id",
-        )
 
-    def column_values(self):
-        """Значения файла сцеплённые с названием колонок.
+def init():
+    """Создание кэша категорий и очереди отложенной записи по конфигу.
+
+    Если они уже созданы, то ничего не делаем
+    """
+    global categories_cache, write_queue
 
-        Данные передаются для сохранения в БД, поэтому у модели
-        на текущий момент нет поля `unique_id`
-        """
-        return {
-            "file_unique_id": self.file_unique_id,
-            "file_id": self.file_id,
-            "owner_id": self.owner_id,
-            "category": self.category,
-            "file_name": self.file_name,
-        }
+    if categories_cache is not None:
+        return
+
+    categories_cache = LRUCache(
+        config.CATEGORIES_CACHE_SIZE, config.CATEGORIES_CACHE_TTL
+    )
+    metrics.register_cache("categories", categories_cache)
+    if config.WRITE_BEHIND:
+        write_queue = db.WriteBehindQueue(
+            config.WRITE_BEHIND_INTERVAL, config.WRITE_BEHIND_BATCH_SIZE
+        )
 
 
 def save_telegram_document(document, user_id, category):
@@ -111,12 +54,61 @@ def save_telegram_document(document, user_id, category):
 
 def save_file(file):
     """Сохранение файла в БД"""
-    column_values = file.column_values()
     try:
-        db.insert(column_values)
+        db.insert(queries.INSERT_FILE, **file.column_values())
     except exceptions.IntegrityError:
         raise exceptions.FileAlreadyExists(templates.FILE_ALREADY_EXISTS)
 
+    db.after_commit(categories_cache.invalidate, file.owner_id)
+
+
+class SaveResult(NamedTuple):
+    """Результат сохранения файла при сохранении нескольких файлов.
+
+    `saved` - был ли файл сохранён. Если нет, то он уже был сохранён ранее
+    """
+
+    file: FileModel
+    saved: bool
+
+
+def save_telegram_documents(documents, user_id, category):
+    """Сохранение нескольких телеграм-документов.
+
+    Документы сохраняются одной транзакцией, для каждого из них
+    возвращается `SaveResult`
+    """
+    files = [
+        FileModel.from_telegram_document(
+            document, owner_id=user_id, category=category
+        )
+        for document in documents
+    ]
+    return save_files(files)
+
+
+def save_files(files):
+    """Сохранение нескольких файлов в БД одной транзакцией.
+
+    Уже сохранённые файлы пропускаются. Для каждого файла
+    возвращается `SaveResult`
+    """
+    rows = [file.column_values() for file in files]
+    saved = db.insert_many(
+        queries.INSERT_NEW_FILE,
+        rows,
+        existing_query=queries.EXISTING_FILES,
+        key="file_unique_id",
+    )
+    results = [
+        SaveResult(file, is_saved) for (file, is_saved) in zip(files, saved)
+    ]
+    owner_ids = {result.file.owner_id for result in results if result.saved}
+    for owner_id in owner_ids:
+        db.after_commit(categories_cache.invalidate, owner_id)
+
+    return results
+
 
 def get_file(unique_id, user_id):
     """Получение конкретного файла.
@@ -124,12 +116,10 @@ def get_file(unique_id, user_id):
     Получение файла с ID - `unique_id` у пользователя с ID - `user_id`.
     Если файл не найден, то выбрасывается исключение `IncorrentFileID`
     """
-    columns = FileModel.db_columns()
-    values = db.fetchone(columns, unique_id=unique_id, owner_id=user_id)
-    if not values:
+    file = db.fetchone(queries.FILE, unique_id=unique_id, owner_id=user_id)
+    if not file:
         raise exceptions.IncorrectFileID("Не могу найти файл с таким ID")
 
-    file = FileModel.from_db_values(values)
     return file
 
 
@@ -137,15 +127,16 @@ def delete_file(unique_id, user_id):
     """Удаление конкретного файла.
 
     Удаление файла с ID - `unique_id` у пользователя с ID `user_id`.
-    Перед удалением файла нужно удостоверится, что пользователь имеет доступ
-    к этому файлу, иначе выбрасывается исключение `IncorrectFileID`
+    Проверка доступа пользователя к файлу происходит в том же запросе:
+    если ничего не удалено, то выбрасывается исключение `IncorrectFileID`
     """
-    try:
-        get_file(unique_id, user_id)
-    except exceptions.IncorrectFileID:
-        raise
-    else:
-        db.delete(unique_id=unique_id, owner_id=user_id)
+    deleted = db.delete(
+        queries.DELETE_FILE, unique_id=unique_id, owner_id=user_id
+    )
+    if not deleted:
+        raise exceptions.IncorrectFileID("Не могу найти файл с таким ID")
+
+    db.after_commit(categories_cache.invalidate, user_id)
 
 
 def get_owned_files(user_id):
@@ -153,23 +144,131 @@ def get_owned_files(user_id):
 
     Получение всех файлов пользователя с ID - `user_id`
     """
-    columns = FileModel.db_columns()
-    values = db.fetchall(columns, owner_id=user_id)
-    if not values:
+    files = db.fetchall(queries.OWNED_FILES, owner_id=user_id)
+    if not files:
         raise exceptions.NoUserFiles(templates.NO_FILES_UPLOADED_YET)
 
-    files = map(FileModel.from_db_values, values)
     return files
 
 
+class FilesPage(NamedTuple):
+    """Страница файлов пользователя.
+
+    `files` - файлы страницы, отсортированные по категории и `unique_id`,
+    `has_previous` и `has_next` - есть ли файлы до и после страницы
+    """
+
+    files: tuple
+    has_previous: bool
+    has_next: bool
+
+
+def get_owned_files_page(user_id, after=None, before=None, size=None):
+    """Получение страницы файлов пользователя.
+
+    Страница начинается после файла с ID - `after`, либо заканчивается
+    перед файлом с ID - `before`. Если ни один из них не передан, или
+    такого файла уже нет, то возвращается первая страница. Если у
+    пользователя нет файлов, то выбрасывается исключение `NoUserFiles`.
+    По умолчанию `size` - `config.OWNED_FILES_PAGE_SIZE`. Если текст
+    страницы не помещается в одно сообщение, то файлов на ней меньше
+    """
+    if size is None:
+        size = config.OWNED_FILES_PAGE_SIZE
+
+    page = None
+    from_end = False
+    if after is not None:
+        page = _get_files_page_after(user_id, after, size)
+    elif before is not None:
+        page = _get_files_page_before(user_id, before, size)
+        from_end = True
+
+    if page is None or not page.files:
+        page = _get_first_files_page(user_id, size)
+        from_end = False
+
+    if not page.files:
+        raise exceptions.NoUserFiles(templates.NO_FILES_UPLOADED_YET)
+
+    return _fit_files_page(page, from_end)
+
+
+def _fit_files_page(page, from_end):
+    """Сокращение страницы, пока её текст длиннее сообщения.
+
+    Файлы отбрасываются с конца страницы, а у страницы перед файлом
+    (`from_end`) - с начала, чтобы она по-прежнему примыкала к нему
+    """
+    files = page.files
+    while len(files) > 1:
+        grouped_files = group_files_by_category(files)
+        text = templates.generate_grouped_files_text(grouped_files)
+        if len(text) <= config.MESSAGE_MAX_LENGTH:
+            break
+        files = files[1:] if from_end else files[:-1]
+
+    if len(files) == len(page.files):
+        return page
+    if from_end:
+        return page._replace(files=files, has_previous=True)
+    return page._replace(files=files, has_next=True)
+
+
+def _get_first_files_page(user_id, size):
+    """Первая страница файлов пользователя"""
+    files = db.fetchall(
+        queries.OWNED_FILES_FIRST_PAGE, owner_id=user_id, limit=size + 1
+    )
+    return FilesPage(
+        tuple(files[:size]), has_previous=False, has_next=len(files) > size
+    )
+
+
+def _get_files_page_after(user_id, unique_id, size):
+    """Страница файлов пользователя после файла с ID - `unique_id`"""
+    files = db.fetchall(
+        queries.OWNED_FILES_PAGE_AFTER,
+        owner_id=user_id,
+        unique_id=unique_id,
+        limit=size + 1,
+    )
+    return FilesPage(
+        tuple(files[:size]), has_previous=True, has_next=len(files) > size
+    )
+
+
+def _get_files_page_before(user_id, unique_id, size):
+    """Страница файлов пользователя перед файлом с ID - `unique_id`"""
+    files = db.fetchall(
+        queries.OWNED_FILES_PAGE_BEFORE,
+        owner_id=user_id,
+        unique_id=unique_id,
+        limit=size + 1,
+    )
+    # файлы выбраны в обратном порядке
+    return FilesPage(
+        tuple(reversed(files[:size])),
+        has_previous=len(files) > size,
+        has_next=True,
+    )
+
+
 def get_user_categories(user_id):
     """Получение всех категорий файлов пользователя.
 
-    Получение всех категорий файлов пользователя с ID - `user_id`
+    Получение всех категорий файлов пользователя с ID - `user_id`.
+    Категории кэшируются до изменения файлов пользователя. Если файлы
+    изменились во время запроса, то результат не кэшируется
     """
-    categories = db.fetchall(["category"], distinct=True, owner_id=user_id)
-    categories = list(map(lambda c: c[0], categories))
-    return categories
+    categories = categories_cache.get(user_id)
+    if categories is None:
+        generation = categories_cache.generation(user_id)
+        categories = db.fetchall(queries.USER_CATEGORIES, owner_id=user_id)
+        categories = tuple(categories)
+        categories_cache.set(user_id, categories, generation)
+
+    return list(categories)
 
 
 def group_files_by_category(files):
@@ -189,15 +288,152 @@ def group_files_by_category(files):
 
 def get_category_files(category, user_id):
     """Получение всех файлов пользователя в данной категории"""
-    columns = FileModel.db_columns()
-    values = db.fetchall(columns, category=category, owner_id=user_id)
-    if not values:
+    files = db.fetchall(
+        queries.CATEGORY_FILES, category=category, owner_id=user_id
+    )
+    if not files:
         raise exceptions.NoCategoryFiles(templates.NO_FILES_UPLOADED_YET)
 
-    files = map(FileModel.from_db_values, values)
     return files
 
 
+def get_category_files_chunk(category, user_id, after=0, size=None):
+    """Получение части файлов категории.
+
+    Возвращаем не больше `size` (по умолчанию - `config.MEDIA_GROUP_SIZE`)
+    файлов категории с ID больше `after`, отсортированных по ID
+    """
+    if size is None:
+        size = config.MEDIA_GROUP_SIZE
+
+    return db.fetchall(
+        queries.CATEGORY_FILES_CHUNK,
+        category=category,
+        owner_id=user_id,
+        after=after,
+        limit=size,
+    )
+
+
+def count_category_files(category, user_id):
+    """Количество файлов пользователя в данной категории"""
+    return db.fetchone(
+        queries.CATEGORY_FILES_COUNT, category=category, owner_id=user_id
+    )
+
+
 def delete_category_files(category, user_id):
-    """Удаление всех файлов данной категории у данного пользователя"""
-    db.delete(category=category, owner_id=user_id)
+    """Удаление всех файлов данной категории у данного пользователя.
+
+    Если у пользователя нет файлов данной категории, то выбрасывается
+    исключение `NoCategoryFiles`
+    """
+    deleted = db.delete(
+        queries.DELETE_CATEGORY_FILES, category=category, owner_id=user_id
+    )
+    if not deleted:
+        raise exceptions.NoCategoryFiles(templates.NO_CATEGORY_FILES)
+
+    db.after_commit(categories_cache.invalidate, user_id)
+
+
+async def asave_telegram_document(document, user_id, category):
+    """Асинхронная версия `save_telegram_document`"""
+    await _run_write(save_telegram_document, document, user_id, category)
+
+
+async def asave_telegram_documents(documents, user_id, category):
+    """Асинхронная версия `save_telegram_documents`"""
+    return await _run_write(
+        save_telegram_documents, documents, user_id, category
+    )
+
+
+async def asave_files(files):
+    """Асинхронная версия `save_files`"""
+    return await _run_write(save_files, files)
+
+
+async def asave_file(file):
+    """Асинхронная версия `save_file`"""
+    await _run_write(save_file, file)
+
+
+async def aget_file(unique_id, user_id):
+    """Асинхронная версия `get_file`"""
+    return await db.run_read(get_file, unique_id, user_id)
+
+
+async def adelete_file(unique_id, user_id):
+    """Асинхронная версия `delete_file`"""
+    await _run_write(delete_file, unique_id, user_id)
+
+
+async def aget_owned_files(user_id):
+    """Асинхронная версия `get_owned_files`"""
+    return await db.run_read(get_owned_files, user_id)
+
+
+async def aget_owned_files_page(user_id, after=None, before=None):
+    """Асинхронная версия `get_owned_files_page`"""
+    return await db.run_read(get_owned_files_page, user_id, after, before)
+
+
+async def aget_user_categories(user_id):
+    """Асинхронная версия `get_user_categories`"""
+    return await db.run_read(get_user_categories, user_id)
+
+
+async def aget_category_files(category, user_id):
+    """Асинхронная версия `get_category_files`"""
+    return await db.run_read(get_category_files, category, user_id)
+
+
+async def aiter_category_files_chunks(category, user_id, size=None):
+    """Асинхронный перебор файлов категории частями по `size` файлов.
+
+    Каждая часть выбирается из БД отдельным запросом, поэтому все файлы
+    категории не загружаются в память сразу.
+    По умолчанию `size` - `config.MEDIA_GROUP_SIZE`
+    """
+    if size is None:
+        size = config.MEDIA_GROUP_SIZE
+
+    after = 0
+    while True:
+        files = await db.run_read(
+            get_category_files_chunk, category, user_id, after, size
+        )
+        if files:
+            yield files
+        if len(files) < size:
+            return
+
+        after = files[-1].unique_id
+
+
+async def acount_category_files(category, user_id):
+    """Асинхронная версия `count_category_files`"""
+    return await db.run_read(count_category_files, category, user_id)
+
+
+async def adelete_category_files(category, user_id):
+    """Асинхронная версия `delete_category_files`"""
+    await _run_write(delete_category_files, category, user_id)
+
+
+async def _run_write(func, *args):
+    """Выполнение пишущей функции через очередь отложенной записи.
+
+    Если очередь отключена, то функция выполняется в потоке записи сразу
+    """
+    if write_queue is not None:
+        return await write_queue.submit(func, *args)
+
+    return await db.run_write(func, *args)
+
+
+async def close_write_queue():
+    """Выполнение отложенных записей перед остановкой бота"""
+    if write_queue is not None:
+        await write_queue.close()
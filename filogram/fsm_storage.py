@@ -0,0 +1,184 @@
+"""Хранилище состояний пользователей (FSM) в БД"""
+import asyncio
+import json
+import time
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from . import db
+from . import queries
+from .config import config
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний и данных пользователей в таблице `fsm_states`.
+
+    В отличие от `MemoryStorage`, состояния переживают перезапуск бота,
+    а брошенные сессии (например, пользователь отправил файл и не выбрал
+    категорию) удаляются фоновой задачей через `ttl` секунд после
+    последнего изменения. Данные хранятся в JSON, поэтому должны
+    сериализоваться в него. Параметры по умолчанию - из конфига
+    """
+
+    def __init__(self, ttl=None, sweep_interval=None):
+        if ttl is None:
+            ttl = config.FSM_STATE_TTL
+        if sweep_interval is None:
+            sweep_interval = config.FSM_SWEEP_INTERVAL
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+
+    async def close(self):
+        """Остановка удаления устаревших состояний"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+
+    async def wait_closed(self):
+        """Ожидание остановки удаления устаревших состояний"""
+        if self._sweeper is not None:
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        """Получение состояния пользователя"""
+        chat, user = self.check_address(chat=chat, user=user)
+        state = await db.run_read(
+            db.fetchone, queries.FSM_STATE, chat_id=chat, user_id=user
+        )
+        return self.resolve_state(state if state is not None else default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        """Получение данных пользователя"""
+        chat, user = self.check_address(chat=chat, user=user)
+        data = await db.run_read(
+            db.fetchone, queries.FSM_DATA, chat_id=chat, user_id=user
+        )
+        if data is None:
+            return dict(default or {})
+        return json.loads(data)
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        """Установка состояния пользователя"""
+        chat, user = self.check_address(chat=chat, user=user)
+        await self._write(
+            _set_state, chat, user, self.resolve_state(state)
+        )
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        """Замена данных пользователя"""
+        chat, user = self.check_address(chat=chat, user=user)
+        await self._write(_set_data, chat, user, data or {})
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        """Дополнение данных пользователя"""
+        chat, user = self.check_address(chat=chat, user=user)
+        await self._write(_update_data, chat, user, {**(data or {}), **kwargs})
+
+    async def add_to_list(
+        self, *, chat=None, user=None, state, key, values, limit
+    ):
+        """Добавление значений к списку `key` в данных пользователя.
+
+        Пользователю без состояния устанавливается `state` с новым
+        списком, в состоянии `state` список дополняется, в остальных
+        состояниях ничего не меняется. В списке остаётся не больше
+        `limit` значений. Проверка и запись выполняются в одной
+        транзакции, поэтому одновременные добавления не теряются.
+        Возвращаем прежнее состояние и количество добавленных значений
+        """
+        chat, user = self.check_address(chat=chat, user=user)
+        return await self._write(
+            _add_to_list, chat, user, state, key, list(values), limit
+        )
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        """Сброс состояния пользователя (и его данных)"""
+        if not with_data:
+            await self.set_state(chat=chat, user=user, state=None)
+            return
+
+        chat, user = self.check_address(chat=chat, user=user)
+        await self._write(
+            db.delete, queries.DELETE_FSM_STATE, chat_id=chat, user_id=user
+        )
+
+    async def sweep(self):
+        """Удаление состояний, не изменявшихся дольше `ttl` секунд.
+
+        Возвращаем количество удалённых состояний
+        """
+        return await db.run_write(
+            db.delete,
+            queries.DELETE_EXPIRED_FSM_STATES,
+            expired_before=time.time() - self.ttl,
+        )
+
+    async def _write(self, func, *args, **kwargs):
+        """Запись в БД с запуском удаления устаревших состояний"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_periodically())
+        return await db.run_write(func, *args, **kwargs)
+
+    async def _sweep_periodically(self):
+        """Удаление устаревших состояний раз в `sweep_interval` секунд"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+
+def _set_state(chat, user, state):
+    """Запись состояния, пустая запись удаляется"""
+    with db.get_cursor():  # обе записи в одной транзакции
+        db.insert(
+            queries.SET_FSM_STATE,
+            chat_id=chat,
+            user_id=user,
+            state=state,
+            updated_at=time.time(),
+        )
+        db.delete(queries.DELETE_EMPTY_FSM_STATE, chat_id=chat, user_id=user)
+
+
+def _set_data(chat, user, data):
+    """Запись данных, пустая запись удаляется"""
+    with db.get_cursor():  # обе записи в одной транзакции
+        db.insert(
+            queries.SET_FSM_DATA,
+            chat_id=chat,
+            user_id=user,
+            data=json.dumps(data, ensure_ascii=False),
+            updated_at=time.time(),
+        )
+        db.delete(queries.DELETE_EMPTY_FSM_STATE, chat_id=chat, user_id=user)
+
+
+def _update_data(chat, user, data):
+    """Дополнение данных, прочитанных в той же транзакции"""
+    with db.get_cursor() as cursor:
+        params = {"chat_id": chat, "user_id": user}
+        row = cursor.execute(queries.FSM_DATA.sql, params).fetchone()
+        current_data = json.loads(row[0]) if row is not None else {}
+        _set_data(chat, user, {**current_data, **data})
+
+
+def _add_to_list(chat, user, state, key, values, limit):
+    """Дополнение списка в данных после проверки состояния"""
+    with db.get_cursor() as cursor:
+        params = {"chat_id": chat, "user_id": user}
+        row = cursor.execute(queries.FSM_STATE_AND_DATA.sql, params).fetchone()
+        current_state, data = row if row is not None else (None, "{}")
+        if current_state not in (None, state):
+            return (current_state, 0)
+
+        data = json.loads(data)
+        items = data.get(key, []) if current_state is not None else []
+        added = values[: max(limit - len(items), 0)]
+        data[key] = items + added
+        if current_state is None:
+            _set_state(chat, user, state)
+        _set_data(chat, user, data)
+        return (current_state, len(added))
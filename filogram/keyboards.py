@@ -5,6 +5,7 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
+from aiogram.utils.callback_data import CallbackData
 
 
 EXTRA_CATEGORY = "Добавить категорию"
@@ -41,6 +42,37 @@ def _add_inline_buttons(keyboard, button_texts):
         keyboard.add(InlineKeyboardButton(text, callback_data=text))
 
 
+# переход к соседней странице "Мои файлы" от файла с ID `unique_id`
+owned_files_page = CallbackData("files", "direction", "unique_id")
+PREVIOUS_PAGE = "before"
+NEXT_PAGE = "after"
+
+
+def create_owned_files_page_keyboard(page):
+    """Создание клавиатуры для перехода между страницами файлов.
+
+    Если страница единственная, то клавиатура не нужна
+    """
+    if not (page.has_previous or page.has_next):
+        return None
+
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if page.has_previous:
+        callback_data = owned_files_page.new(
+            direction=PREVIOUS_PAGE, unique_id=page.files[0].unique_id
+        )
+        buttons.append(InlineKeyboardButton("«", callback_data=callback_data))
+    if page.has_next:
+        callback_data = owned_files_page.new(
+            direction=NEXT_PAGE, unique_id=page.files[-1].unique_id
+        )
+        buttons.append(InlineKeyboardButton("»", callback_data=callback_data))
+
+    keyboard.row(*buttons)
+    return keyboard
+
+
 MY_FILES = "Мои файлы"
 GET_CATEGORY_FILES = "Получить категорию"
 DELETE_CATEGORY_FILES = "Удалить категорию"
@@ -1,14 +1,182 @@
-"""Логгер"""
+"""Логгер.
+
+Файл лога подключается вызовом `setup_logger`. Записи пишутся в него
+строками JSON через очередь: запись, ротация и сжатие файла идут
+в отдельном потоке и не блокируют цикл событий. К записям, сделанным
+во время обработки обновления, добавляется его контекст (ID обновления
+и пользователя, обработчик, время с начала обработки), который
+устанавливает `UpdateLogContextMiddleware`
+"""
+from collections import OrderedDict
+from contextvars import ContextVar
+import json
+import threading
+import time
+import traceback
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from loguru import logger
 
 from .config import config
 
 
-logger.add(
-    encoding="u8",
-    sink=config.LOGS_PATH,
-    format="{time:DD-MM-YYYY at HH:mm:ss} | {level} | {message}",
-    rotation="1 week",
-    compression="zip",
-    backtrace=False,
-)
+# контекст обновления, обрабатываемого в текущей задаче
+_update_context = ContextVar("update_context", default=None)
+# ID обработчика loguru для файла лога, подключается в `setup_logger`
+_file_sink_id = None
+
+
+def add_update_context(record):
+    """Добавление контекста обновления к записи лога"""
+    context = _update_context.get()
+    if context is None:
+        return
+
+    started = context["started"]
+    record["extra"].update(
+        update_id=context["update_id"],
+        user_id=context["user_id"],
+        handler=context["handler"],
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+
+def format_json(record):
+    """Формат записи лога - одна строка JSON"""
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "message": record["message"],
+        "module": record["name"],
+        **record["extra"],
+    }
+    if record["exception"] is not None:
+        error_type, error, error_traceback = record["exception"]
+        entry["exception"] = "".join(
+            traceback.format_exception(error_type, error, error_traceback)
+        )
+
+    record["extra"]["json"] = json.dumps(
+        entry, ensure_ascii=False, default=str
+    )
+    return "{extra[json]}\n"
+
+
+class UpdateLogContextMiddleware(BaseMiddleware):
+    """Контекст обновления для записей лога.
+
+    Контекст устанавливается до фильтров обработчиков и не сбрасывается
+    после обработки: ошибки обработчика записываются в лог уже после
+    `post_process`. Каждое обновление обрабатывается в своей задаче,
+    поэтому контекст не переходит к другим обновлениям
+    """
+
+    async def on_pre_process_message(self, message, data):
+        """Контекст сообщения"""
+        self._set_context(message.from_user)
+
+    async def on_process_message(self, message, data):
+        """Обработчик сообщения"""
+        self._set_handler()
+
+    async def on_pre_process_callback_query(self, call, data):
+        """Контекст нажатия на кнопку"""
+        self._set_context(call.from_user)
+
+    async def on_process_callback_query(self, call, data):
+        """Обработчик нажатия на кнопку"""
+        self._set_handler()
+
+    def _set_context(self, user):
+        """Новый контекст для текущего обновления"""
+        update = types.Update.get_current()
+        _update_context.set(
+            {
+                "update_id": update.update_id if update else None,
+                "user_id": user.id if user else None,
+                "handler": None,
+                "started": time.perf_counter(),
+            }
+        )
+
+    def _set_handler(self):
+        """Запоминаем обработчик обновления в контексте"""
+        context = _update_context.get()
+        if context is not None:
+            context["handler"] = current_handler.get().__name__
+
+
+class RepeatedErrorLimiter:
+    """Ограничение записи в лог повторяющихся ошибок.
+
+    Ошибки одного типа из одного места кода записываются не чаще раза
+    в `interval` секунд, остальные только считаются. Запоминается не
+    больше `maxsize` мест, дольше всех не встречавшиеся забываются
+    """
+
+    def __init__(self, interval, maxsize, timer=time.monotonic):
+        self.interval = interval
+        self.maxsize = maxsize
+        self._timer = timer
+        # место ошибки -> (время последней записи, пропущено с тех пор)
+        self._errors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, error):
+        """Нужно ли записать ошибку.
+
+        Возвращаем количество пропущенных с прошлой записи таких же
+        ошибок, либо None, если ошибку записывать не нужно
+        """
+        key = get_error_location(error)
+        now = self._timer()
+        with self._lock:
+            logged_at, suppressed = self._errors.get(key, (None, 0))
+            if logged_at is not None and now - logged_at < self.interval:
+                self._errors[key] = (logged_at, suppressed + 1)
+                self._errors.move_to_end(key)
+                return None
+
+            self._errors[key] = (now, 0)
+            self._errors.move_to_end(key)
+            if len(self._errors) > self.maxsize:
+                self._errors.popitem(last=False)
+            return suppressed
+
+
+def get_error_location(error):
+    """Тип ошибки и место, где она была выброшена"""
+    error_traceback = error.__traceback__
+    if error_traceback is None:
+        return (type(error).__name__, None, None)
+
+    while error_traceback.tb_next is not None:
+        error_traceback = error_traceback.tb_next
+    code = error_traceback.tb_frame.f_code
+    return (type(error).__name__, code.co_filename, error_traceback.tb_lineno)
+
+
+def setup_logger():
+    """Подключение записи лога в файл.
+
+    Файл открывается при первом вызове, повторные вызовы ничего не делают
+    """
+    global _file_sink_id
+
+    if _file_sink_id is not None:
+        return
+
+    _file_sink_id = logger.add(
+        encoding="u8",
+        sink=config.LOGS_PATH,
+        format=format_json,
+        rotation="1 week",
+        compression="zip",
+        backtrace=False,
+        enqueue=True,
+    )
+
+
+logger.configure(patcher=add_update_context)
@@ -0,0 +1,518 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Время работы обработчиков считает `MetricsMiddleware`, время запросов
+к БД по именам запросов - функции модуля `db`. Счётчики кэшей и очередей
+берутся из самих объектов при отдаче метрик. Метрики хранятся в памяти
+процесса: при запуске в нескольких процессах у каждого процесса свои
+метрики, отличающиеся постоянной меткой (`set_constant_labels`)
+"""
+from collections import deque
+import sys
+import threading
+import time
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+from .config import Config, config
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# границы корзин гистограмм в секундах: обработчики ждут БД и Bot API,
+# а запросы к БД в основном укладываются в миллисекунды
+HANDLER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+# постоянные метки всех метрик процесса, например номер процесса вебхука
+_constant_labels = {}
+
+
+class Counter:
+    """Счётчик с метками.
+
+    Значения меток передаются позиционно в порядке `labels`.
+    Счётчик обновляется из нескольких потоков, поэтому защищён блокировкой
+    """
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """Увеличение счётчика"""
+        with self._lock:
+            self._values[label_values] = (
+                self._values.get(label_values, 0) + amount
+            )
+
+    def get(self, *label_values):
+        """Текущее значение счётчика"""
+        return self._values.get(label_values, 0)
+
+    def collect(self):
+        """Строки метрики в текстовом формате"""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}{labels} {value}"
+
+
+class Histogram:
+    """Гистограмма с метками.
+
+    Для каждого набора меток хранятся количества наблюдений в корзинах
+    (не накопленные), сумма и количество наблюдений
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Добавление наблюдения"""
+        with self._lock:
+            counts, total = self._values.get(
+                label_values, ([0] * (len(self.buckets) + 1), 0)
+            )
+            counts[self._bucket_index(value)] += 1
+            self._values[label_values] = (counts, total + value)
+
+    def count(self, *label_values):
+        """Количество наблюдений"""
+        counts, _ = self._values.get(label_values, ([], 0))
+        return sum(counts)
+
+    def collect(self):
+        """Строки метрики в текстовом формате"""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = sorted(
+                (label_values, list(counts), total)
+                for label_values, (counts, total) in self._values.items()
+            )
+        bounds = [*map(format_value, self.buckets), "+Inf"]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = format_labels(
+                    (*self.labels, "le"), (*label_values, bound)
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+    def _bucket_index(self, value):
+        """Номер корзины для значения (последняя - +Inf)"""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                return index
+        return len(self.buckets)
+
+
+class RollingQuantiles:
+    """Квантили по последним `window` наблюдениям для каждого набора меток.
+
+    В отличие от гистограммы старые наблюдения вытесняются, поэтому
+    квантили показывают текущее состояние, а не накопленное с запуска
+    """
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labels=(),
+        window=1000,
+        quantiles=(0.5, 0.9, 0.99),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.window = window
+        self.quantiles = quantiles
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Добавление наблюдения"""
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = deque(
+                    maxlen=self.window
+                )
+            values.append(value)
+
+    def get(self, quantile, *label_values):
+        """Квантиль наблюдений, либо None без наблюдений"""
+        with self._lock:
+            values = sorted(self._values.get(label_values, ()))
+        if not values:
+            return None
+        return get_quantile(values, quantile)
+
+    def collect(self):
+        """Строки метрики в текстовом формате"""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} summary"
+        with self._lock:
+            values = sorted(
+                (label_values, sorted(window))
+                for label_values, window in self._values.items()
+            )
+        for label_values, window in values:
+            for quantile in self.quantiles:
+                value = get_quantile(window, quantile)
+                labels = format_labels(
+                    (*self.labels, "quantile"),
+                    (*label_values, format_value(quantile)),
+                )
+                yield f"{self.name}{labels} {value}"
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {sum(window)}"
+            yield f"{self.name}_count{labels} {len(window)}"
+
+
+class FunctionMetric:
+    """Метрика, значения которой берутся из функции при отдаче метрик.
+
+    Функция возвращает число, а для метрики с метками - словарь
+    значения меток -> число. Так отдаются значения, которые и так
+    считают сами объекты, например длина очереди
+    """
+
+    def __init__(self, name, documentation, labels=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.kind = kind
+        self._function = None
+
+    def set_function(self, function):
+        """Функция, возвращающая текущие значения"""
+        self._function = function
+
+    def collect(self):
+        """Строки метрики в текстовом формате"""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if self._function is None:
+            return
+
+        values = self._function()
+        if not self.labels:
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}{labels} {value}"
+
+
+def get_quantile(values, quantile):
+    """Квантиль отсортированного непустого списка"""
+    return values[min(int(quantile * len(values)), len(values) - 1)]
+
+
+def set_constant_labels(**labels):
+    """Метки, добавляемые ко всем метрикам процесса"""
+    _constant_labels.clear()
+    _constant_labels.update(labels)
+
+
+def format_labels(names, values):
+    """Метки метрики в виде `{name="value",...}`.
+
+    Постоянные метки процесса идут первыми
+    """
+    names = (*_constant_labels, *names)
+    values = (*_constant_labels.values(), *values)
+    if not names:
+        return ""
+    labels = ",".join(
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in zip(names, values)
+    )
+    return f"{{{labels}}}"
+
+
+def escape_label_value(value):
+    """Экранирование значения метки"""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def format_value(value):
+    """Граница корзины без лишних нулей"""
+    return repr(float(value))
+
+
+handler_seconds = Histogram(
+    "filogram_handler_seconds",
+    "Время работы обработчика обновления",
+    ("handler",),
+    HANDLER_BUCKETS,
+)
+handler_calls = Counter(
+    "filogram_handler_calls_total",
+    "Вызовы обработчиков по результату (ok, error)",
+    ("handler", "outcome"),
+)
+unhandled_updates = Counter(
+    "filogram_unhandled_updates_total",
+    "Обновления, для которых не нашлось обработчика",
+    ("type",),
+)
+query_seconds = Histogram(
+    "filogram_db_query_seconds",
+    "Время выполнения запроса к БД, включая ожидание соединения",
+    ("query",),
+    QUERY_BUCKETS,
+)
+query_rows = Counter(
+    "filogram_db_query_rows_total",
+    "Строки, полученные или изменённые запросом к БД",
+    ("query",),
+)
+query_errors = Counter(
+    "filogram_db_query_errors_total",
+    "Запросы к БД, завершившиеся исключением",
+    ("query",),
+)
+query_samples = RollingQuantiles(
+    "filogram_db_query_sample_seconds",
+    "Время выборки запросов к БД (доля QUERY_SAMPLE_RATE) в скользящем окне",
+    ("query",),
+    Config.QUERY_SAMPLE_WINDOW,
+)
+webhook_queue_depth = FunctionMetric(
+    "filogram_webhook_queue_depth",
+    "Обновления, ожидающие обработки в очереди вебхука",
+)
+webhook_queue_lag = FunctionMetric(
+    "filogram_webhook_queue_lag_seconds",
+    "Сколько ждёт обработки самое старое обновление в очереди вебхука",
+)
+webhook_queue_accepted = FunctionMetric(
+    "filogram_webhook_queue_accepted_total",
+    "Обновления, принятые в очередь вебхука",
+    kind="counter",
+)
+webhook_queue_rejected = FunctionMetric(
+    "filogram_webhook_queue_rejected_total",
+    "Обновления, отклонённые заполненной очередью вебхука (ответ 429)",
+    kind="counter",
+)
+polling_queue_depth = FunctionMetric(
+    "filogram_polling_queue_depth",
+    "Обновления, ожидающие обработки в очереди поллинга",
+    ("shard",),
+)
+polling_queue_lag = FunctionMetric(
+    "filogram_polling_queue_lag_seconds",
+    "Сколько ждёт обработки самое старое обновление в очереди поллинга",
+    ("shard",),
+)
+send_queue_depth = FunctionMetric(
+    "filogram_send_queue_depth",
+    "Запросы к Bot API, ожидающие разрешения планировщика отправки",
+    ("priority",),
+)
+send_retries = FunctionMetric(
+    "filogram_send_retries_total",
+    "Запросы к Bot API, повторённые после RetryAfter",
+    kind="counter",
+)
+_metrics = [
+    handler_seconds,
+    handler_calls,
+    unhandled_updates,
+    query_seconds,
+    query_rows,
+    query_errors,
+    query_samples,
+    webhook_queue_depth,
+    webhook_queue_lag,
+    webhook_queue_accepted,
+    webhook_queue_rejected,
+    polling_queue_depth,
+    polling_queue_lag,
+    send_queue_depth,
+    send_retries,
+]
+_caches = {}
+
+
+def register_cache(name, cache):
+    """Добавление кэша со счётчиками `hits` и `misses` в метрики"""
+    _caches[name] = cache
+
+
+def register_polling_runner(runner):
+    """Добавление очередей поллинга (`ShardedUpdateRunner`) в метрики"""
+
+    def get_stats(key):
+        return {
+            (number,): stats[key]
+            for number, stats in enumerate(runner.stats())
+        }
+
+    polling_queue_depth.set_function(lambda: get_stats("depth"))
+    polling_queue_lag.set_function(lambda: get_stats("lag"))
+
+
+def register_send_scheduler(scheduler):
+    """Добавление очереди и повторов планировщика отправки в метрики"""
+    send_queue_depth.set_function(
+        lambda: {
+            (priority,): waiting
+            for priority, waiting in scheduler.queue_depth().items()
+        }
+    )
+    send_retries.set_function(lambda: scheduler.retries)
+
+
+def collect_caches():
+    """Строки метрик кэшей в текстовом формате"""
+    caches = sorted(_caches.items())
+    for metric, attribute, kind, documentation in (
+        ("filogram_cache_hits_total", "hits", "counter", "Попадания в кэш"),
+        ("filogram_cache_misses_total", "misses", "counter", "Промахи кэша"),
+        ("filogram_cache_entries", None, "gauge", "Записей в кэше"),
+    ):
+        yield f"# HELP {metric} {documentation}"
+        yield f"# TYPE {metric} {kind}"
+        for name, cache in caches:
+            if attribute is None:
+                value = len(cache)
+            else:
+                value = getattr(cache, attribute)
+            labels = format_labels(("cache",), (name,))
+            yield f"{metric}{labels} {value}"
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = [line for metric in _metrics for line in metric.collect()]
+    lines.extend(collect_caches())
+    return "\n".join(lines) + "\n"
+
+
+class QueryMeasurement:
+    """Замер одного запроса к БД: количество строк заполняет вызывающий.
+
+    Контекстный менеджер, а не генератор: замер оборачивает каждый запрос,
+    поэтому должен стоить как можно меньше
+    """
+
+    __slots__ = ("name", "rows", "elapsed", "_started")
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.elapsed = 0.0
+        self._started = 0.0
+
+    def __enter__(self):
+        """Начало замера"""
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Конец замера: исключение запроса считается ошибкой"""
+        self.elapsed = time.perf_counter() - self._started
+        if exc_type is not None:
+            query_errors.inc(self.name)
+        query_seconds.observe(self.elapsed, self.name)
+        query_rows.inc(self.name, amount=self.rows)
+        return False
+
+
+def measure_query(name):
+    """Замер времени и количества строк запроса к БД с именем `name`"""
+    return QueryMeasurement(name)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время работы и результаты обработчиков сообщений и нажатий кнопок.
+
+    Время считается от вызова обработчика до конца обработки обновления
+    диспетчером. Если обработчик выбросил исключение, то при
+    `post_process` оно ещё не обработано - вызов считается ошибкой
+    """
+
+    async def on_process_message(self, message, data):
+        """Начало обработки сообщения"""
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        """Конец обработки сообщения"""
+        self._stop("message", data)
+
+    async def on_process_callback_query(self, call, data):
+        """Начало обработки нажатия на кнопку"""
+        self._start(data)
+
+    async def on_post_process_callback_query(self, call, results, data):
+        """Конец обработки нажатия на кнопку"""
+        self._stop("callback_query", data)
+
+    def _start(self, data):
+        """Запоминаем обработчик и время начала его работы"""
+        handler = current_handler.get().__name__
+        data["metrics"] = (handler, time.perf_counter())
+
+    def _stop(self, update_type, data):
+        """Записываем время и результат работы обработчика"""
+        if "metrics" not in data:
+            unhandled_updates.inc(update_type)
+            return
+
+        handler, started = data["metrics"]
+        handler_seconds.observe(time.perf_counter() - started, handler)
+        outcome = "error" if sys.exc_info()[0] is not None else "ok"
+        handler_calls.inc(handler, outcome)
+
+
+async def handle_metrics(request):
+    """Обработчик запроса метрик"""
+    return web.Response(
+        body=render().encode(), headers={"Content-Type": CONTENT_TYPE}
+    )
+
+
+def create_app():
+    """Веб-приложение с метриками по пути `config.METRICS_PATH`"""
+    app = web.Application()
+    app.router.add_get(config.METRICS_PATH, handle_metrics)
+    return app
+
+
+async def start_server(host=None, port=None):
+    """Запуск отдельного сервера метрик (при поллинге).
+
+    Возвращаем `aiohttp.web.AppRunner` для остановки сервера
+    """
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    site = web.TCPSite(
+        runner,
+        host if host is not None else config.METRICS_HOST,
+        port if port is not None else config.METRICS_PORT,
+    )
+    await site.start()
+    return runner
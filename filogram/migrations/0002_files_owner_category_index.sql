@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS files_owner_category_idx
+ON files(owner_id, category, unique_id);
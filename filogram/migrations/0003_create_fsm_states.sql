@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS fsm_states (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS fsm_states_updated_at_idx
+ON fsm_states(updated_at);
@@ -0,0 +1,105 @@
+"""Модели данных"""
+from typing import NamedTuple, Optional
+
+
+class PendingDocument(NamedTuple):
+    """Телеграм-документ, ожидающий сохранения.
+
+    Хранит только поля, нужные для создания `FileModel`, поэтому
+    в данных состояния пользователя занимает меньше места, чем весь
+    документ с превью и вложенными объектами. После сериализации
+    в JSON документ восстанавливается из списка значений через `_make`
+    """
+
+    file_unique_id: str
+    file_id: str
+    file_name: str
+
+    @classmethod
+    def from_telegram_document(cls, document):
+        """Создание из телеграм-документа"""
+        return cls(
+            document.file_unique_id, document.file_id, document.file_name
+        )
+
+
+class FileModel(NamedTuple):
+    """Модель файла.
+
+    Модель представляет как входной файл (созданный из ввода пользователя),
+    так и файл полученный из БД.
+
+    Модель имеет 6 полей:
+    `file_unique_id` - уникальный ID файла в Telegram
+    `file_id`        - ID телеграм-документа для отправления в сообщении
+    `owner_id`       - ID пользователя, которому принадлежит данный файл
+    `category`       - пользовательская категория файла
+    `file_name`      - название файла
+    `unique_id`      - ID данного файла в нашей БД (имеется только у файлов,
+                       которые мы достали из БД)
+    """
+
+    file_unique_id: str
+    file_id: str
+    owner_id: int
+    category: str
+    file_name: str
+    unique_id: Optional[int] = None
+
+    def __eq__(self, other):
+        """Проверка на равенство файлов.
+
+        Сравниваюся поле `file_unique_id`. Так мы можем сравнивать
+        файлы ещё не попавшие в БД с теми, которые мы оттуда достали
+        (удобно при тестах)
+        """
+        return self.file_unique_id == other.file_unique_id
+
+    @classmethod
+    def from_telegram_document(cls, document, **kwargs):
+        """Создание модели из телеграм-документа.
+
+        Создаём модель файла из телеграм-документа и дополнительно
+        переданных параметров (тех, которых нет в документе,
+        это `owner_id` и `category`).
+
+        !! При создании через документ, у модели нет поля `unique_id`
+        """
+        file_unique_id = document.file_unique_id
+        file_id = document.file_id
+        file_name = document.file_name
+        return cls(
+            file_unique_id=file_unique_id,
+            file_id=file_id,
+            file_name=file_name,
+            **kwargs
+        )
+
+    @classmethod
+    def from_db_row(cls, cursor, row):
+        """Создание модели из строки БД.
+
+        Используется как `row_factory` курсора. Колонки выбираются
+        в порядке `db_columns`, совпадающем с порядком полей модели,
+        поэтому модель создаётся прямо из кортежа значений строки
+        """
+        return cls._make(row)
+
+    @classmethod
+    def db_columns(cls):
+        """Название полей для таблицы в БД"""
+        return cls._fields
+
+    def column_values(self):
+        """Значения файла сцеплённые с названием колонок.
+
+        Данные передаются для сохранения в БД, поэтому у модели
+        на текущий момент нет поля `unique_id`
+        """
+        return {
+            "file_unique_id": self.file_unique_id,
+            "file_id": self.file_id,
+            "owner_id": self.owner_id,
+            "category": self.category,
+            "file_name": self.file_name,
+        }
@@ -0,0 +1,346 @@
+"""Поллинг с параллельной обработкой обновлений разных пользователей.
+
+Обновления распределяются по очередям по `from_user.id`: обновления
+одного пользователя обрабатываются по порядку (например, отправка файлов
+и затем выбор категории), а разных пользователей - параллельно. Так же
+обрабатывает обновления и вебхук с быстрым подтверждением
+"""
+import asyncio
+from collections import deque
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.webhook import BaseResponse
+import aiohttp
+
+from . import metrics
+from .config import config
+from .logger import logger
+
+
+# поля обновления, в объектах которых есть отправитель
+_UPDATE_FIELDS_WITH_USER = (
+    "message",
+    "edited_message",
+    "callback_query",
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+    "poll_answer",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+# пауза (в секундах) перед повтором неудачного запроса обновлений,
+# удваивается после каждой ошибки подряд до POLLING_ERROR_MAX_DELAY
+POLLING_ERROR_DELAY = 1
+POLLING_ERROR_MAX_DELAY = 30
+# сколько секунд при остановке ждать обработки оставшихся обновлений
+DRAIN_TIMEOUT = 30
+
+
+def get_shard_key(update):
+    """Ключ распределения обновления: ID отправителя.
+
+    У обновлений без отправителя - ID обновления
+    """
+    for field in _UPDATE_FIELDS_WITH_USER:
+        obj = getattr(update, field)
+        if obj is None:
+            continue
+        user = obj.user if field == "poll_answer" else obj.from_user
+        if user is not None:
+            return user.id
+
+    return update.update_id
+
+
+def get_response(results):
+    """Ответ обработчика для вебхука из результатов обработки"""
+    for result in results or ():
+        if isinstance(result, BaseResponse):
+            return result
+
+    return None
+
+
+def get_media_group_id(update):
+    """ID альбома, к которому относится сообщение обновления"""
+    if update.message is None:
+        return None
+    return update.message.media_group_id
+
+
+class Shard:
+    """Очередь обновлений с метриками задержки обработки.
+
+    Вместе с обновлением в очереди хранится future для ответа
+    обработчика (либо None)
+    """
+
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize)
+        self.processed = 0
+        self.failed = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self._received = deque()  # время получения обновлений в очереди
+
+    async def put(self, update, future=None):
+        """Постановка обновления в очередь, когда в ней есть место"""
+        await self.queue.put((update, future))
+        self._received.append(time.monotonic())
+
+    def put_nowait(self, update, future=None):
+        """Постановка обновления в очередь без ожидания места"""
+        self.queue.put_nowait((update, future))
+        self._received.append(time.monotonic())
+
+    async def get(self):
+        """Следующее обновление из очереди и future для ответа"""
+        item = await self.queue.get()
+        lag = time.monotonic() - self._received.popleft()
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        return item
+
+    def stats(self):
+        """Метрики очереди.
+
+        `lag` - сколько секунд ждёт обработки самое старое обновление
+        в очереди, `lag_avg` и `lag_max` - по взятым из очереди
+        """
+        lag = time.monotonic() - self._received[0] if self._received else 0
+        taken = self.processed + self.failed
+        return {
+            "depth": self.queue.qsize(),
+            "lag": lag,
+            "lag_avg": self.lag_total / max(taken, 1),
+            "lag_max": self.lag_max,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+class ShardedUpdateRunner:
+    """Обработка обновлений в `shards` упорядоченных очередях.
+
+    Сообщения одного альбома обрабатываются одновременно, так как
+    обработчик первого сообщения ждёт остальные (`albums.AlbumCollector`),
+    но следующее обновление пользователя - только после всего альбома.
+    Ответ обработчика (`BaseResponse`) передаётся в future, поставленную
+    в очередь вместе с обновлением, а без неё или если её отменили -
+    отправляется запросом к Bot API. Параметры по умолчанию - из конфига
+    """
+
+    def __init__(self, dispatcher, shards=None, maxsize=None):
+        if shards is None:
+            shards = config.POLLING_CONCURRENCY
+        if maxsize is None:
+            maxsize = config.POLLING_SHARD_QUEUE_SIZE
+        self.dispatcher = dispatcher
+        self.shards = [Shard(maxsize) for _ in range(shards)]
+        self._tasks = []
+
+    def start(self):
+        """Запуск обработчиков очередей"""
+        self._tasks = [
+            asyncio.create_task(self._work(shard)) for shard in self.shards
+        ]
+
+    async def put(self, update):
+        """Постановка обновления в очередь его отправителя.
+
+        Если очередь заполнена, то ждём места в ней
+        """
+        await self._get_shard(update).put(update)
+
+    def put_nowait(self, update, future=None):
+        """Постановка обновления в очередь его отправителя без ожидания"""
+        self._get_shard(update).put_nowait(update, future)
+
+    def depth(self):
+        """Количество обновлений, ожидающих обработки во всех очередях"""
+        return sum(shard.queue.qsize() for shard in self.shards)
+
+    def stats(self):
+        """Метрики очередей"""
+        return [shard.stats() for shard in self.shards]
+
+    async def close(self, timeout=DRAIN_TIMEOUT):
+        """Остановка после обработки оставшихся обновлений"""
+        joins = [shard.queue.join() for shard in self.shards]
+        try:
+            await asyncio.wait_for(asyncio.gather(*joins), timeout)
+        except asyncio.TimeoutError:
+            depth = sum(shard.queue.qsize() for shard in self.shards)
+            logger.warning(f"Не обработано обновлений при остановке: {depth}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def poll(self, timeout=20, limit=100):
+        """Получение обновлений и распределение их по очередям.
+
+        Новые обновления запрашиваются, только когда для полученных
+        есть место в очередях. Как и в `aiogram`, ошибка получения
+        обновлений не останавливает поллинг: запрос повторяется после
+        паузы, которая растёт, пока ошибки идут подряд
+        """
+        bot = self.dispatcher.bot
+        offset = None
+        error_delay = POLLING_ERROR_DELAY
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, limit=limit, timeout=timeout
+                )
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                logger.warning(f"Ошибка сети при получении обновлений: {e!r}")
+                updates = None
+            except Exception:
+                logger.exception("Ошибка при получении обновлений")
+                updates = None
+
+            if updates is None:
+                await asyncio.sleep(error_delay)
+                error_delay = min(2 * error_delay, POLLING_ERROR_MAX_DELAY)
+                continue
+
+            error_delay = POLLING_ERROR_DELAY
+            for update in updates:
+                await self.put(update)
+            if updates:
+                offset = updates[-1].update_id + 1
+
+    async def report_lag(self, interval=None):
+        """Периодическая запись задержки обработки очередей в лог.
+
+        По умолчанию `interval` - `config.POLLING_LAG_REPORT_INTERVAL`
+        """
+        if interval is None:
+            interval = config.POLLING_LAG_REPORT_INTERVAL
+
+        while True:
+            await asyncio.sleep(interval)
+            lags = ", ".join(
+                f"{number}: {stats['lag']:.3f}s ({stats['depth']})"
+                for number, stats in enumerate(self.stats())
+                if stats["depth"]
+            )
+            if lags:
+                logger.info(f"Задержка очередей обновлений: {lags}")
+
+    def _get_shard(self, update):
+        """Очередь отправителя обновления"""
+        return self.shards[get_shard_key(update) % len(self.shards)]
+
+    async def _work(self, shard):
+        """Обработчик очереди.
+
+        Сообщения альбома обрабатываются одновременно, а следующее
+        обновление того же пользователя ждёт конца обработки альбома.
+        Обновления других пользователей очереди альбом не ждут: иначе
+        остальные сообщения альбома, стоящие за ними в очереди, не успели
+        бы попасть в собираемый альбом
+        """
+        Dispatcher.set_current(self.dispatcher)
+        Bot.set_current(self.dispatcher.bot)
+        # незавершённые альбомы по отправителям: ID альбома и задачи
+        albums = {}
+        while True:
+            update, future = await shard.get()
+            media_group_id = get_media_group_id(update)
+            sender = get_shard_key(update)
+            album = albums.get(sender)
+            if album is not None and album[0] != media_group_id:
+                await asyncio.gather(*album[1])
+                del albums[sender]
+
+            # своя задача - свой контекст: состояния обновлений
+            # в контекстных переменных aiogram не смешиваются
+            task = asyncio.create_task(self._process(shard, update, future))
+            if media_group_id is None:
+                await task
+            else:
+                albums.setdefault(sender, (media_group_id, []))[1].append(task)
+
+            albums = {
+                sender: album
+                for sender, album in albums.items()
+                if not all(task.done() for task in album[1])
+            }
+
+    async def _process(self, shard, update, future):
+        """Обработка обновления и передача или отправка ответа"""
+        try:
+            results = await self.dispatcher.process_update(update)
+            response = get_response(results)
+            if future is not None and not future.done():
+                future.set_result(response)
+            elif response is not None:
+                await response.execute_response(self.dispatcher.bot)
+        except Exception:
+            shard.failed += 1
+            logger.exception("Ошибка при обработке обновления")
+        else:
+            shard.processed += 1
+        finally:
+            if future is not None and not future.done():
+                future.set_result(None)
+            shard.queue.task_done()
+
+
+def start_sharded_polling(
+    dispatcher,
+    shards=None,
+    *,
+    skip_updates=False,
+    on_startup=None,
+    on_shutdown=None,
+):
+    """Запуск поллинга с обработкой обновлений в `shards` очередях.
+
+    Аналог `aiogram.utils.executor.start_polling`, работает до Ctrl+C.
+    По умолчанию `shards` - `config.POLLING_CONCURRENCY`
+    """
+    try:
+        asyncio.run(
+            _run_polling(
+                dispatcher, shards, skip_updates, on_startup, on_shutdown
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+async def _run_polling(
+    dispatcher, shards, skip_updates, on_startup, on_shutdown
+):
+    """Поллинг с колбэками запуска и остановки"""
+    Dispatcher.set_current(dispatcher)
+    Bot.set_current(dispatcher.bot)
+    if skip_updates:
+        await dispatcher.reset_webhook(True)
+        await dispatcher.skip_updates()
+    if on_startup is not None:
+        await on_startup(dispatcher)
+
+    runner = ShardedUpdateRunner(dispatcher, shards)
+    runner.start()
+    metrics.register_polling_runner(runner)
+    reporter = asyncio.create_task(runner.report_lag())
+    try:
+        await runner.poll()
+    finally:
+        reporter.cancel()
+        await runner.close()
+        logger.info(f"Метрики очередей обновлений: {runner.stats()}")
+        if on_shutdown is not None:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await (await dispatcher.bot.get_session()).close()
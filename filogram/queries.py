@@ -0,0 +1,246 @@
+"""Запросы к БД.
+
+Все запросы создаются один раз при импорте модуля (запросы к файлам -
+из полей `FileModel`) и выполняются по имени через функции модуля `db`
+"""
+from .db import Query, first_column
+from .models import FileModel
+
+
+_COLUMNS = ", ".join(FileModel.db_columns())
+# `unique_id` назначается самой БД
+_INSERT_COLUMNS = ", ".join(FileModel.db_columns()[:-1])
+_INSERT_PLACEHOLDERS = ", ".join(
+    f":{column}" for column in FileModel.db_columns()[:-1]
+)
+
+
+INSERT_FILE = Query(
+    "insert_file",
+    f"""
+    INSERT INTO files({_INSERT_COLUMNS})
+    VALUES ({_INSERT_PLACEHOLDERS})
+    """,
+)
+
+INSERT_NEW_FILE = Query(
+    "insert_new_file",
+    f"""
+    INSERT INTO files({_INSERT_COLUMNS})
+    VALUES ({_INSERT_PLACEHOLDERS})
+    ON CONFLICT(file_unique_id) DO NOTHING
+    """,
+)
+
+EXISTING_FILES = Query(
+    "existing_files",
+    """
+    SELECT file_unique_id
+    FROM files
+    WHERE file_unique_id IN (SELECT value FROM json_each(:keys))
+    """,
+)
+
+FILE = Query(
+    "file",
+    f"""
+    SELECT {_COLUMNS}
+    FROM files
+    WHERE unique_id = :unique_id AND owner_id = :owner_id
+    """,
+    FileModel.from_db_row,
+)
+
+OWNED_FILES = Query(
+    "owned_files",
+    f"""
+    SELECT {_COLUMNS}
+    FROM files
+    WHERE owner_id = :owner_id
+    ORDER BY category, unique_id
+    """,
+    FileModel.from_db_row,
+)
+
+OWNED_FILES_FIRST_PAGE = Query(
+    "owned_files_first_page",
+    f"""
+    SELECT {_COLUMNS}
+    FROM files
+    WHERE owner_id = :owner_id
+    ORDER BY category, unique_id
+    LIMIT :limit
+    """,
+    FileModel.from_db_row,
+)
+
+# страницы отсчитываются от файла с `unique_id` по ключу (category, unique_id)
+OWNED_FILES_PAGE_AFTER = Query(
+    "owned_files_page_after",
+    f"""
+    SELECT {_COLUMNS}
+    FROM files
+    WHERE owner_id = :owner_id AND (category, unique_id) > (
+        SELECT category, unique_id
+        FROM files
+        WHERE unique_id = :unique_id AND owner_id = :owner_id
+    )
+    ORDER BY category, unique_id
+    LIMIT :limit
+    """,
+    FileModel.from_db_row,
+)
+
+OWNED_FILES_PAGE_BEFORE = Query(
+    "owned_files_page_before",
+    f"""
+    SELECT {_COLUMNS}
+    FROM files
+    WHERE owner_id = :owner_id AND (category, unique_id) < (
+        SELECT category, unique_id
+        FROM files
+        WHERE unique_id = :unique_id AND owner_id = :owner_id
+    )
+    ORDER BY category DESC, unique_id DESC
+    LIMIT :limit
+    """,
+    FileModel.from_db_row,
+)
+
+CATEGORY_FILES = Query(
+    "category_files",
+    f"""
+    SELECT {_COLUMNS}
+    FROM files
+    WHERE owner_id = :owner_id AND category = :category
+    ORDER BY unique_id
+    """,
+    FileModel.from_db_row,
+)
+
+# файлы категории выбираются частями по ключу `unique_id`
+CATEGORY_FILES_CHUNK = Query(
+    "category_files_chunk",
+    f"""
+    SELECT {_COLUMNS}
+    FROM files
+    WHERE owner_id = :owner_id AND category = :category
+        AND unique_id > :after
+    ORDER BY unique_id
+    LIMIT :limit
+    """,
+    FileModel.from_db_row,
+)
+
+CATEGORY_FILES_COUNT = Query(
+    "category_files_count",
+    """
+    SELECT COUNT(*)
+    FROM files
+    WHERE owner_id = :owner_id AND category = :category
+    """,
+    first_column,
+)
+
+USER_CATEGORIES = Query(
+    "user_categories",
+    """
+    SELECT DISTINCT category
+    FROM files
+    WHERE owner_id = :owner_id
+    ORDER BY category
+    """,
+    first_column,
+)
+
+DELETE_FILE = Query(
+    "delete_file",
+    """
+    DELETE FROM files
+    WHERE unique_id = :unique_id AND owner_id = :owner_id
+    """,
+)
+
+DELETE_CATEGORY_FILES = Query(
+    "delete_category_files",
+    """
+    DELETE FROM files
+    WHERE owner_id = :owner_id AND category = :category
+    """,
+)
+
+
+# состояния пользователей (FSM) в хранилище `fsm_storage.SQLiteStorage`
+FSM_STATE = Query(
+    "fsm_state",
+    """
+    SELECT state
+    FROM fsm_states
+    WHERE chat_id = :chat_id AND user_id = :user_id
+    """,
+    first_column,
+)
+
+FSM_DATA = Query(
+    "fsm_data",
+    """
+    SELECT data
+    FROM fsm_states
+    WHERE chat_id = :chat_id AND user_id = :user_id
+    """,
+    first_column,
+)
+
+FSM_STATE_AND_DATA = Query(
+    "fsm_state_and_data",
+    """
+    SELECT state, data
+    FROM fsm_states
+    WHERE chat_id = :chat_id AND user_id = :user_id
+    """,
+)
+
+SET_FSM_STATE = Query(
+    "set_fsm_state",
+    """
+    INSERT INTO fsm_states(chat_id, user_id, state, updated_at)
+    VALUES (:chat_id, :user_id, :state, :updated_at)
+    ON CONFLICT(chat_id, user_id) DO UPDATE
+    SET state = excluded.state, updated_at = excluded.updated_at
+    """,
+)
+
+SET_FSM_DATA = Query(
+    "set_fsm_data",
+    """
+    INSERT INTO fsm_states(chat_id, user_id, data, updated_at)
+    VALUES (:chat_id, :user_id, :data, :updated_at)
+    ON CONFLICT(chat_id, user_id) DO UPDATE
+    SET data = excluded.data, updated_at = excluded.updated_at
+    """,
+)
+
+DELETE_EMPTY_FSM_STATE = Query(
+    "delete_empty_fsm_state",
+    """
+    DELETE FROM fsm_states
+    WHERE chat_id = :chat_id AND user_id = :user_id
+        AND state IS NULL AND data = '{}'
+    """,
+)
+
+DELETE_FSM_STATE = Query(
+    "delete_fsm_state",
+    """
+    DELETE FROM fsm_states
+    WHERE chat_id = :chat_id AND user_id = :user_id
+    """,
+)
+
+DELETE_EXPIRED_FSM_STATES = Query(
+    "delete_expired_fsm_states",
+    """
+    DELETE FROM fsm_states
+    WHERE updated_at < :expired_before
+    """,
+)
@@ -0,0 +1,237 @@
+"""Планировщик отправки запросов к Telegram Bot API.
+
+Запросы к чатам ограничиваются по частоте для каждого чата и для бота
+в целом, как того требует Telegram. Ответы пользователям отправляются
+раньше массовых отправок, а при `RetryAfter` запрос повторяется
+"""
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+import heapq
+from itertools import count
+import time
+
+from aiogram import Bot
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
+from aiogram.utils.exceptions import RetryAfter
+
+from .config import config
+
+
+# приоритеты запросов, меньше - раньше
+INTERACTIVE = 0
+BULK = 1
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+_priority = ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk():
+    """Отправка запросов внутри блока с приоритетом массовой отправки"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Ограничение частоты: `rate` запросов в секунду, до `capacity` разом"""
+
+    def __init__(self, rate, capacity, timer=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._timer = timer
+        self._tokens = capacity
+        self._updated = timer()
+
+    def try_take(self):
+        """Взятие разрешения, если оно есть"""
+        self._refill()
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+    def delay(self):
+        """Сколько секунд ждать до появления разрешения"""
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def reserve(self):
+        """Взятие разрешения в долг.
+
+        Возвращаем, сколько секунд ждать до его наступления. Разрешения
+        выдаются в порядке вызовов, поэтому запросы не обгоняют друг друга
+        """
+        self._refill()
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    def is_full(self):
+        """Накоплены ли все разрешения"""
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def _refill(self):
+        """Начисление разрешений за прошедшее время"""
+        now = self._timer()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+
+class SendScheduler:
+    """Очередь запросов к чатам с ограничением частоты и приоритетами.
+
+    Сначала запрос ждёт разрешения своего чата (по очереди с другими
+    запросами в этот чат), затем общего разрешения бота, которые
+    выдаются ожидающим запросам по приоритету. `queue_depth` и счётчик
+    `retries` показывают, насколько ограничения тормозят отправку, и
+    отдаются в метриках (`metrics.register_send_scheduler`).
+    Параметры по умолчанию - из конфига
+    """
+
+    def __init__(
+        self,
+        global_rate=None,
+        global_burst=None,
+        chat_rate=None,
+        chat_burst=None,
+        max_retries=None,
+    ):
+        if global_rate is None:
+            global_rate = config.SEND_GLOBAL_RATE
+        if global_burst is None:
+            global_burst = config.SEND_GLOBAL_BURST
+        if chat_rate is None:
+            chat_rate = config.SEND_CHAT_RATE
+        if chat_burst is None:
+            chat_burst = config.SEND_CHAT_BURST
+        if max_retries is None:
+            max_retries = config.SEND_MAX_RETRIES
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retries = 0
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}
+        self._prune_at = 1024
+        self._waiters = []
+        self._sequence = count()
+        self._releaser = None
+        self._waiting = dict.fromkeys(_PRIORITY_NAMES, 0)
+
+    def queue_depth(self):
+        """Количество ожидающих отправки запросов по приоритетам"""
+        return {
+            _PRIORITY_NAMES[priority]: waiting
+            for priority, waiting in self._waiting.items()
+        }
+
+    async def run(self, chat_id, call):
+        """Выполнение запроса `call` к чату после получения разрешений.
+
+        При `RetryAfter` запрос повторяется через указанное Telegram
+        время, но не больше `max_retries` раз
+        """
+        priority = _priority.get()
+        self._waiting[priority] += 1
+        try:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            await self._acquire_global(priority)
+        finally:
+            self._waiting[priority] -= 1
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await call()
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+
+                self.retries += 1
+                await asyncio.sleep(e.timeout)
+
+    def _chat_bucket(self, chat_id):
+        """Ограничение частоты запросов к чату.
+
+        Ограничения, накопившие все разрешения, ничем не отличаются
+        от новых, поэтому периодически удаляются
+        """
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._prune_at:
+                self._prune_chat_buckets()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+
+        return bucket
+
+    def _prune_chat_buckets(self):
+        """Удаление ограничений чатов, накопивших все разрешения"""
+        self._chat_buckets = {
+            chat_id: bucket
+            for chat_id, bucket in self._chat_buckets.items()
+            if not bucket.is_full()
+        }
+        self._prune_at = max(1024, 2 * len(self._chat_buckets))
+
+    async def _acquire_global(self, priority):
+        """Ожидание общего разрешения в очереди по приоритету"""
+        if not self._waiters and self._global_bucket.try_take():
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        if self._releaser is None or self._releaser.done():
+            self._releaser = asyncio.create_task(self._release_waiters())
+        await waiter
+
+    async def _release_waiters(self):
+        """Выдача общих разрешений ожидающим запросам по приоритету"""
+        while self._waiters:
+            delay = self._global_bucket.delay()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            (_, _, waiter) = heapq.heappop(self._waiters)
+            if not waiter.done():  # запрос мог быть отменён
+                self._global_bucket.try_take()
+                waiter.set_result(None)
+
+
+def get_api_server():
+    """Сервер Bot API, на который бот отправляет запросы"""
+    if config.BOT_API_URL:
+        return TelegramAPIServer.from_base(config.BOT_API_URL)
+
+    return TELEGRAM_PRODUCTION
+
+
+class SchedulingBot(Bot):
+    """Бот, отправляющий запросы к чатам через `SendScheduler`.
+
+    Запросы без чата (например, получение обновлений) выполняются сразу
+    """
+
+    def __init__(self, *args, scheduler=None, **kwargs):
+        kwargs.setdefault("server", get_api_server())
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or SendScheduler()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        """Запрос к Bot API"""
+        chat_id = (data or {}).get("chat_id")
+        call = partial(super().request, method, data, files, **kwargs)
+        if chat_id is None:
+            return await call()
+
+        return await self.scheduler.run(chat_id, call)
@@ -0,0 +1,89 @@
+"""Отправка файлов пользователю"""
+import asyncio
+
+from aiogram.types.input_media import MediaGroup, InputMediaDocument
+
+from . import file_service
+from . import send_scheduler
+from . import templates
+from .config import config
+
+
+async def send_category_files(category, user_id, message):
+    """Отправка всех файлов категории альбомами.
+
+    Файлы выбираются из БД частями по размеру альбома, пока отправляется
+    текущий альбом (не больше `MEDIA_GROUP_PREFETCH` альбомов заранее).
+    Альбомы отправляются по очереди, чтобы они пришли в порядке файлов,
+    и с приоритетом массовой отправки. Альбом не может состоять из одного
+    файла, поэтому последний файл, оставшийся без альбома, отправляется
+    отдельным сообщением.
+    Для больших категорий отправляется сообщение о ходе отправки.
+    Возвращаем количество отправленных файлов
+    """
+    total = await file_service.acount_category_files(category, user_id)
+    if not total:
+        await message.answer(templates.NO_CATEGORY_FILES)
+        return 0
+
+    progress = None
+    if total > config.SEND_PROGRESS_MIN_FILES:
+        progress = await message.answer(
+            templates.SEND_PROGRESS.format(sent=0, total=total)
+        )
+
+    chunks = asyncio.Queue(maxsize=config.MEDIA_GROUP_PREFETCH)
+    reader = asyncio.create_task(_read_chunks(category, user_id, chunks))
+    try:
+        with send_scheduler.bulk():
+            return await _send_albums(chunks, message, progress, total)
+    finally:
+        reader.cancel()
+
+
+async def _send_albums(chunks, message, progress, total):
+    """Отправка альбомов из очереди с обновлением хода отправки"""
+    sent = 0
+    albums_sent = 0
+    while True:
+        files = await chunks.get()
+        if files is None:
+            return sent
+        if isinstance(files, Exception):
+            raise files
+
+        if len(files) == 1:
+            await message.answer_document(files[0].file_id)
+        else:
+            await message.answer_media_group(create_media_group(files))
+        sent += len(files)
+        albums_sent += 1
+        is_report_album = albums_sent % config.SEND_PROGRESS_EVERY == 0
+        if progress and (is_report_album or sent == total):
+            await progress.edit_text(
+                templates.SEND_PROGRESS.format(sent=sent, total=total)
+            )
+
+
+async def _read_chunks(category, user_id, chunks):
+    """Выбор файлов категории в очередь частями по размеру альбома.
+
+    Конец файлов обозначается `None`, а ошибка при выборе передаётся
+    через очередь, чтобы её выбросила отправка
+    """
+    try:
+        async for files in file_service.aiter_category_files_chunks(
+            category, user_id, config.MEDIA_GROUP_SIZE
+        ):
+            await chunks.put(files)
+    except Exception as e:
+        await chunks.put(e)
+    else:
+        await chunks.put(None)
+
+
+def create_media_group(files):
+    """Создание альбома из файлов"""
+    media_group = MediaGroup()
+    media_group.attach_many(*(InputMediaDocument(f.file_id) for f in files))
+    return media_group
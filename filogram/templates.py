@@ -1,18 +1,92 @@
 """Шаблоны и готовые ответы для бота"""
 from . import keyboards
+from .config import config
 
 
 def generate_grouped_files_text(files_with_categories):
-    """Создание текста о файлах пользователя по шаблону"""
+    """Создание текста о файлах пользователя по шаблону.
+
+    Длинные категории и имена файлов сокращаются (`shorten`). Файл без
+    имени обозначается уникальным ID
+    """
     return "\n\n".join(
         FILES_WITH_CATEGORIES.format(
-            category=category,
-            files="\n\n".join(SINGLE_FILE.format(file=file) for file in files),
+            category=shorten(category),
+            files="\n\n".join(
+                SINGLE_FILE.format(
+                    file=file,
+                    file_name=shorten(file.file_name or file.file_unique_id),
+                )
+                for file in files
+            ),
         )
         for category, files in files_with_categories.items()
     )
 
 
+def shorten(text, max_length=None):
+    """Сокращение текста до `max_length` символов с многоточием.
+
+    По умолчанию `max_length` - `config.OWNED_FILES_NAME_MAX_LENGTH`
+    """
+    if max_length is None:
+        max_length = config.OWNED_FILES_NAME_MAX_LENGTH
+
+    if len(text) <= max_length:
+        return text
+    return text[: max_length - 1] + "…"
+
+
+def generate_save_report(results):
+    """Создание отчёта о сохранении файлов.
+
+    `results` - `SaveResult` каждого файла. Уже сохранённые ранее файлы
+    перечисляются в одном сообщении вместе с итогом сохранения. У файла
+    может не быть имени - тогда вместо него указывается уникальный ID
+    """
+    duplicates = [
+        result.file.file_name or result.file.file_unique_id
+        for result in results
+        if not result.saved
+    ]
+    if not duplicates:
+        return ALL_FILES_SAVED
+
+    summary = (
+        NO_FILES_SAVED if len(duplicates) == len(results) else REST_FILES_SAVED
+    )
+    return ALREADY_SAVED_FILES.format(
+        files="\n".join(duplicates), summary=summary
+    )
+
+
+def split_text(text, max_length=None):
+    """Разбиение текста на сообщения не длиннее `max_length`.
+
+    Текст разбивается по строкам, а слишком длинные строки - на части.
+    Пустые строки на границах сообщений отбрасываются.
+    По умолчанию `max_length` - `config.MESSAGE_MAX_LENGTH`
+    """
+    if max_length is None:
+        max_length = config.MESSAGE_MAX_LENGTH
+
+    messages = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > max_length:
+            messages.append(line[:max_length])
+            line = line[max_length:]
+
+        if current and len(current) + 1 + len(line) > max_length:
+            messages.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+
+    messages.append(current)
+    return [message.strip("\n") for message in messages if message.strip()]
+
+
 START_MESSAGE = (
     "Привет! Я - Filogram, бот, позволяющий удобно хранить файлы.\n"
     "Чтобы загрузить файл, отправьте его и выберите для него категорию\n\n"
@@ -29,7 +103,7 @@ INCORRECT_CATEGORY_NAME = "Недопустимое название катег
 
 FILES_WITH_CATEGORIES = "*{category}*\n\n{files}"
 SINGLE_FILE = (
-    "`{file.file_name}`\n"
+    "`{file_name}`\n"
     "_Получить файл:_ /f{file.unique_id:04}\n"
     "_Удалить файл:_ /d{file.unique_id:04}"
 )
@@ -39,4 +113,20 @@ NO_FILES_UPLOADED_YET = (
     "Вы можете загрузить их, отправив в виде файла"
 )
 
+NO_CATEGORY_FILES = "У вас нет файлов в данной категории"
+
+TOO_MANY_PENDING_DOCUMENTS = (
+    "Нельзя сохранить больше {max_documents} файлов за раз. "
+    "Выберите категорию для уже отправленных"
+)
+
+SEND_PROGRESS = "Отправлено {sent} из {total} файлов"
+
+ALL_FILES_SAVED = "Все файлы сохранены!"
+# если какой-то файл не был сохранён, то он перечислен в отчёте,
+# поэтому используется слово "остальные"
+REST_FILES_SAVED = "Остальные файлы сохранены!"
+NO_FILES_SAVED = "Ни один файл не сохранён!"
+ALREADY_SAVED_FILES = "Уже сохранены:\n{files}\n\n{summary}"
+
 FILE_ALREADY_EXISTS = "Данный файл уже сохранён"
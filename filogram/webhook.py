@@ -0,0 +1,250 @@
+"""Вебхук с быстрым подтверждением обновлений.
+
+Обычный вебхук aiogram отвечает Telegram только после обработки
+обновления (запросов к БД и к Bot API), и медленные ответы Telegram
+считает ошибками и присылает обновление повторно. Здесь обновление
+кладётся в ограниченную очередь, которую разбирают обработчики
+по пользователям, а ответ отправляется сразу. Если очередь заполнена,
+то Telegram получает 429 и повторит обновление позже
+"""
+import asyncio
+
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
+
+from . import metrics
+from .config import config
+from .logger import logger
+from .polling import DRAIN_TIMEOUT, ShardedUpdateRunner
+
+
+UPDATE_QUEUE_KEY = "UPDATE_QUEUE"
+# через сколько секунд Telegram повторяет отклонённое обновление
+REJECTED_RETRY_AFTER = 1
+
+
+class UpdateQueue:
+    """Ограниченная очередь обновлений с обработкой по пользователям.
+
+    Обновления распределяются по `workers` очередям по отправителю
+    (`polling.ShardedUpdateRunner`): обновления одного пользователя
+    обрабатываются по порядку, как при обычном вебхуке, когда Telegram
+    не присылает следующее обновление до ответа на предыдущее, а разных
+    пользователей - параллельно. Всего обработки ждут не больше `maxsize`
+    обновлений. Ответ обработчика (`BaseResponse`) можно получить через
+    future, возвращаемую `submit`, а если её отменили - он отправляется
+    запросом к Bot API. Параметры по умолчанию - из конфига
+    """
+
+    def __init__(self, maxsize=None, workers=None):
+        if maxsize is None:
+            maxsize = config.WEBHOOK_QUEUE_SIZE
+        if workers is None:
+            workers = config.WEBHOOK_QUEUE_WORKERS
+        self.maxsize = maxsize
+        self.workers = workers
+        self.accepted = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self._runner = None
+        self._accepting = False
+
+    async def start(self, dispatcher):
+        """Запуск обработчиков очереди"""
+        # очереди пользователей не ограничены, их ограничивает `maxsize`
+        self._runner = ShardedUpdateRunner(dispatcher, self.workers, 0)
+        self._runner.start()
+        self._accepting = True
+        metrics.webhook_queue_depth.set_function(self.depth)
+        metrics.webhook_queue_lag.set_function(self.lag)
+        metrics.webhook_queue_accepted.set_function(lambda: self.accepted)
+        metrics.webhook_queue_rejected.set_function(lambda: self.rejected)
+
+    def submit(self, update):
+        """Постановка обновления в очередь.
+
+        Возвращаем future с ответом обработчика (либо None), или None,
+        если очередь не запущена или заполнена
+        """
+        if not self._accepting or self.depth() >= self.maxsize:
+            self.rejected += 1
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._runner.put_nowait(update, future)
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self.depth())
+        return future
+
+    def depth(self):
+        """Количество обновлений, ожидающих обработки"""
+        return self._runner.depth() if self._runner is not None else 0
+
+    def lag(self):
+        """Сколько секунд ждёт обработки самое старое обновление"""
+        return max((shard["lag"] for shard in self._shard_stats()), default=0)
+
+    def stats(self):
+        """Метрики очереди"""
+        shards = self._shard_stats()
+        taken = sum(shard["processed"] + shard["failed"] for shard in shards)
+        wait_time_total = sum(
+            shard["lag_avg"] * (shard["processed"] + shard["failed"])
+            for shard in shards
+        )
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "maxsize": self.maxsize,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": sum(shard["processed"] for shard in shards),
+            "failed": sum(shard["failed"] for shard in shards),
+            "lag": self.lag(),
+            "wait_time_avg": wait_time_total / max(taken, 1),
+            "wait_time_max": max(
+                (shard["lag_max"] for shard in shards), default=0
+            ),
+        }
+
+    async def close(self, timeout=DRAIN_TIMEOUT):
+        """Остановка после обработки оставшихся обновлений.
+
+        Новые обновления больше не принимаются
+        """
+        if not self._accepting:
+            return
+
+        self._accepting = False
+        await self._runner.close(timeout)
+
+    def _shard_stats(self):
+        """Метрики очередей пользователей"""
+        return self._runner.stats() if self._runner is not None else []
+
+
+async def wait_response(future):
+    """Ожидание ответа обработчика, пока можно ответить на вебхук.
+
+    Ответ может появиться, пока ожидание отменяется по таймауту: тогда
+    `future` уже выполнена и ответ не будет отправлен запросом к Bot API,
+    поэтому он возвращается для ответа на вебхук
+    """
+    timeout = config.WEBHOOK_INLINE_REPLY_TIMEOUT
+    if timeout <= 0:
+        return None
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        if future.done() and not future.cancelled():
+            return future.result()
+        return None
+
+
+class FastAckWebhookRequestHandler(WebhookRequestHandler):
+    """Обработчик запросов вебхука, отвечающий до обработки обновления.
+
+    Ответ обработчика возвращается в ответе на вебхук (без отдельного
+    запроса к Bot API), только если обновление обработано не дольше
+    `config.WEBHOOK_INLINE_REPLY_TIMEOUT` секунд
+    """
+
+    async def post(self):
+        """Постановка обновления в очередь и ответ Telegram"""
+        self.validate_ip()
+        dispatcher = self.get_dispatcher()
+        update = await self.parse_update(dispatcher.bot)
+
+        future = self.request.app[UPDATE_QUEUE_KEY].submit(update)
+        if future is None:
+            raise web.HTTPTooManyRequests(
+                headers={"Retry-After": str(REJECTED_RETRY_AFTER)}
+            )
+
+        try:
+            response = await wait_response(future)
+        finally:
+            # ответ, полученный позже, отправляется запросом к Bot API
+            future.cancel()
+
+        if response is not None:
+            return response.get_web_response()
+        return web.Response(text="ok")
+
+
+def set_fast_ack_webhook(
+    dispatcher,
+    webhook_path,
+    *,
+    skip_updates=None,
+    on_startup=None,
+    on_shutdown=None,
+    update_queue=None,
+    web_app=None,
+):
+    """Настройка вебхука с очередью обновлений.
+
+    Аналог `aiogram.utils.executor.set_webhook`: возвращаем `Executor`,
+    веб-приложение которого нужно запустить. Очередь запускается
+    до колбэков `on_startup`, а останавливается до колбэков `on_shutdown`.
+    Вебхук добавляется в `web_app`, если оно передано
+    """
+    if update_queue is None:
+        update_queue = UpdateQueue()
+
+    async def start_queue(dp):
+        await update_queue.start(dp)
+
+    async def close_queue(dp):
+        await update_queue.close()
+        logger.info(f"Метрики очереди обновлений: {update_queue.stats()}")
+
+    executor = Executor(dispatcher, skip_updates=skip_updates)
+    executor.on_startup([start_queue, *_as_list(on_startup)], polling=False)
+    executor.on_shutdown([close_queue, *_as_list(on_shutdown)], polling=False)
+    executor.set_webhook(
+        webhook_path,
+        request_handler=FastAckWebhookRequestHandler,
+        web_app=web_app,
+    )
+    executor.web_app[UPDATE_QUEUE_KEY] = update_queue
+    return executor
+
+
+def start_fast_ack_webhook(
+    dispatcher,
+    webhook_path,
+    *,
+    skip_updates=None,
+    on_startup=None,
+    on_shutdown=None,
+    update_queue=None,
+    web_app=None,
+    **kwargs,
+):
+    """Запуск вебхука с очередью обновлений.
+
+    Аналог `aiogram.utils.executor.start_webhook`, параметры - как у
+    `set_fast_ack_webhook`, `kwargs` - параметры `aiohttp.web.run_app`
+    """
+    executor = set_fast_ack_webhook(
+        dispatcher,
+        webhook_path,
+        skip_updates=skip_updates,
+        on_startup=on_startup,
+        on_shutdown=on_shutdown,
+        update_queue=update_queue,
+        web_app=web_app,
+    )
+    executor.run_app(**kwargs)
+
+
+def _as_list(callbacks):
+    """Колбэки в виде списка"""
+    if callbacks is None:
+        return []
+    if isinstance(callbacks, (list, tuple)):
+        return list(callbacks)
+    return [callbacks]
@@ -0,0 +1,208 @@
+"""Запуск бота через вебхук в нескольких процессах.
+
+Каждый процесс открывает свой сокет на одном и том же порту
+(SO_REUSEPORT), поэтому входящие запросы распределяет ядро. У процессов
+свои соединения к БД в режиме WAL. Вебхук устанавливает и удаляет только
+родительский процесс - после запуска и после остановки всех процессов
+"""
+import asyncio
+import multiprocessing
+from multiprocessing.connection import wait
+import signal
+
+from aiogram import Bot
+from aiohttp import web
+
+from .config import config
+
+
+# сколько секунд ждать запуска процессов
+STARTUP_TIMEOUT = 60
+
+
+def run_webhook_workers(
+    workers, webhook_url, fast_ack=False, **webhook_params
+):
+    """Запуск `workers` процессов с вебхуком.
+
+    Родительский процесс применяет миграции БД, запускает процессы
+    и ждёт, пока каждый из них начнёт принимать запросы, после чего
+    устанавливает вебхук. Если один из процессов завершился, то
+    останавливаются и остальные. Вебхук удаляется после остановки
+    всех процессов. При `fast_ack` процессы отвечают на вебхук до
+    обработки обновлений. `webhook_params` - `webhook_path`, `host` и `port`
+    """
+    from . import db
+    from .logger import logger
+
+    # миграции применены при инициализации, процессам соединение не нужно
+    db.close_connection()
+
+    # SIGTERM останавливает процессы так же, как Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    context = multiprocessing.get_context("spawn")
+    ready_events = [context.Event() for _ in range(workers)]
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(workers, number, ready, fast_ack, webhook_params),
+            name=f"webhook-worker-{number}",
+        )
+        for number, ready in enumerate(ready_events)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        _wait_ready(processes, ready_events)
+        asyncio.run(_set_webhook(webhook_url))
+        logger.info(f"Запуск бота через вебхук в {workers} процессах")
+        wait([process.sentinel for process in processes])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+        asyncio.run(_delete_webhook())
+        logger.info("Работа бота завершена")
+
+
+def _wait_ready(processes, ready_events):
+    """Ожидание запуска всех процессов.
+
+    Процесс запущен, когда его сокет открыт и принимает запросы, поэтому
+    после ожидания можно устанавливать вебхук. Если какой-то процесс
+    завершился при запуске, или не успел запуститься, то выбрасывается
+    исключение `RuntimeError`
+    """
+    for process, ready in zip(processes, ready_events):
+        if not ready.wait(STARTUP_TIMEOUT) or not process.is_alive():
+            raise RuntimeError(f"Процесс {process.name} не запустился")
+
+
+async def _set_webhook(webhook_url):
+    """Установка вебхука с пропуском накопившихся обновлений"""
+    from .send_scheduler import get_api_server
+
+    bot = Bot(token=config.BOT_TOKEN, server=get_api_server())
+    try:
+        await bot.set_webhook(webhook_url, drop_pending_updates=True)
+    finally:
+        await (await bot.get_session()).close()
+
+
+async def _delete_webhook():
+    """Удаление вебхука"""
+    from .send_scheduler import get_api_server
+
+    bot = Bot(token=config.BOT_TOKEN, server=get_api_server())
+    try:
+        await bot.delete_webhook()
+    finally:
+        await (await bot.get_session()).close()
+
+
+def run_worker(workers, number, ready, fast_ack, webhook_params):
+    """Запуск процесса номер `number` с вебхуком.
+
+    Выполняется в новом интерпретаторе, поэтому конфиг (этап берётся
+    из переменной окружения STAGE) меняется до инициализации логгера
+    и создания диспетчера.
+    О готовности процесс сообщает через `ready`, когда его сокет открыт.
+    Метрики процесса с меткой `worker` отдаются отдельным сервером
+    на порту `METRICS_PORT + number`: порт вебхука общий, и запрос
+    метрик попадал бы в случайный процесс
+    """
+    # ограничение Telegram на отправку общее для всех процессов
+    config.SEND_GLOBAL_RATE /= workers
+    config.SEND_GLOBAL_BURST = max(1, config.SEND_GLOBAL_BURST // workers)
+    config.CATEGORIES_CACHE_TTL = min(
+        config.CATEGORIES_CACHE_TTL, config.WORKERS_CATEGORIES_CACHE_TTL
+    )
+    # у каждого процесса свой файл лога: иначе процессы ротировали бы
+    # один и тот же файл независимо друг от друга
+    logs_path = config.LOGS_PATH
+    process_name = multiprocessing.current_process().name
+    config.LOGS_PATH = logs_path.with_name(
+        f"{logs_path.stem}-{process_name}{logs_path.suffix}"
+    )
+    config.METRICS_PORT += number
+
+    from aiogram.utils.executor import set_webhook
+
+    from . import metrics
+    from .app import create_app
+    from .webhook import set_fast_ack_webhook
+
+    metrics.set_constant_labels(worker=number)
+    dp = create_app()
+    set_worker_webhook = set_fast_ack_webhook if fast_ack else set_webhook
+    executor = set_worker_webhook(
+        dispatcher=dp,
+        webhook_path=webhook_params["webhook_path"],
+        skip_updates=False,
+        on_startup=on_worker_startup,
+        on_shutdown=on_worker_shutdown,
+    )
+    serve(
+        executor.web_app,
+        ready,
+        host=webhook_params["host"],
+        port=webhook_params["port"],
+        loop=executor.loop,
+    )
+
+
+def serve(web_app, ready, host=None, port=None, loop=None):
+    """Работа веб-приложения процесса до SIGTERM или Ctrl+C.
+
+    В отличие от `aiohttp.web.run_app` сокет открывается с SO_REUSEPORT
+    и после его открытия устанавливается `ready`
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    runner = web.AppRunner(web_app, handle_signals=True)
+    try:
+        loop.run_until_complete(start_site(runner, ready, host, port))
+        loop.run_forever()
+    except (web.GracefulExit, KeyboardInterrupt):
+        pass
+    finally:
+        loop.run_until_complete(runner.cleanup())
+
+
+async def start_site(runner, ready, host=None, port=None):
+    """Запуск веб-приложения: `ready` устанавливается, когда сокет открыт.
+
+    Колбэки запуска приложения выполняются до открытия сокета
+    """
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=True)
+    await site.start()
+    ready.set()
+
+
+async def on_worker_startup(dp):
+    """Колбэк при запуске процесса: запуск сервера метрик"""
+    from . import metrics
+    from .cli import METRICS_RUNNER_KEY
+
+    dp[METRICS_RUNNER_KEY] = await metrics.start_server()
+
+
+async def on_worker_shutdown(dp):
+    """Колбэк при остановке процесса"""
+    from . import db
+    from . import file_service
+    from .cli import METRICS_RUNNER_KEY
+
+    await dp[METRICS_RUNNER_KEY].cleanup()
+    await file_service.close_write_queue()
+    db.close_connection()
+    await (await dp.bot.get_session()).close()
@@ -1,13 +1,14 @@
-import os
+from filogram import app
+from filogram import db
+from filogram import file_service
 
-os.environ["STAGE"] = "dev"  # переменная окружения для dev конфига
 
-from filogram import db  # noqa: E402
+app.init("dev")
 
-
-pytest_plugins = ["file_service_fixtures", "not_raises"]
+pytest_plugins = ["fake_bot", "file_service_fixtures", "not_raises"]
 
 
 def pytest_runtest_teardown(item):
-    """Новая БД после каждого теста"""
+    """Новая БД и пустой кэш после каждого теста"""
     db.reset_connection()
+    file_service.categories_cache.clear()
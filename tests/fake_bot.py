@@ -0,0 +1,134 @@
+import json
+from itertools import count
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.utils.exceptions import BadRequest
+import pytest
+
+from filogram import bot
+from filogram.albums import AlbumCollector
+from filogram.fsm_storage import SQLiteStorage
+from filogram.logger import RepeatedErrorLimiter
+
+
+TOKEN = "123456:AABBCCDDEEFFaabbccddeeff-1234567890"
+
+
+class FakeBot(Bot):
+    """Бот, записывающий запросы к Bot API вместо их отправки.
+
+    Отвечает так же, как Telegram: отправленными сообщениями,
+    а альбом меньше чем из 2 файлов отклоняет
+    """
+
+    def __init__(self):
+        super().__init__(TOKEN)
+        self.calls = []
+        self._message_ids = count(1)
+
+    def methods(self):
+        return [method for (method, _) in self.calls]
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        data = data or {}
+        self.calls.append((method, data))
+        if method == "sendMediaGroup":
+            media = json.loads(data["media"])
+            if len(media) < 2:
+                raise BadRequest("Too few media in the group")
+            return [self._message(data) for _ in media]
+        if method in ("sendMessage", "sendDocument", "editMessageText"):
+            return self._message(data)
+
+        return True
+
+    def _message(self, data):
+        return {
+            "message_id": next(self._message_ids),
+            "date": 0,
+            "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+            "text": data.get("text", ""),
+        }
+
+
+@pytest.fixture
+def fake_bot():
+    fake_bot = FakeBot()
+    Bot.set_current(fake_bot)
+    return fake_bot
+
+
+@pytest.fixture
+def dispatcher(fake_bot, monkeypatch):
+    """Диспетчер с обработчиками бота и фейковым ботом"""
+    monkeypatch.setattr(bot, "albums", AlbumCollector(debounce=0.01))
+    monkeypatch.setattr(bot, "error_limiter", RepeatedErrorLimiter(60, 10))
+    dp = Dispatcher(fake_bot, storage=SQLiteStorage())
+    bot.register_handlers(dp)
+    Dispatcher.set_current(dp)
+    return dp
+
+
+@pytest.fixture
+def create_message_update():
+    update_ids = count(1)
+
+    def _create_message_update(user_id, **fields):
+        update_id = next(update_ids)
+        return types.Update(
+            update_id=update_id,
+            message={
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+                **fields,
+            },
+        )
+
+    return _create_message_update
+
+
+@pytest.fixture
+def create_document_update(create_message_update):
+    file_ids = count(1)
+
+    def _create_document_update(user_id, media_group_id=None):
+        file_id = next(file_ids)
+        fields = {
+            "document": {
+                "file_id": f"file_id{file_id}",
+                "file_unique_id": f"unique{file_id}",
+                "file_name": f"file{file_id}.txt",
+            }
+        }
+        if media_group_id is not None:
+            fields["media_group_id"] = media_group_id
+        return create_message_update(user_id, **fields)
+
+    return _create_document_update
+
+
+@pytest.fixture
+def create_callback_update():
+    update_ids = count(1)
+
+    def _create_callback_update(user_id, data):
+        update_id = next(update_ids)
+        return types.Update(
+            update_id=update_id,
+            callback_query={
+                "id": str(update_id),
+                "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+                "chat_instance": str(user_id),
+                "message": {
+                    "message_id": update_id,
+                    "date": 0,
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "",
+                },
+                "data": data,
+            },
+        )
+
+    return _create_callback_update
@@ -0,0 +1,65 @@
+import asyncio
+from typing import NamedTuple, Optional
+
+from filogram.albums import AlbumCollector
+
+
+class MessageModel(NamedTuple):
+    message_id: int
+    media_group_id: Optional[str]
+
+
+def collect_all(collector, messages, delays=None):
+    async def send(message, delay):
+        await asyncio.sleep(delay)
+        return await collector.collect(message)
+
+    async def run():
+        return await asyncio.gather(
+            *(
+                send(message, delay)
+                for (message, delay) in zip(
+                    messages, delays or [0] * len(messages)
+                )
+            )
+        )
+
+    return asyncio.run(run())
+
+
+def test_album_collected_by_first_message():
+    collector = AlbumCollector(debounce=0.01)
+    messages = [MessageModel(i, "album") for i in range(5)]
+
+    results = collect_all(collector, messages)
+
+    assert results[0] == messages
+    assert results[1:] == [None] * 4
+
+
+def test_albums_collected_separately():
+    collector = AlbumCollector(debounce=0.01)
+    first = [MessageModel(1, "first"), MessageModel(3, "first")]
+    second = [MessageModel(2, "second")]
+
+    results = collect_all(collector, [first[0], second[0], first[1]])
+
+    assert results == [first, second, None]
+
+
+def test_late_message_extends_debounce():
+    collector = AlbumCollector(debounce=0.05)
+    messages = [MessageModel(i, "album") for i in range(3)]
+
+    results = collect_all(collector, messages, delays=[0, 0.03, 0.06])
+
+    assert results[0] == messages
+
+
+def test_messages_ordered_by_id():
+    collector = AlbumCollector(debounce=0.01)
+    messages = [MessageModel(2, "album"), MessageModel(1, "album")]
+
+    (album, _) = collect_all(collector, messages)
+
+    assert album == list(reversed(messages))
@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.fake_api import TOKEN
+from filogram import app
+from filogram.config import DevConfig, LazyConfig, config
+
+
+ROOT = Path(__file__).parents[2]
+
+
+def test_import_without_stage(tmp_path):
+    environment = {**os.environ, "PYTHONPATH": str(ROOT)}
+    environment.pop("STAGE", None)
+
+    subprocess.run(
+        [sys.executable, "-c", "import filogram.bot, filogram.cli"],
+        cwd=tmp_path,
+        env=environment,
+        check=True,
+    )
+
+    # ни БД, ни файла лога при импорте не создаётся
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_config_loaded_once():
+    lazy_config = LazyConfig()
+
+    assert isinstance(lazy_config.load("dev"), DevConfig)
+    assert lazy_config.load() is lazy_config.load("dev")
+    with pytest.raises(ValueError):
+        lazy_config.load("prod")
+
+
+def test_unknown_stage_rejected(monkeypatch):
+    monkeypatch.delenv("STAGE", raising=False)
+
+    with pytest.raises(ValueError):
+        LazyConfig().load()
+    with pytest.raises(ValueError):
+        LazyConfig().load("test")
+
+
+def test_create_app_once(monkeypatch):
+    monkeypatch.setattr(app, "_dispatcher", None)
+    monkeypatch.setattr(config, "BOT_TOKEN", TOKEN)
+
+    dp = app.create_app("dev")
+
+    assert app.create_app() is dp
+    assert dp.bot.id == int(TOKEN.split(":")[0])
+    assert dp.message_handlers.handlers
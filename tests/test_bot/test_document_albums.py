@@ -0,0 +1,43 @@
+import asyncio
+
+from filogram import bot
+
+
+def process_concurrently(dp, updates):
+    async def run():
+        await asyncio.gather(*map(dp.process_update, updates))
+
+    asyncio.run(run())
+
+
+def sent_texts(fake_bot):
+    return [
+        params["text"]
+        for (method, params) in fake_bot.calls
+        if method == "sendMessage"
+    ]
+
+
+def test_concurrent_albums_of_user_are_merged(
+    dispatcher, fake_bot, create_document_update, create_user
+):
+    user = create_user(1)
+    # Telegram делит загрузку больше 10 файлов на несколько альбомов
+    updates = [
+        create_document_update(user.id, media_group_id=album)
+        for album in ("first", "second")
+        for _ in range(10)
+    ]
+
+    process_concurrently(dispatcher, updates)
+
+    state = dispatcher.current_state(chat=user.id, user=user.id)
+    upload_state = bot.UploadDocuments.handle_documents_or_category.state
+    assert asyncio.run(state.get_state()) == upload_state
+    documents = asyncio.run(state.get_data())["documents"]
+    assert sorted(document[0] for document in documents) == sorted(
+        update.message.document.file_unique_id for update in updates
+    )
+    texts = sent_texts(fake_bot)
+    assert len(texts) == 2
+    assert "Добавлено к сохранению!" in texts
@@ -0,0 +1,45 @@
+import asyncio
+
+from filogram import bot
+from filogram import file_service
+from filogram import keyboards
+
+
+def process_updates(dp, updates):
+    async def run():
+        # как при поллинге и вебхуке: каждое обновление в своей задаче
+        for update in updates:
+            await asyncio.create_task(dp.process_update(update))
+
+    asyncio.run(run())
+
+
+def test_page_switched_while_documents_pending(
+    dispatcher,
+    fake_bot,
+    create_document_update,
+    create_callback_update,
+    create_unique_file,
+    create_user,
+):
+    user = create_user(1)
+    for _ in range(3):
+        file_service.save_file(create_unique_file(user=user))
+    page_data = keyboards.owned_files_page.new(
+        direction=keyboards.NEXT_PAGE, unique_id=1
+    )
+
+    process_updates(
+        dispatcher,
+        [
+            create_document_update(user.id),
+            create_callback_update(user.id, page_data),
+        ],
+    )
+
+    state = dispatcher.current_state(chat=user.id, user=user.id)
+    upload_state = bot.UploadDocuments.handle_documents_or_category.state
+    assert asyncio.run(state.get_state()) == upload_state
+    assert len(asyncio.run(state.get_data())["documents"]) == 1
+    assert page_data not in file_service.get_user_categories(user.id)
+    assert "editMessageText" in fake_bot.methods()
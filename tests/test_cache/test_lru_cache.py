@@ -0,0 +1,80 @@
+from filogram.cache import LRUCache
+
+
+class FakeTimer:
+    """Управляемые часы для проверки времени жизни записей"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_evicted():
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("first", 1)
+    cache.set("second", 2)
+    cache.get("first")
+
+    cache.set("third", 3)
+
+    assert cache.get("first") == 1
+    assert cache.get("second") is None
+    assert cache.get("third") == 3
+
+
+def test_expired_entry_is_missing():
+    timer = FakeTimer()
+    cache = LRUCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("key", "value")
+
+    timer.now = 11
+
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_hits_and_misses_counted():
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("key", "value")
+
+    cache.get("key")
+    cache.get("key")
+    cache.get("other")
+
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_invalidated_entry_is_missing():
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set("key", "value")
+
+    cache.invalidate("key")
+
+    assert cache.get("key") is None
+
+
+def test_value_read_before_invalidation_not_cached():
+    cache = LRUCache(maxsize=2, ttl=10)
+    generation = cache.generation("key")
+
+    cache.invalidate("key")
+    cache.set("key", "stale", generation)
+
+    assert cache.get("key") is None
+    cache.set("key", "value", cache.generation("key"))
+    assert cache.get("key") == "value"
+
+
+def test_generations_outdated_when_pruned():
+    cache = LRUCache(maxsize=2, ttl=10)
+    generation = cache.generation("key")
+    cache.invalidate("key")
+    cache.invalidate("first")
+
+    # поколения удаляются при переполнении, но взятое поколение устарело
+    cache.invalidate("second")
+    cache.set("key", "stale", generation)
+
+    assert cache.get("key") is None
@@ -0,0 +1,21 @@
+import pytest
+
+from filogram import cli
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        ["--stage=dev", "--use=webhook", "--workers=2"],
+        ["--stage=prod", "--use=polling", "--workers=2"],
+        ["--stage=prod", "--use=webhook", "--workers=0"],
+        ["--stage=prod", "--use=polling", "--fast-ack"],
+        ["--stage=prod", "--use=webhook", "--concurrency=4"],
+        ["--stage=prod", "--use=polling", "--concurrency=0"],
+    ],
+)
+def test_unsupported_options_rejected(monkeypatch, arguments):
+    monkeypatch.setattr("sys.argv", ["bot", *arguments])
+
+    with pytest.raises(SystemExit):
+        cli.cli()
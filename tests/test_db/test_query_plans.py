@@ -0,0 +1,112 @@
+import pytest
+
+from filogram import db
+from filogram import exceptions
+from filogram import file_service
+
+
+@pytest.fixture
+def traced_statements():
+    """Запросы к БД, выполненные во время теста"""
+    statements = []
+    db.set_trace_callback(statements.append)
+    return statements
+
+
+@pytest.fixture
+def saved_files(default_user, create_unique_file):
+    files = []
+    for category in ["books", "audio", "books"]:
+        file = create_unique_file(user=default_user, category=category)
+        file_service.save_file(file)
+        files.append(file)
+
+    return files
+
+
+def get_owned_files(user):
+    list(file_service.get_owned_files(user_id=user.id))
+
+
+def get_owned_files_pages(user):
+    page = file_service.get_owned_files_page(user_id=user.id, size=1)
+    unique_id = page.files[-1].unique_id
+    file_service.get_owned_files_page(user.id, after=unique_id, size=1)
+    file_service.get_owned_files_page(user.id, before=unique_id, size=1)
+
+
+def get_user_categories(user):
+    file_service.get_user_categories(user_id=user.id)
+
+
+def get_category_files(user):
+    list(file_service.get_category_files(category="books", user_id=user.id))
+
+
+def get_file(user):
+    file_service.get_file(unique_id=1, user_id=user.id)
+
+
+def delete_file(user):
+    file_service.delete_file(unique_id=1, user_id=user.id)
+
+
+def delete_category_files(user):
+    file_service.delete_category_files(category="audio", user_id=user.id)
+
+
+def save_files(user):
+    files = [
+        file_service.FileModel("new", "file_id", user.id, "books", "name"),
+        file_service.FileModel("1", "file_id", user.id, "books", "name"),
+    ]
+    file_service.save_files(files)
+
+
+def get_someone_elses_file(user):
+    with pytest.raises(exceptions.IncorrectFileID):
+        file_service.get_file(unique_id=1, user_id=user.id + 1)
+
+
+@pytest.mark.parametrize(
+    "file_service_call",
+    [
+        get_owned_files,
+        get_owned_files_pages,
+        get_user_categories,
+        get_category_files,
+        get_file,
+        delete_file,
+        delete_category_files,
+        save_files,
+        get_someone_elses_file,
+    ],
+)
+def test_file_service_queries_do_not_scan_table(
+    default_user, saved_files, traced_statements, file_service_call
+):
+    traced_statements.clear()
+    file_service_call(default_user)
+
+    queries = [
+        statement
+        for statement in traced_statements
+        if statement.lstrip().upper().startswith(("SELECT", "DELETE"))
+    ]
+    assert queries
+
+    for query in queries:
+        with db.get_read_cursor() as cursor:
+            plan = cursor.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+
+        details = [row["detail"] for row in plan]
+        assert not any(detail.startswith("SCAN files") for detail in details)
+        assert not any("TEMP B-TREE FOR" in detail for detail in details)
+
+
+def test_migrations_set_schema_version():
+    with db.get_read_cursor() as cursor:
+        (version,) = cursor.execute("PRAGMA user_version").fetchone()
+    (last_version, _) = list(db._get_migrations())[-1]
+
+    assert version == last_version
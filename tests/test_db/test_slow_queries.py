@@ -0,0 +1,82 @@
+import pytest
+
+from filogram import db
+from filogram import exceptions
+from filogram import file_service
+from filogram import metrics
+from filogram.config import config
+from filogram.logger import logger
+
+
+@pytest.fixture
+def logged_messages():
+    """Сообщения лога во время теста"""
+    messages = []
+    handler_id = logger.add(messages.append, format="{message}")
+    yield messages
+    logger.remove(handler_id)
+
+
+def test_slow_query_logged_with_plan(monkeypatch, logged_messages):
+    monkeypatch.setattr(config, "SLOW_QUERY_THRESHOLD", 0)
+
+    with pytest.raises(exceptions.NoUserFiles):
+        file_service.get_owned_files(user_id=1)
+
+    (message,) = logged_messages
+    assert "Медленный запрос owned_files" in message
+    assert "строк: 0" in message
+    assert "параметры: owner_id=int" in message
+    assert "USING INDEX files_owner_category_idx" in message
+
+
+def test_fast_query_not_logged(monkeypatch, logged_messages):
+    monkeypatch.setattr(config, "SLOW_QUERY_THRESHOLD", 10)
+
+    file_service.get_user_categories(user_id=1)
+
+    assert logged_messages == []
+
+
+def test_params_described_without_values():
+    params = {"owner_id": 1, "category": "secret", "rows": [{}, {}]}
+
+    assert db.describe_params(params) == (
+        "owner_id=int, category=str[6], rows=list[2]"
+    )
+
+
+def test_sampled_queries_in_rolling_window(monkeypatch):
+    monkeypatch.setattr(config, "QUERY_SAMPLE_RATE", 1.0)
+    query = db.Query("test_sampled_select", "SELECT 1")
+
+    for _ in range(3):
+        db.fetchone(query)
+
+    assert metrics.query_samples.get(0.5, "test_sampled_select") is not None
+    assert "filogram_db_query_sample_seconds_count" in metrics.render()
+
+
+def test_disabled_sampling_skips_random(monkeypatch):
+    def random():
+        raise AssertionError("случайное число при выключенной выборке")
+
+    monkeypatch.setattr(config, "QUERY_SAMPLE_RATE", 0)
+    monkeypatch.setattr(db.random, "random", random)
+    query = db.Query("test_unsampled_select", "SELECT 1")
+
+    db.fetchone(query)
+
+    assert metrics.query_samples.get(0.5, "test_unsampled_select") is None
+
+
+def test_slow_query_logged_without_progress_handler(
+    monkeypatch, logged_messages
+):
+    monkeypatch.setattr(config, "SLOW_QUERY_THRESHOLD", 0)
+    monkeypatch.setattr(config, "QUERY_PROGRESS_STEPS", None)
+
+    file_service.get_user_categories(user_id=1)
+
+    (message,) = logged_messages
+    assert "инструкций sqlite: ?" in message
@@ -0,0 +1,131 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from filogram import db
+from filogram import exceptions
+from filogram import file_service
+from filogram.models import PendingDocument
+
+
+def run_with_queue(write_queue, *operations):
+    async def run():
+        results = asyncio.gather(
+            *(write_queue.submit(*operation) for operation in operations),
+            return_exceptions=True,
+        )
+        await asyncio.sleep(0)
+        await write_queue.close()
+        return await results
+
+    return asyncio.run(run())
+
+
+def test_concurrent_writes_committed_in_one_batch(
+    default_user, create_unique_file
+):
+    write_queue = db.WriteBehindQueue(flush_interval=1, batch_size=3)
+    files = [create_unique_file(user=default_user) for _ in range(3)]
+
+    run_with_queue(write_queue, *((file_service.save_file, f) for f in files))
+
+    assert write_queue.batches == 1
+    assert list(file_service.get_owned_files(default_user.id)) == files
+
+
+def test_error_reaches_only_its_caller(default_file, create_unique_file):
+    file_service.save_file(default_file)
+    new_file = create_unique_file()
+    write_queue = db.WriteBehindQueue(flush_interval=1, batch_size=2)
+
+    (duplicate_result, new_result) = run_with_queue(
+        write_queue,
+        (file_service.save_file, default_file),
+        (file_service.save_file, new_file),
+    )
+
+    assert isinstance(duplicate_result, exceptions.FileAlreadyExists)
+    assert new_result is None
+    assert new_file in file_service.get_owned_files(new_file.owner_id)
+
+
+def test_close_flushes_pending_writes(default_user, create_unique_file):
+    write_queue = db.WriteBehindQueue(flush_interval=60, batch_size=100)
+    file = create_unique_file(user=default_user)
+
+    run_with_queue(write_queue, (file_service.save_file, file))
+
+    assert list(file_service.get_owned_files(default_user.id)) == [file]
+
+
+def test_cache_invalidated_after_batch_commit(
+    default_user, create_unique_file
+):
+    file_service.get_user_categories(default_user.id)
+    file = create_unique_file(user=default_user, category="books")
+    write_queue = db.WriteBehindQueue(flush_interval=1, batch_size=1)
+
+    run_with_queue(write_queue, (file_service.save_file, file))
+
+    assert file_service.get_user_categories(default_user.id) == ["books"]
+
+
+def test_failed_operation_rolled_back_alone(default_user, create_unique_file):
+    file = create_unique_file(user=default_user)
+
+    def save_and_fail():
+        file_service.save_file(file)
+        raise RuntimeError
+
+    other_file = create_unique_file(user=default_user)
+    write_queue = db.WriteBehindQueue(flush_interval=1, batch_size=2)
+
+    (failed, saved) = run_with_queue(
+        write_queue, (save_and_fail,), (file_service.save_file, other_file)
+    )
+
+    assert isinstance(failed, RuntimeError)
+    assert saved is None
+    assert list(file_service.get_owned_files(default_user.id)) == [other_file]
+
+
+def test_async_document_save_goes_through_queue(default_user, monkeypatch):
+    write_queue = db.WriteBehindQueue(flush_interval=1, batch_size=1)
+    monkeypatch.setattr(file_service, "write_queue", write_queue)
+    document = PendingDocument("unique", "file_id", "file.txt")
+
+    async def run():
+        await file_service.asave_telegram_document(
+            document, default_user.id, "books"
+        )
+        await write_queue.close()
+
+    asyncio.run(run())
+
+    assert write_queue.batches == 1
+    assert file_service.get_user_categories(default_user.id) == ["books"]
+
+
+def test_commit_error_reaches_every_caller(
+    default_user, create_unique_file, monkeypatch
+):
+    commit = db._commit
+
+    def fail_commit(depth):
+        if depth == 0:
+            raise sqlite3.OperationalError("disk I/O error")
+        commit(depth)
+
+    monkeypatch.setattr(db, "_commit", fail_commit)
+    files = [create_unique_file(user=default_user) for _ in range(3)]
+    write_queue = db.WriteBehindQueue(flush_interval=1, batch_size=3)
+
+    results = run_with_queue(
+        write_queue, *((file_service.save_file, f) for f in files)
+    )
+
+    assert all(isinstance(r, sqlite3.OperationalError) for r in results)
+    monkeypatch.setattr(db, "_commit", commit)
+    with pytest.raises(exceptions.NoUserFiles):
+        file_service.get_owned_files(default_user.id)
@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+from filogram import exceptions
+from filogram import file_service
+
+
+def test_async_save_and_get_owned_files(default_user, create_unique_file):
+    file = create_unique_file(user=default_user)
+
+    async def save_and_get():
+        await file_service.asave_file(file)
+        return list(await file_service.aget_owned_files(default_user.id))
+
+    owned_files = asyncio.run(save_and_get())
+
+    assert owned_files == [file]
+
+
+def test_async_functions_raise_service_exceptions(default_file):
+    file_service.save_file(default_file)
+
+    with pytest.raises(exceptions.FileAlreadyExists):
+        asyncio.run(file_service.asave_file(default_file))
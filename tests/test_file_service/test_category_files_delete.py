@@ -58,3 +58,15 @@ def test_deletion_not_affects_on_other_users(
         file_service.get_owned_files(user_id=second_user.id)
     )
     assert second_user_files_before == second_user_files_after
+
+
+def test_cannot_delete_non_existing_category(
+    default_user, create_unique_file
+):
+    file = create_unique_file(user=default_user, category="books")
+    file_service.save_file(file)
+
+    with pytest.raises(exceptions.NoCategoryFiles):
+        file_service.delete_category_files(
+            category="films", user_id=default_user.id
+        )
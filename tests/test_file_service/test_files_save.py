@@ -0,0 +1,41 @@
+from filogram import file_service
+
+
+def test_correct_save_files(default_user, create_unique_file):
+    files = [create_unique_file(user=default_user) for _ in range(3)]
+
+    results = file_service.save_files(files)
+
+    assert [result.file for result in results] == files
+    assert all(result.saved for result in results)
+    assert list(file_service.get_owned_files(default_user.id)) == files
+
+
+def test_save_files_reports_already_saved_files(create_unique_file):
+    saved_file = create_unique_file()
+    file_service.save_file(saved_file)
+    new_file = create_unique_file()
+
+    results = file_service.save_files([saved_file, new_file])
+
+    assert [result.saved for result in results] == [False, True]
+
+
+def test_save_files_skips_repeated_files(default_file):
+    results = file_service.save_files([default_file, default_file])
+
+    assert [result.saved for result in results] == [True, False]
+
+
+def test_save_telegram_documents(
+    default_user, default_category, create_unique_document
+):
+    documents = [create_unique_document() for _ in range(2)]
+
+    results = file_service.save_telegram_documents(
+        documents, user_id=default_user.id, category=default_category
+    )
+
+    assert all(result.saved for result in results)
+    files = file_service.get_category_files(default_category, default_user.id)
+    assert len(list(files)) == 2
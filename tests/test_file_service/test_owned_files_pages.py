@@ -0,0 +1,127 @@
+import pytest
+
+from filogram import exceptions
+from filogram import file_service
+from filogram import templates
+from filogram.config import config
+
+
+@pytest.fixture
+def saved_files(default_user, create_unique_file):
+    for category in ["books", "audio", "texts", "audio", "books"]:
+        file = create_unique_file(user=default_user, category=category)
+        file_service.save_file(file)
+
+    # файлы из БД с `unique_id`, отсортированные по категории
+    return list(file_service.get_owned_files(default_user.id))
+
+
+def test_first_page(default_user, saved_files):
+    page = file_service.get_owned_files_page(default_user.id, size=2)
+
+    assert list(page.files) == saved_files[:2]
+    assert not page.has_previous
+    assert page.has_next
+
+
+def test_page_after_last_file(default_user, saved_files):
+    first_page = file_service.get_owned_files_page(default_user.id, size=2)
+
+    page = file_service.get_owned_files_page(
+        default_user.id, after=first_page.files[-1].unique_id, size=2
+    )
+
+    assert list(page.files) == saved_files[2:4]
+    assert page.has_previous
+    assert page.has_next
+
+
+def test_last_page(default_user, saved_files):
+    page = file_service.get_owned_files_page(
+        default_user.id, after=saved_files[3].unique_id, size=2
+    )
+
+    assert list(page.files) == saved_files[4:]
+    assert page.has_previous
+    assert not page.has_next
+
+
+def test_page_before_first_file(default_user, saved_files):
+    last_page = file_service.get_owned_files_page(
+        default_user.id, after=saved_files[3].unique_id, size=2
+    )
+
+    page = file_service.get_owned_files_page(
+        default_user.id, before=last_page.files[0].unique_id, size=2
+    )
+
+    assert list(page.files) == saved_files[2:4]
+    assert page.has_previous
+    assert page.has_next
+
+
+def test_deleted_page_key_leads_to_first_page(default_user, saved_files):
+    page = file_service.get_owned_files_page(default_user.id, size=2)
+    file_service.delete_file(page.files[-1].unique_id, default_user.id)
+
+    page = file_service.get_owned_files_page(
+        default_user.id, after=page.files[-1].unique_id, size=2
+    )
+
+    assert not page.has_previous
+
+
+def test_cannot_page_someone_elses_files(
+    create_unique_user, default_user, saved_files
+):
+    user = create_unique_user()
+
+    with pytest.raises(exceptions.NoUserFiles):
+        file_service.get_owned_files_page(
+            user.id, after=saved_files[0].unique_id
+        )
+
+
+def save_long_named_files(user, count):
+    files = [
+        file_service.FileModel(
+            f"long{i}", f"file_id{i}", user.id, f"{i}" * 300, f"{i}" * 250
+        )
+        for i in range(count)
+    ]
+    file_service.save_files(files)
+    return list(file_service.get_owned_files(user.id))
+
+
+def get_page_text(page):
+    grouped_files = file_service.group_files_by_category(page.files)
+    return templates.generate_grouped_files_text(grouped_files)
+
+
+def test_page_with_long_names_fits_in_message(default_user):
+    save_long_named_files(default_user, 10)
+
+    page = file_service.get_owned_files_page(default_user.id)
+
+    assert len(page.files) == 10
+    assert len(get_page_text(page)) <= config.MESSAGE_MAX_LENGTH
+
+
+def test_page_shortened_to_fit_in_message(default_user, monkeypatch):
+    monkeypatch.setattr(config, "MESSAGE_MAX_LENGTH", 1000)
+    files = save_long_named_files(default_user, 10)
+
+    pages = [file_service.get_owned_files_page(default_user.id)]
+    while pages[-1].has_next:
+        after = pages[-1].files[-1].unique_id
+        pages.append(
+            file_service.get_owned_files_page(default_user.id, after=after)
+        )
+    previous_page = file_service.get_owned_files_page(
+        default_user.id, before=pages[-1].files[0].unique_id
+    )
+
+    assert len(pages) > 1
+    assert all(len(get_page_text(page)) <= 1000 for page in pages)
+    assert [file for page in pages for file in page.files] == files
+    assert previous_page.files[-1] == pages[-2].files[-1]
@@ -1,4 +1,7 @@
+import json
+
 from filogram import file_service
+from filogram.models import PendingDocument
 
 
 def test_convert_teleram_document_to_file_model(
@@ -34,3 +37,17 @@ def test_save_telegram_document(
     assert file.file_name == default_document.file_name
     assert file.owner_id == default_user.id
     assert file.category == default_category
+
+
+def test_pending_document_restored_after_json(default_document, default_user):
+    document = PendingDocument.from_telegram_document(default_document)
+    restored = PendingDocument._make(json.loads(json.dumps(document)))
+
+    file = file_service.FileModel.from_telegram_document(
+        restored, owner_id=default_user.id, category="category"
+    )
+
+    assert restored == document
+    assert file.file_unique_id == default_document.file_unique_id
+    assert file.file_id == default_document.file_id
+    assert file.file_name == default_document.file_name
@@ -1,3 +1,6 @@
+import threading
+
+from filogram import db
 from filogram import file_service
 
 
@@ -42,3 +45,66 @@ def test_no_someone_elses_categories(create_unique_user, create_unique_file):
 
     assert all(c in user_categories for c in first_user_categories)
     assert all(c not in user_categories for c in second_user_categories)
+
+
+def test_categories_are_cached(default_user, create_unique_file):
+    file = create_unique_file(user=default_user, category="photos")
+    file_service.save_file(file)
+
+    file_service.get_user_categories(user_id=default_user.id)
+    user_categories = file_service.get_user_categories(user_id=default_user.id)
+
+    assert user_categories == ["photos"]
+    assert file_service.categories_cache.hits == 1
+    assert file_service.categories_cache.misses == 1
+
+
+def test_categories_cache_invalidated_on_save(
+    default_user, create_unique_file
+):
+    file_service.get_user_categories(user_id=default_user.id)
+
+    file = create_unique_file(user=default_user, category="photos")
+    file_service.save_file(file)
+    other_file = create_unique_file(user=default_user, category="videos")
+    file_service.save_files([other_file])
+
+    user_categories = file_service.get_user_categories(user_id=default_user.id)
+    assert user_categories == ["photos", "videos"]
+
+
+def test_categories_cache_invalidated_on_delete(
+    default_user, create_unique_file, get_file_unique_id
+):
+    for category in ["photos", "videos", "games"]:
+        file = create_unique_file(user=default_user, category=category)
+        file_service.save_file(file)
+    file_service.get_user_categories(user_id=default_user.id)
+
+    file_service.delete_category_files("photos", user_id=default_user.id)
+    file_service.delete_file(unique_id=2, user_id=default_user.id)
+
+    user_categories = file_service.get_user_categories(user_id=default_user.id)
+    assert user_categories == ["games"]
+
+
+def test_categories_read_during_save_not_cached(
+    default_user, create_unique_file, monkeypatch
+):
+    fetchall = db.fetchall
+
+    def fetchall_during_save(*args, **kwargs):
+        rows = fetchall(*args, **kwargs)
+        # файл сохраняется другим потоком, пока результат не закэширован
+        file = create_unique_file(user=default_user, category="photos")
+        thread = threading.Thread(target=file_service.save_file, args=(file,))
+        thread.start()
+        thread.join()
+        return rows
+
+    monkeypatch.setattr(db, "fetchall", fetchall_during_save)
+    assert file_service.get_user_categories(user_id=default_user.id) == []
+    monkeypatch.setattr(db, "fetchall", fetchall)
+
+    user_categories = file_service.get_user_categories(user_id=default_user.id)
+    assert user_categories == ["photos"]
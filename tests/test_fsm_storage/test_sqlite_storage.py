@@ -0,0 +1,159 @@
+import asyncio
+
+from filogram import db
+from filogram.fsm_storage import SQLiteStorage
+
+
+CHAT = 1
+USER = 2
+
+
+def run_with_storage(coroutine_function, **storage_kwargs):
+    async def run():
+        storage = SQLiteStorage(**storage_kwargs)
+        try:
+            return await coroutine_function(storage)
+        finally:
+            await storage.close()
+            await storage.wait_closed()
+
+    return asyncio.run(run())
+
+
+def count_stored_states():
+    with db.get_read_cursor() as cursor:
+        (count,) = cursor.execute("SELECT COUNT(*) FROM fsm_states").fetchone()
+    return count
+
+
+def test_state_and_data_are_stored():
+    async def scenario(storage):
+        await storage.set_state(chat=CHAT, user=USER, state="Upload:start")
+        await storage.update_data(chat=CHAT, user=USER, documents=[{"a": 1}])
+        await storage.update_data(chat=CHAT, user=USER, category="books")
+        return (
+            await storage.get_state(chat=CHAT, user=USER),
+            await storage.get_data(chat=CHAT, user=USER),
+        )
+
+    state, data = run_with_storage(scenario)
+
+    assert state == "Upload:start"
+    assert data == {"documents": [{"a": 1}], "category": "books"}
+
+
+def test_unknown_user_has_default_state_and_empty_data():
+    async def scenario(storage):
+        return (
+            await storage.get_state(chat=CHAT, user=USER, default="default"),
+            await storage.get_data(chat=CHAT, user=USER),
+        )
+
+    assert run_with_storage(scenario) == ("default", {})
+
+
+def test_finish_removes_stored_state():
+    async def scenario(storage):
+        await storage.set_state(chat=CHAT, user=USER, state="Upload:start")
+        await storage.update_data(chat=CHAT, user=USER, documents=[])
+        await storage.finish(chat=CHAT, user=USER)
+        return await storage.get_state(chat=CHAT, user=USER)
+
+    assert run_with_storage(scenario) is None
+    assert count_stored_states() == 0
+
+
+def test_empty_state_is_not_stored():
+    async def scenario(storage):
+        await storage.set_state(chat=CHAT, user=USER, state="Upload:start")
+        await storage.set_state(chat=CHAT, user=USER, state=None)
+
+    run_with_storage(scenario)
+
+    assert count_stored_states() == 0
+
+
+def test_sweep_removes_expired_states():
+    async def scenario(storage):
+        await storage.set_state(chat=CHAT, user=USER, state="Upload:start")
+        return await storage.sweep()
+
+    assert run_with_storage(scenario, ttl=-1) == 1
+    assert count_stored_states() == 0
+
+
+def test_sweep_keeps_fresh_states():
+    async def scenario(storage):
+        await storage.set_state(chat=CHAT, user=USER, state="Upload:start")
+        return await storage.sweep()
+
+    assert run_with_storage(scenario, ttl=60) == 0
+    assert count_stored_states() == 1
+
+
+def test_queries_do_not_scan_table():
+    statements = []
+    db.set_trace_callback(statements.append)
+
+    async def scenario(storage):
+        await storage.set_state(chat=CHAT, user=USER, state="Upload:start")
+        await storage.update_data(chat=CHAT, user=USER, documents=[])
+        await storage.get_state(chat=CHAT, user=USER)
+        await storage.get_data(chat=CHAT, user=USER)
+        await storage.sweep()
+        await storage.finish(chat=CHAT, user=USER)
+
+    run_with_storage(scenario)
+
+    queries = [
+        statement
+        for statement in statements
+        if statement.lstrip().upper().startswith(("SELECT", "DELETE"))
+    ]
+    assert queries
+
+    for query in queries:
+        with db.get_read_cursor() as cursor:
+            plan = cursor.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+
+        details = [row["detail"] for row in plan]
+        assert not any(detail.startswith("SCAN fsm") for detail in details)
+
+
+def test_concurrent_additions_to_list_are_kept():
+    def add(storage, values):
+        return storage.add_to_list(
+            chat=CHAT,
+            user=USER,
+            state="Upload:start",
+            key="documents",
+            values=values,
+            limit=5,
+        )
+
+    async def scenario(storage):
+        results = await asyncio.gather(
+            add(storage, [1, 2]), add(storage, [3, 4]), add(storage, [5, 6])
+        )
+        return (results, await storage.get_data(chat=CHAT, user=USER))
+
+    (results, data) = run_with_storage(scenario)
+
+    assert results == [(None, 2), ("Upload:start", 2), ("Upload:start", 1)]
+    assert data == {"documents": [1, 2, 3, 4, 5]}
+
+
+def test_list_not_changed_in_other_state():
+    async def scenario(storage):
+        await storage.set_state(chat=CHAT, user=USER, state="Other:state")
+        result = await storage.add_to_list(
+            chat=CHAT,
+            user=USER,
+            state="Upload:start",
+            key="documents",
+            values=[1],
+            limit=5,
+        )
+        return (result, await storage.get_data(chat=CHAT, user=USER))
+
+    assert run_with_storage(scenario) == (("Other:state", 0), {})
@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+from aiogram import Bot, Dispatcher, types
+import pytest
+
+from benchmarks.fake_api import TOKEN
+from filogram.logger import (
+    RepeatedErrorLimiter,
+    UpdateLogContextMiddleware,
+    format_json,
+    logger,
+)
+
+
+def read_entries(lines):
+    return [json.loads(line) for line in lines]
+
+
+@pytest.fixture
+def log_lines():
+    """Строки лога в формате JSON во время теста"""
+    lines = []
+    handler_id = logger.add(lines.append, format=format_json)
+    yield lines
+    logger.remove(handler_id)
+
+
+def process_updates(handler, texts):
+    async def handle_errors(update, error):
+        logger.opt(exception=error).error("error")
+        return True
+
+    async def run():
+        bot = Bot(TOKEN)
+        dp = Dispatcher(bot)
+        dp.middleware.setup(UpdateLogContextMiddleware())
+        dp.register_message_handler(handler)
+        dp.register_errors_handler(handle_errors)
+        for number, text in enumerate(texts, 1):
+            update = types.Update(
+                update_id=number,
+                message={
+                    "message_id": number,
+                    "date": 0,
+                    "chat": {"id": number * 10, "type": "private"},
+                    "from": {
+                        "id": number * 10,
+                        "is_bot": False,
+                        "first_name": "User",
+                    },
+                    "text": text,
+                },
+            )
+            # как при поллинге и вебхуке: каждое обновление в своей задаче
+            await asyncio.create_task(dp.process_update(update))
+        await (await bot.get_session()).close()
+
+    asyncio.run(run())
+
+
+def test_log_entries_have_update_context(log_lines):
+    async def log_text(message):
+        logger.info(message.text)
+
+    process_updates(log_text, ["first", "second"])
+
+    first, second = read_entries(log_lines)
+    assert first["message"] == "first"
+    assert first["update_id"] == 1
+    assert first["user_id"] == 10
+    assert first["handler"] == "log_text"
+    assert first["elapsed_ms"] >= 0
+    assert (second["update_id"], second["user_id"]) == (2, 20)
+
+
+def test_handler_error_logged_with_context(log_lines):
+    async def fail(message):
+        raise ValueError("fail")
+
+    process_updates(fail, ["text"])
+
+    (entry,) = read_entries(log_lines)
+    assert entry["handler"] == "fail"
+    assert entry["update_id"] == 1
+    assert "ValueError: fail" in entry["exception"]
+
+
+def test_log_entry_outside_update_has_no_context(log_lines):
+    logger.info("outside")
+
+    (entry,) = read_entries(log_lines)
+    assert entry["message"] == "outside"
+    assert "update_id" not in entry
+
+
+def raise_error(error):
+    try:
+        raise error
+    except Exception as e:
+        return e
+
+
+def test_repeated_error_logged_once_per_interval():
+    now = 0
+    limiter = RepeatedErrorLimiter(60, 10, timer=lambda: now)
+    errors = [raise_error(ValueError(number)) for number in range(4)]
+
+    first = limiter.acquire(errors[0])
+    repeated = [limiter.acquire(error) for error in errors[1:3]]
+    now = 61
+    after_interval = limiter.acquire(errors[3])
+
+    assert first == 0
+    assert repeated == [None, None]
+    assert after_interval == 2
+
+
+def test_errors_from_different_places_logged_separately():
+    limiter = RepeatedErrorLimiter(60, 10)
+
+    assert limiter.acquire(raise_error(ValueError())) == 0
+    assert limiter.acquire(raise_error(KeyError())) == 0
+    assert limiter.acquire(ZeroDivisionError()) == 0
+
+
+def test_least_recent_error_location_forgotten():
+    limiter = RepeatedErrorLimiter(60, 1)
+
+    limiter.acquire(raise_error(ValueError()))
+    limiter.acquire(raise_error(KeyError()))
+
+    assert limiter.acquire(raise_error(ValueError())) == 0
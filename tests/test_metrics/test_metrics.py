@@ -0,0 +1,104 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.fake_api import TOKEN
+from filogram import db
+from filogram import file_service
+from filogram import metrics
+from filogram.config import config
+
+
+def create_update(number, text):
+    return types.Update(
+        update_id=number,
+        message={
+            "message_id": number,
+            "date": 0,
+            "chat": {"id": number, "type": "private"},
+            "from": {"id": number, "is_bot": False, "first_name": "User"},
+            "text": text,
+        },
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Тест", ("name",), (1, 5))
+    for value in (0.5, 2, 3, 10):
+        histogram.observe(value, "a")
+
+    lines = list(histogram.collect())
+
+    assert lines[2:] == [
+        'test_seconds_bucket{name="a",le="1.0"} 1',
+        'test_seconds_bucket{name="a",le="5.0"} 3',
+        'test_seconds_bucket{name="a",le="+Inf"} 4',
+        'test_seconds_sum{name="a"} 15.5',
+        'test_seconds_count{name="a"} 4',
+    ]
+
+
+def test_counter_label_values_escaped():
+    counter = metrics.Counter("test_total", "Тест", ("name",))
+    counter.inc('a"b\\c')
+    counter.inc('a"b\\c', amount=2)
+
+    assert list(counter.collect())[2] == 'test_total{name="a\\"b\\\\c"} 3'
+
+
+def test_middleware_counts_handler_outcomes():
+    async def metrics_ok(message):
+        pass
+
+    async def metrics_fail(message):
+        raise ValueError("fail")
+
+    async def handle_errors(update, error):
+        return True
+
+    async def run():
+        bot = Bot(TOKEN)
+        dp = Dispatcher(bot)
+        dp.middleware.setup(metrics.MetricsMiddleware())
+        dp.register_message_handler(metrics_ok, text="ok")
+        dp.register_message_handler(metrics_fail, text="fail")
+        dp.register_errors_handler(handle_errors)
+        for number, text in enumerate(["ok", "ok", "fail", "other"], 1):
+            await dp.process_update(create_update(number, text))
+        await (await bot.get_session()).close()
+
+    unhandled = metrics.unhandled_updates.get("message")
+    asyncio.run(run())
+
+    assert metrics.handler_calls.get("metrics_ok", "ok") == 2
+    assert metrics.handler_calls.get("metrics_fail", "error") == 1
+    assert metrics.handler_seconds.count("metrics_ok") == 2
+    assert metrics.unhandled_updates.get("message") == unhandled + 1
+
+
+def test_query_rows_counted_by_query_name():
+    query = db.Query("test_metrics_select", "SELECT 1 UNION SELECT 2")
+
+    db.fetchall(query)
+    db.fetchone(query)
+
+    assert metrics.query_rows.get("test_metrics_select") == 3
+    assert metrics.query_seconds.count("test_metrics_select") == 2
+
+
+def test_metrics_endpoint_returns_text_format():
+    file_service.get_user_categories(1)
+    file_service.get_user_categories(1)
+
+    async def run():
+        async with TestClient(TestServer(metrics.create_app())) as client:
+            response = await client.get(config.METRICS_PATH)
+            return (response.headers["Content-Type"], await response.text())
+
+    content_type, text = asyncio.run(run())
+
+    assert content_type == metrics.CONTENT_TYPE
+    assert 'filogram_cache_hits_total{cache="categories"} 1' in text
+    assert 'filogram_cache_misses_total{cache="categories"} 1' in text
+    assert 'filogram_db_query_seconds_count{query="user_categories"}' in text
@@ -0,0 +1,256 @@
+import asyncio
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.webhook import SendMessage
+import aiohttp
+import pytest
+
+from benchmarks.fake_api import FakeBotAPI
+from filogram import metrics
+from filogram import polling
+from filogram.albums import AlbumCollector
+from filogram.polling import ShardedUpdateRunner, get_shard_key
+
+
+def create_update(number, user_id, text="text", media_group_id=None):
+    message = {
+        "message_id": number,
+        "date": 0,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+        "text": text,
+    }
+    if media_group_id is not None:
+        message["media_group_id"] = media_group_id
+    return {"update_id": number, "message": message}
+
+
+def run_updates(handler, updates, shards=4, poll=False):
+    """Обработка обновлений, возвращаем сервер API и метрики очередей"""
+
+    async def run():
+        api = FakeBotAPI()
+        await api.start()
+        bot = api.create_bot()
+        dp = Dispatcher(bot)
+        dp.register_message_handler(handler)
+        runner = ShardedUpdateRunner(dp, shards)
+        runner.start()
+        try:
+            if poll:
+                api.add_updates(updates)
+                polling = asyncio.create_task(runner.poll(timeout=1))
+                while api.updates:
+                    await asyncio.sleep(0.01)
+                polling.cancel()
+            else:
+                for update in updates:
+                    await runner.put(types.Update(**update))
+            await runner.close()
+        finally:
+            await (await bot.get_session()).close()
+            await api.close()
+
+        return (api, runner.stats())
+
+    return asyncio.run(run())
+
+
+def test_shard_key_is_sender_id():
+    update = types.Update(**create_update(1, user_id=42))
+    callback = types.Update(
+        update_id=2,
+        callback_query={
+            "id": "1",
+            "from": {"id": 43, "is_bot": False, "first_name": "User"},
+            "chat_instance": "1",
+        },
+    )
+
+    assert get_shard_key(update) == 42
+    assert get_shard_key(callback) == 43
+
+
+def test_user_updates_processed_in_order():
+    processed = []
+
+    async def handler(message):
+        # более ранние обновления обрабатываются дольше
+        await asyncio.sleep(0.01 * (5 - message.message_id % 5))
+        processed.append(message.message_id)
+
+    run_updates(handler, [create_update(i, user_id=1) for i in range(1, 6)])
+
+    assert processed == [1, 2, 3, 4, 5]
+
+
+def test_different_users_processed_in_parallel():
+    running = 0
+    max_running = 0
+
+    async def handler(message):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    run_updates(
+        handler,
+        [create_update(i, user_id=i) for i in range(1, 9)],
+        shards=4,
+    )
+
+    assert max_running == 4
+
+
+def test_album_collected_before_next_user_update():
+    albums = AlbumCollector(debounce=0.01)
+    processed = []
+
+    async def handler(message):
+        if message.media_group_id is None:
+            processed.append(message.message_id)
+            return
+        messages = await albums.collect(message)
+        if messages is not None:
+            processed.append([m.message_id for m in messages])
+
+    updates = [
+        *(create_update(i, 1, media_group_id="album") for i in range(1, 4)),
+        create_update(4, user_id=1),
+    ]
+    run_updates(handler, updates)
+
+    assert processed == [[1, 2, 3], 4]
+
+
+def test_other_user_update_does_not_split_album():
+    albums = AlbumCollector(debounce=0.05)
+    processed = []
+
+    async def handler(message):
+        if message.media_group_id is None:
+            processed.append(message.message_id)
+            return
+        messages = await albums.collect(message)
+        if messages is not None:
+            processed.append([m.message_id for m in messages])
+
+    updates = [
+        create_update(1, 1, media_group_id="album"),
+        create_update(2, 1, media_group_id="album"),
+        create_update(3, user_id=2),
+        create_update(4, 1, media_group_id="album"),
+        create_update(5, user_id=1),
+    ]
+    run_updates(handler, updates, shards=1)
+
+    assert processed == [3, [1, 2, 4], 5]
+
+
+def test_handler_response_sent():
+    async def reply(message):
+        return SendMessage(message.chat.id, "reply")
+
+    api, _ = run_updates(reply, [create_update(1, user_id=1)])
+
+    assert api.methods() == ["sendMessage"]
+
+
+def test_polled_updates_processed():
+    async def reply(message):
+        return SendMessage(message.chat.id, "reply")
+
+    api, stats = run_updates(
+        reply, [create_update(i, user_id=i) for i in range(1, 11)], poll=True
+    )
+
+    assert api.methods().count("sendMessage") == 10
+    assert sum(shard["processed"] for shard in stats) == 10
+    assert all(shard["depth"] == 0 for shard in stats)
+
+
+def test_failed_update_counted():
+    async def fail(message):
+        raise ValueError("fail")
+
+    _, stats = run_updates(fail, [create_update(1, user_id=1)], shards=1)
+
+    assert stats == [
+        {
+            "depth": 0,
+            "lag": 0,
+            "lag_avg": stats[0]["lag_avg"],
+            "lag_max": stats[0]["lag_max"],
+            "processed": 0,
+            "failed": 1,
+        }
+    ]
+
+
+def test_queue_depth_and_lag_exported_in_metrics(fake_bot):
+    async def run():
+        release = asyncio.Event()
+
+        async def wait(message):
+            await release.wait()
+
+        dp = Dispatcher(fake_bot)
+        dp.register_message_handler(wait)
+        runner = ShardedUpdateRunner(dp, shards=2)
+        metrics.register_polling_runner(runner)
+        runner.start()
+        for number in range(1, 4):
+            await runner.put(types.Update(**create_update(number, user_id=1)))
+        await asyncio.sleep(0)
+        text = metrics.render()
+        release.set()
+        await runner.close()
+        return text
+
+    text = asyncio.run(run())
+
+    assert 'filogram_polling_queue_depth{shard="0"} 0' in text
+    assert 'filogram_polling_queue_depth{shard="1"} 2' in text
+    assert 'filogram_polling_queue_lag_seconds{shard="1"}' in text
+
+
+@pytest.mark.parametrize(
+    "error", [aiohttp.ClientError(), asyncio.TimeoutError(), ValueError()]
+)
+def test_polling_recovers_after_error(error, fake_bot, monkeypatch):
+    monkeypatch.setattr(polling, "POLLING_ERROR_DELAY", 0)
+    processed = []
+    offsets = []
+    responses = [error, [types.Update(**create_update(1, user_id=1))]]
+
+    async def get_updates(offset=None, **kwargs):
+        offsets.append(offset)
+        if not responses:
+            await asyncio.Event().wait()
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def handler(message):
+        processed.append(message.message_id)
+
+    monkeypatch.setattr(fake_bot, "get_updates", get_updates)
+
+    async def run():
+        dp = Dispatcher(fake_bot)
+        dp.register_message_handler(handler)
+        runner = ShardedUpdateRunner(dp, shards=1)
+        runner.start()
+        polling_task = asyncio.create_task(runner.poll())
+        while len(offsets) < 3 and not polling_task.done():
+            await asyncio.sleep(0.01)
+        polling_task.cancel()
+        await runner.close()
+
+    asyncio.run(run())
+
+    assert processed == [1]
+    assert offsets == [None, None, 2]
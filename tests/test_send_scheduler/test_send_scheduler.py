@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from aiogram.utils.exceptions import RetryAfter
+import pytest
+
+from benchmarks.fake_api import FakeBotAPI
+from filogram import metrics
+from filogram import send_scheduler
+from filogram.send_scheduler import SchedulingBot, SendScheduler
+
+
+def create_scheduler(**kwargs):
+    limits = {
+        "global_rate": 1000,
+        "global_burst": 1000,
+        "chat_rate": 1000,
+        "chat_burst": 1000,
+        "max_retries": 2,
+    }
+    return SendScheduler(**{**limits, **kwargs})
+
+
+def test_interactive_requests_sent_before_bulk():
+    scheduler = create_scheduler(global_rate=50, global_burst=1)
+    sent = []
+
+    async def send(name, chat_id, is_bulk=False):
+        async def call():
+            sent.append(name)
+
+        if is_bulk:
+            with send_scheduler.bulk():
+                await scheduler.run(chat_id, call)
+        else:
+            await scheduler.run(chat_id, call)
+
+    async def run():
+        bulk_sends = [
+            asyncio.create_task(send(f"bulk{i}", i, is_bulk=True))
+            for i in range(4)
+        ]
+        await asyncio.sleep(0)
+        depth = scheduler.queue_depth()
+        await asyncio.gather(send("reply", 100), *bulk_sends)
+        return depth
+
+    depth = asyncio.run(run())
+
+    assert depth == {"interactive": 0, "bulk": 3}
+    assert sent[:2] == ["bulk0", "reply"]
+    assert scheduler.queue_depth() == {"interactive": 0, "bulk": 0}
+
+
+def test_requests_to_one_chat_limited():
+    scheduler = create_scheduler(chat_rate=20, chat_burst=1)
+
+    async def call():
+        return time.perf_counter()
+
+    async def run():
+        return await asyncio.gather(
+            *(scheduler.run(1, call) for _ in range(3)), scheduler.run(2, call)
+        )
+
+    (first, second, third, other_chat) = asyncio.run(run())
+
+    assert second - first >= 0.04
+    assert third - second >= 0.04
+    assert other_chat - first < 0.04
+
+
+def test_retry_after_retried():
+    scheduler = create_scheduler()
+    attempts = []
+
+    async def call():
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise RetryAfter(0)
+        return "sent"
+
+    assert asyncio.run(scheduler.run(1, call)) == "sent"
+    assert scheduler.retries == 2
+
+
+def test_queue_depth_and_retries_exported_in_metrics():
+    scheduler = create_scheduler(global_rate=50, global_burst=1)
+    metrics.register_send_scheduler(scheduler)
+    attempts = []
+
+    async def call():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise RetryAfter(0)
+
+    async def send(chat_id):
+        with send_scheduler.bulk():
+            await scheduler.run(chat_id, call)
+
+    async def run():
+        sends = [asyncio.create_task(send(chat_id)) for chat_id in range(3)]
+        await asyncio.sleep(0)
+        text = metrics.render()
+        await asyncio.gather(*sends)
+        return text
+
+    text = asyncio.run(run())
+
+    assert 'filogram_send_queue_depth{priority="bulk"} 2' in text
+    assert 'filogram_send_queue_depth{priority="interactive"} 0' in text
+    assert "filogram_send_retries_total 1" in metrics.render()
+
+
+def test_retry_after_raised_after_max_retries():
+    scheduler = create_scheduler(max_retries=1)
+
+    async def call():
+        raise RetryAfter(0)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(scheduler.run(1, call))
+
+
+def test_bot_retries_flood_responses():
+    async def run():
+        api = FakeBotAPI(flood_responses=1)
+        await api.start()
+        bot = api.create_bot(SchedulingBot, scheduler=create_scheduler())
+        try:
+            await bot.get_me()
+            message = await bot.send_message(1, "text")
+        finally:
+            await (await bot.get_session()).close()
+            await api.close()
+
+        return (api, bot, message)
+
+    (api, bot, message) = asyncio.run(run())
+
+    assert message.text == "text"
+    assert api.methods() == ["getMe", "sendMessage", "sendMessage"]
+    assert bot.scheduler.retries == 1
@@ -0,0 +1,40 @@
+from filogram.send_scheduler import TokenBucket
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_allowed_then_limited():
+    timer = FakeTimer()
+    bucket = TokenBucket(rate=2, capacity=3, timer=timer)
+
+    assert [bucket.try_take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == 0.5
+
+
+def test_tokens_refilled_over_time():
+    timer = FakeTimer()
+    bucket = TokenBucket(rate=2, capacity=3, timer=timer)
+    for _ in range(3):
+        bucket.try_take()
+
+    timer.now = 1.0
+
+    assert [bucket.try_take() for _ in range(3)] == [True, True, False]
+
+
+def test_reservations_wait_in_order():
+    timer = FakeTimer()
+    bucket = TokenBucket(rate=2, capacity=1, timer=timer)
+
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.5, 1.0]
+    assert not bucket.is_full()
+
+    timer.now = 2.0
+
+    assert bucket.is_full()
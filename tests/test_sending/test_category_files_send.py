@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+from aiogram import types
+
+from filogram import file_service
+from filogram import sending
+from filogram import templates
+
+
+def save_category_files(user, category, count):
+    files = [
+        file_service.FileModel(
+            f"{category}{i}", f"file_id{i}", user.id, category, f"name{i}"
+        )
+        for i in range(count)
+    ]
+    file_service.save_files(files)
+    return files
+
+
+def send_category_files(category, user):
+    message = types.Message.to_object(
+        {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": user.id, "type": "private"},
+        }
+    )
+    return asyncio.run(sending.send_category_files(category, user.id, message))
+
+
+def get_albums(fake_bot):
+    return [
+        [media["media"] for media in json.loads(data["media"])]
+        for (method, data) in fake_bot.calls
+        if method == "sendMediaGroup"
+    ]
+
+
+def sent_file_ids(fake_bot):
+    file_ids = []
+    for (method, data) in fake_bot.calls:
+        if method == "sendMediaGroup":
+            media = json.loads(data["media"])
+            file_ids.extend(document["media"] for document in media)
+        elif method == "sendDocument":
+            file_ids.append(data["document"])
+    return file_ids
+
+
+def test_large_category_sent_in_ordered_albums(default_user, fake_bot):
+    files = save_category_files(default_user, "books", 500)
+
+    sent = send_category_files("books", default_user)
+
+    albums = get_albums(fake_bot)
+    assert sent == 500
+    assert len(albums) == 50
+    assert all(len(album) == 10 for album in albums)
+    assert sent_file_ids(fake_bot) == [file.file_id for file in files]
+
+
+def test_albums_sent_while_files_read(default_user, fake_bot, monkeypatch):
+    save_category_files(default_user, "books", 50)
+    events = []
+    iter_chunks = file_service.aiter_category_files_chunks
+    request = fake_bot.request
+
+    async def record_chunks(*args):
+        async for files in iter_chunks(*args):
+            events.append("read")
+            yield files
+
+    async def record_request(method, data=None, *args, **kwargs):
+        events.append(method)
+        return await request(method, data, *args, **kwargs)
+
+    monkeypatch.setattr(
+        file_service, "aiter_category_files_chunks", record_chunks
+    )
+    monkeypatch.setattr(fake_bot, "request", record_request)
+
+    send_category_files("books", default_user)
+
+    # альбомы отправляются без ожидания выбора всех файлов из БД,
+    # а заранее выбирается не больше MEDIA_GROUP_PREFETCH альбомов
+    first_album = events.index("sendMediaGroup")
+    assert events[first_album:].count("read") > 0
+    assert events[:first_album].count("read") <= 3
+
+
+def test_large_category_progress_reported(default_user, fake_bot):
+    save_category_files(default_user, "books", 500)
+
+    send_category_files("books", default_user)
+
+    methods = fake_bot.methods()
+    assert methods[0] == "sendMessage"
+    assert methods.count("editMessageText") == 10
+    (_, last_progress) = [
+        call for call in fake_bot.calls if call[0] == "editMessageText"
+    ][-1]
+    assert last_progress["text"] == templates.SEND_PROGRESS.format(
+        sent=500, total=500
+    )
+
+
+def test_small_category_sent_without_progress(default_user, fake_bot):
+    files = save_category_files(default_user, "books", 15)
+
+    sent = send_category_files("books", default_user)
+
+    assert sent == 15
+    assert fake_bot.methods() == ["sendMediaGroup", "sendMediaGroup"]
+    assert sent_file_ids(fake_bot) == [file.file_id for file in files]
+
+
+def test_last_file_without_album_sent_as_document(default_user, fake_bot):
+    files = save_category_files(default_user, "books", 11)
+
+    sent = send_category_files("books", default_user)
+
+    assert sent == 11
+    assert fake_bot.methods() == ["sendMediaGroup", "sendDocument"]
+    assert sent_file_ids(fake_bot) == [file.file_id for file in files]
+
+
+def test_single_file_sent_as_document(default_user, fake_bot):
+    files = save_category_files(default_user, "books", 1)
+
+    sent = send_category_files("books", default_user)
+
+    assert sent == 1
+    assert fake_bot.methods() == ["sendDocument"]
+    assert sent_file_ids(fake_bot) == [files[0].file_id]
+
+
+def test_empty_category_not_sent(default_user, fake_bot):
+    sent = send_category_files("books", default_user)
+
+    assert sent == 0
+    assert fake_bot.methods() == ["sendMessage"]
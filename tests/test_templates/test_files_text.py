@@ -0,0 +1,20 @@
+from filogram import templates
+from filogram.file_service import FileModel
+
+
+def test_long_names_shortened_in_files_list():
+    file = FileModel("unique", "id", 0, "c" * 300, "n" * 250, unique_id=1)
+
+    text = templates.generate_grouped_files_text({file.category: (file,)})
+
+    assert "c" * 300 not in text
+    assert "n" * 250 not in text
+    assert templates.shorten("n" * 250, max_length=10) == "n" * 9 + "…"
+
+
+def test_file_without_name_listed_by_unique_id():
+    file = FileModel("unique", "id", 0, "c", None, unique_id=1)
+
+    text = templates.generate_grouped_files_text({"c": (file,)})
+
+    assert "`unique`" in text
@@ -0,0 +1,64 @@
+from filogram import templates
+from filogram.file_service import FileModel, SaveResult
+
+
+def create_results(saved, duplicates):
+    return [
+        SaveResult(FileModel(str(i), "id", 0, "c", f"new{i}.txt"), True)
+        for i in range(saved)
+    ] + [
+        SaveResult(FileModel(f"d{i}", "id", 0, "c", f"old{i}.txt"), False)
+        for i in range(duplicates)
+    ]
+
+
+def test_all_files_saved_report():
+    report = templates.generate_save_report(create_results(3, 0))
+
+    assert report == templates.ALL_FILES_SAVED
+
+
+def test_duplicates_listed_in_one_report():
+    report = templates.generate_save_report(create_results(1, 2))
+
+    assert report == templates.ALREADY_SAVED_FILES.format(
+        files="old0.txt\nold1.txt", summary=templates.REST_FILES_SAVED
+    )
+
+
+def test_no_files_saved_report():
+    report = templates.generate_save_report(create_results(0, 2))
+
+    assert report.endswith(templates.NO_FILES_SAVED)
+
+
+def test_duplicate_without_name_listed_by_unique_id():
+    results = [
+        SaveResult(FileModel("unique", "id", 0, "c", None), False),
+        *create_results(1, 0),
+    ]
+
+    report = templates.generate_save_report(results)
+
+    assert report == templates.ALREADY_SAVED_FILES.format(
+        files="unique", summary=templates.REST_FILES_SAVED
+    )
+
+
+def test_short_text_not_split():
+    assert templates.split_text("line\nline", max_length=20) == ["line\nline"]
+
+
+def test_long_text_split_by_lines():
+    lines = [f"file{i:02}.txt" for i in range(10)]
+
+    messages = templates.split_text("\n".join(lines), max_length=30)
+
+    assert all(len(message) <= 30 for message in messages)
+    assert "\n".join(messages).split("\n") == lines
+
+
+def test_long_line_split_into_parts():
+    messages = templates.split_text("x" * 25, max_length=10)
+
+    assert messages == ["x" * 10, "x" * 10, "x" * 5]
@@ -0,0 +1,267 @@
+import asyncio
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, SendMessage
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.fake_api import FakeBotAPI
+from filogram import metrics
+from filogram.config import config
+from filogram.webhook import (
+    FastAckWebhookRequestHandler,
+    UPDATE_QUEUE_KEY,
+    UpdateQueue,
+    wait_response,
+)
+
+
+def create_update(number, text="text"):
+    return {
+        "update_id": number,
+        "message": {
+            "message_id": number,
+            "date": 0,
+            "chat": {"id": number, "type": "private"},
+            "from": {"id": number, "is_bot": False, "first_name": "User"},
+            "text": text,
+        },
+    }
+
+
+def run_with_dispatcher(test, handler, **queue_params):
+    """Запуск `test(api, dp, queue)` с диспетчером из одного обработчика"""
+
+    async def run():
+        api = FakeBotAPI()
+        await api.start()
+        bot = api.create_bot()
+        dp = Dispatcher(bot)
+        dp.register_message_handler(handler)
+        queue = UpdateQueue(**queue_params)
+        try:
+            return await test(api, dp, queue)
+        finally:
+            await queue.close()
+            await (await bot.get_session()).close()
+            await api.close()
+
+    return asyncio.run(run())
+
+
+async def reply(message):
+    return SendMessage(message.chat.id, "reply")
+
+
+def test_handler_response_returned_through_future():
+    async def test(api, dp, queue):
+        await queue.start(dp)
+        future = queue.submit(types.Update(**create_update(1)))
+        return await future
+
+    response = run_with_dispatcher(test, reply)
+
+    assert response.get_response() == {
+        "method": "sendMessage",
+        "chat_id": 1,
+        "text": "reply",
+    }
+
+
+def test_response_sent_through_api_after_future_cancelled():
+    async def test(api, dp, queue):
+        await queue.start(dp)
+        queue.submit(types.Update(**create_update(1))).cancel()
+        await queue.close()
+        return api
+
+    api = run_with_dispatcher(test, reply)
+
+    assert api.methods() == ["sendMessage"]
+
+
+def test_full_queue_rejects_updates():
+    async def test(api, dp, queue):
+        release = asyncio.Event()
+
+        async def wait_release(message):
+            await release.wait()
+
+        dp.message_handlers.handlers.clear()
+        dp.register_message_handler(wait_release)
+        await queue.start(dp)
+        accepted = [
+            queue.submit(types.Update(**create_update(i))) is not None
+            for i in range(4)
+        ]
+        await asyncio.sleep(0)  # обработчик взял первое обновление
+        accepted.append(
+            queue.submit(types.Update(**create_update(4))) is not None
+        )
+        release.set()
+        await queue.close()
+        return (accepted, queue.stats())
+
+    accepted, stats = run_with_dispatcher(test, reply, maxsize=2, workers=1)
+
+    assert accepted == [True, True, False, False, True]
+    assert stats["accepted"] == 3
+    assert stats["rejected"] == 2
+    assert stats["processed"] == 3
+    assert stats["max_depth"] == 2
+    assert stats["depth"] == 0
+
+
+def test_queue_drained_on_close():
+    async def test(api, dp, queue):
+        await queue.start(dp)
+        for i in range(1, 11):
+            queue.submit(types.Update(**create_update(i))).cancel()
+        await queue.close()
+        return (api, queue.stats())
+
+    api, stats = run_with_dispatcher(test, reply, workers=2)
+
+    assert stats["processed"] == 10
+    assert api.methods() == ["sendMessage"] * 10
+
+
+def test_failed_update_does_not_stop_worker():
+    async def fail(message):
+        if message.text == "fail":
+            raise ValueError("fail")
+        return await reply(message)
+
+    async def test(api, dp, queue):
+        await queue.start(dp)
+        failed = queue.submit(types.Update(**create_update(1, "fail")))
+        succeeded = queue.submit(types.Update(**create_update(2)))
+        await queue.close()
+        return (failed.result(), succeeded.result(), queue.stats())
+
+    failed, succeeded, stats = run_with_dispatcher(test, fail, workers=1)
+
+    assert failed is None
+    assert isinstance(succeeded, SendMessage)
+    assert stats["failed"] == 1
+    assert stats["processed"] == 1
+
+
+def post_updates(handler, updates, **queue_params):
+    async def test(api, dp, queue):
+        app = web.Application()
+        app[BOT_DISPATCHER_KEY] = dp
+        app[UPDATE_QUEUE_KEY] = queue
+        app.router.add_route("*", "/webhook", FastAckWebhookRequestHandler)
+        await queue.start(dp)
+        async with TestClient(TestServer(app)) as client:
+            responses = []
+            for update in updates:
+                response = await client.post("/webhook", json=update)
+                responses.append((response.status, await response.text()))
+        return responses
+
+    return run_with_dispatcher(test, handler, **queue_params)
+
+
+def test_webhook_returns_fast_reply_inline():
+    ((status, text),) = post_updates(reply, [create_update(1)])
+
+    assert status == 200
+    assert '"method": "sendMessage"' in text
+
+
+def test_webhook_acknowledges_slow_update_immediately(monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_INLINE_REPLY_TIMEOUT", 0.01)
+
+    async def slow_reply(message):
+        await asyncio.sleep(0.1)
+        return await reply(message)
+
+    ((status, text),) = post_updates(slow_reply, [create_update(1)])
+
+    assert (status, text) == (200, "ok")
+
+
+def test_reply_set_during_timeout_returned_inline(monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_INLINE_REPLY_TIMEOUT", 1)
+
+    async def run():
+        future = asyncio.get_running_loop().create_future()
+
+        async def wait_for(awaitable, timeout):
+            # ответ появляется, пока ожидание отменяется по таймауту
+            awaitable.cancel()
+            future.set_result("reply")
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(asyncio, "wait_for", wait_for)
+        try:
+            return await wait_response(future)
+        finally:
+            monkeypatch.undo()
+
+    assert asyncio.run(run()) == "reply"
+
+
+def test_webhook_rejects_updates_when_queue_full(monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_INLINE_REPLY_TIMEOUT", 0)
+
+    async def slow(message):
+        await asyncio.sleep(0.1)
+
+    responses = post_updates(
+        slow, [create_update(i) for i in range(1, 5)], maxsize=1, workers=1
+    )
+
+    assert [status for status, _ in responses] == [200, 200, 429, 429]
+
+
+def test_updates_of_user_processed_in_order():
+    processed = []
+
+    async def record(message):
+        # первое обновление пользователя обрабатывается дольше второго
+        await asyncio.sleep(0.05 if message.text == "first" else 0)
+        processed.append((message.from_user.id, message.text))
+
+    async def test(api, dp, queue):
+        await queue.start(dp)
+        second = create_update(1, "second")
+        second["update_id"] = 2
+        updates = [create_update(1, "first"), second, create_update(3)]
+        for update in updates:
+            queue.submit(types.Update(**update))
+        await queue.close()
+
+    run_with_dispatcher(test, record, workers=4)
+
+    user_updates = [text for user_id, text in processed if user_id == 1]
+    assert user_updates == ["first", "second"]
+    # другой пользователь не ждёт первого
+    assert processed[0] == (3, "text")
+
+
+def test_queue_metrics_exported_live():
+    async def test(api, dp, queue):
+        release = asyncio.Event()
+
+        async def wait_release(message):
+            await release.wait()
+
+        dp.message_handlers.handlers.clear()
+        dp.register_message_handler(wait_release)
+        await queue.start(dp)
+        for i in range(3):
+            queue.submit(types.Update(**create_update(i)))
+        await asyncio.sleep(0)  # обработчик взял первое обновление
+        exposition = metrics.render()
+        release.set()
+        return exposition
+
+    exposition = run_with_dispatcher(test, reply, maxsize=2, workers=1)
+
+    assert "filogram_webhook_queue_depth 1" in exposition
+    assert "filogram_webhook_queue_accepted_total 2" in exposition
+    assert "filogram_webhook_queue_rejected_total 1" in exposition
+    assert "filogram_webhook_queue_lag_seconds " in exposition
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from aiogram.utils import executor
+from aiohttp import web
+
+from filogram import app
+from filogram import metrics
+from filogram import workers
+from filogram.config import config
+
+
+def test_worker_serves_metrics_on_own_port(monkeypatch):
+    webhook = {}
+    served = {}
+    for name in (
+        "SEND_GLOBAL_RATE",
+        "SEND_GLOBAL_BURST",
+        "CATEGORIES_CACHE_TTL",
+        "LOGS_PATH",
+        "METRICS_PORT",
+    ):
+        monkeypatch.setattr(config, name, getattr(config, name))
+    monkeypatch.setattr(app, "create_app", lambda: "dispatcher")
+    monkeypatch.setattr(metrics, "_constant_labels", {})
+    metrics_port = config.METRICS_PORT
+
+    def set_webhook(**kwargs):
+        webhook.update(kwargs)
+        return SimpleNamespace(web_app=web.Application(), loop=None)
+
+    def serve(web_app, ready, **kwargs):
+        served.update(kwargs)
+
+    monkeypatch.setattr(executor, "set_webhook", set_webhook)
+    monkeypatch.setattr(workers, "serve", serve)
+
+    workers.run_worker(
+        2, 1, None, False, {"webhook_path": "/webhook", "host": "h", "port": 1}
+    )
+
+    assert webhook["dispatcher"] == "dispatcher"
+    assert webhook["webhook_path"] == "/webhook"
+    assert webhook["on_startup"] is workers.on_worker_startup
+    assert config.METRICS_PORT == metrics_port + 1
+    assert metrics.format_labels(("query",), ("q",)) == (
+        '{worker="1",query="q"}'
+    )
+    assert served["host"] == "h"
+    assert served["port"] == 1
+    assert config.LOGS_PATH.name == "log-MainProcess.log"
+
+
+def test_worker_ready_after_socket_opened():
+    ready = threading.Event()
+    ready_on_startup = []
+    web_app = web.Application()
+
+    async def on_startup(web_app):
+        ready_on_startup.append(ready.is_set())
+
+    web_app.on_startup.append(on_startup)
+
+    async def run():
+        runner = web.AppRunner(web_app)
+        try:
+            await workers.start_site(runner, ready, "127.0.0.1", 0)
+            (host, port) = runner.addresses[0]
+            (_, writer) = await asyncio.open_connection(host, port)
+            writer.close()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+    assert ready_on_startup == [False]
+    assert ready.is_set()